@@ -0,0 +1,214 @@
+"""
+Pool of pre-generated assessments, refilled in the background.
+
+Generating an assessment costs minutes of LLM time, so popular subjects are
+served from validated sets stored in the `assessment_sets` table. A subject is
+popular when it is pinned (ASSESSMENT_POOL_SUBJECTS) or was asked for at least
+DEMAND_THRESHOLD times in the last DEMAND_WINDOW; only those are pooled, so a
+typo or a one-off subject costs one generation, not a pool's worth. A daemon
+thread tops each popular subject up to POOL_TARGET sets whenever it drops below
+POOL_LOW_WATER. Sets are retired after MAX_SERVES_PER_SET uses or MAX_SET_AGE,
+and the least-served set is handed out first, so students still see varied
+quizzes.
+"""
+import functools
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+
+from .db import SessionLocal
+from .models import AssessmentSet
+
+POOL_LOW_WATER = int(os.environ.get("ASSESSMENT_POOL_LOW_WATER", "3"))
+POOL_TARGET = int(os.environ.get("ASSESSMENT_POOL_TARGET", "5"))
+MAX_SERVES_PER_SET = int(os.environ.get("ASSESSMENT_POOL_MAX_SERVES", "20"))
+MAX_SET_AGE = timedelta(days=int(os.environ.get("ASSESSMENT_POOL_MAX_AGE_DAYS", "7")))
+MIN_QUESTIONS = 8  # Smaller (e.g. deadline-truncated) sets are served once but never pooled
+REFILL_INTERVAL = 60  # seconds between sweeps for expired sets
+# Requests (hits or misses) within the window that make a subject worth pooling
+DEMAND_THRESHOLD = int(os.environ.get("ASSESSMENT_POOL_DEMAND", "3"))
+DEMAND_WINDOW = float(os.environ.get("ASSESSMENT_POOL_DEMAND_WINDOW_HOURS", "24")) * 3600
+
+
+def normalize_subject(subject: str) -> str:
+    return " ".join(subject.lower().split())
+
+
+class AssessmentPool:
+    def __init__(self, session_factory=SessionLocal, generator=None):
+        self.session_factory = session_factory
+        # Injected so the pool can be driven without a running model
+        self.generator = generator
+        self._pending = set()
+        self._pinned = set()
+        self._demand = {}  # subject -> deque of request times within DEMAND_WINDOW
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _generate(self, subject: str):
+        if self.generator is None:
+            from .chat_ollama import generate_assessment_quiz
+            # Pooled sets exist to add variety, so they never come from the response cache,
+            # and refills run at background priority behind student-facing LLM calls
+            self.generator = functools.partial(generate_assessment_quiz, use_cache=False, priority="background")
+        return self.generator(subject)
+
+    def _fresh_filter(self, query):
+        cutoff = datetime.utcnow() - MAX_SET_AGE
+        return query.filter(
+            AssessmentSet.created_at >= cutoff,
+            AssessmentSet.served_count < MAX_SERVES_PER_SET,
+        )
+
+    def _record_demand(self, key: str):
+        now = time.time()
+        with self._lock:
+            requests = self._demand.setdefault(key, deque())
+            requests.append(now)
+            while requests and requests[0] < now - DEMAND_WINDOW:
+                requests.popleft()
+
+    def is_popular(self, subject: str) -> bool:
+        key = normalize_subject(subject)
+        cutoff = time.time() - DEMAND_WINDOW
+        with self._lock:
+            if key in self._pinned:
+                return True
+            return sum(1 for t in self._demand.get(key, ()) if t >= cutoff) >= DEMAND_THRESHOLD
+
+    def _prune_demand(self):
+        cutoff = time.time() - DEMAND_WINDOW
+        with self._lock:
+            for key in [k for k, requests in self._demand.items() if not requests or requests[-1] < cutoff]:
+                del self._demand[key]
+
+    def take(self, subject: str):
+        """Returns a pooled assessment for the subject, or None on a miss."""
+        key = normalize_subject(subject)
+        self._record_demand(key)
+        db = self.session_factory()
+        try:
+            fresh = self._fresh_filter(db.query(AssessmentSet).filter(AssessmentSet.subject == key))
+            candidates = fresh.order_by(AssessmentSet.served_count.asc()).limit(3).all()
+            remaining = fresh.count()
+            if not candidates:
+                if self.is_popular(key):
+                    self.request_refill(key)
+                return None
+
+            chosen = random.choice(candidates)
+            db.query(AssessmentSet).filter(AssessmentSet.id == chosen.id).update(
+                {AssessmentSet.served_count: AssessmentSet.served_count + 1}
+            )
+            db.commit()
+            questions = list(chosen.questions)
+        finally:
+            db.close()
+
+        if remaining - 1 < POOL_LOW_WATER and self.is_popular(key):
+            self.request_refill(key)
+
+        random.shuffle(questions)
+        return {"questions": questions, "source": "pool"}
+
+    def add(self, subject: str, quiz: dict) -> bool:
+        """Stores a generated assessment if it is complete enough to reuse."""
+        if not quiz or quiz.get("partial") or len(quiz.get("questions", [])) < MIN_QUESTIONS:
+            return False
+        db = self.session_factory()
+        try:
+            db.add(AssessmentSet(subject=normalize_subject(subject), questions=quiz["questions"]))
+            db.commit()
+        finally:
+            db.close()
+        return True
+
+    def pending_refills(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def request_refill(self, subject: str):
+        with self._lock:
+            self._pending.add(normalize_subject(subject))
+        self._wake.set()
+
+    def _retire_stale(self, db):
+        cutoff = datetime.utcnow() - MAX_SET_AGE
+        db.query(AssessmentSet).filter(
+            or_(AssessmentSet.created_at < cutoff, AssessmentSet.served_count >= MAX_SERVES_PER_SET)
+        ).delete(synchronize_session=False)
+        db.commit()
+
+    def fresh_counts(self):
+        db = self.session_factory()
+        try:
+            rows = self._fresh_filter(
+                db.query(AssessmentSet.subject, func.count(AssessmentSet.id))
+            ).group_by(AssessmentSet.subject).all()
+            return dict(rows)
+        finally:
+            db.close()
+
+    def refill(self, subject: str):
+        key = normalize_subject(subject)
+        failures = 0
+        while not self._stop.is_set() and failures < 2:
+            if self.fresh_counts().get(key, 0) >= POOL_TARGET:
+                return
+            if not self.add(key, self._generate(key)):
+                failures += 1
+
+    def run_once(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+
+        db = self.session_factory()
+        try:
+            self._retire_stale(db)
+        finally:
+            db.close()
+
+        # Popular subjects are kept topped up as sets rotate out; the rest are
+        # left to drain, since nobody has asked for them lately
+        self._prune_demand()
+        counts = self.fresh_counts()
+        pending |= {subject for subject, n in counts.items() if n < POOL_LOW_WATER}
+        for subject in pending:
+            if self._stop.is_set():
+                break
+            if not self.is_popular(subject):
+                continue
+            try:
+                self.refill(subject)
+            except Exception as e:
+                print(f"Assessment pool refill failed for '{subject}': {e}")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(REFILL_INTERVAL)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.run_once()
+
+    def start(self, subjects=()):
+        with self._lock:
+            self._pinned |= {normalize_subject(s) for s in subjects}
+        for subject in subjects:
+            self.request_refill(subject)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="assessment-pool", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+assessment_pool = AssessmentPool()
@@ -1,9 +1,99 @@
+"""
+Password hashing and session tokens.
+
+bcrypt is deliberately slow (~250 ms of CPU per call), so login and
+registration hash in a small process pool instead of the request threadpool:
+a burst of logins at the start of a class queues there and cannot starve quiz
+submissions. After login, clients present a signed session token, which is
+checked with one HMAC (microseconds) instead of another bcrypt round.
+
+Tokens are "<base64 claims>.<base64 HMAC-SHA256>". Set SESSION_SECRET so all
+workers (and restarts) accept each other's tokens; without it every process
+makes up its own secret.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "").encode() or secrets.token_bytes(32)
+TOKEN_TTL = int(os.environ.get("SESSION_TTL", str(12 * 3600)))  # seconds
+HASH_WORKERS = int(os.environ.get("AUTH_HASH_WORKERS", "2"))
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
+
+# --- HASHING POOL ---
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+def get_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            # spawn, not fork: the server process already runs threads
+            _hash_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _hash_pool
+
+def shutdown_hash_pool():
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is not None:
+            _hash_pool.shutdown(wait=False, cancel_futures=True)
+            _hash_pool = None
+
+async def verify_password_async(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_pool(), verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_pool(), get_password_hash, password)
+
+# --- SESSION TOKENS ---
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(body: str) -> str:
+    return _b64(hmac.new(SESSION_SECRET, body.encode(), hashlib.sha256).digest())
+
+def create_session_token(user_id: int, role: str, ttl: int = TOKEN_TTL) -> str:
+    claims = {"sub": user_id, "role": role, "exp": int(time.time()) + ttl}
+    body = _b64(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{body}.{_sign(body)}"
+
+def verify_session_token(token: str):
+    """Returns the token's claims, or None if it is malformed, forged or expired."""
+    try:
+        body, signature = token.split(".")
+    except (AttributeError, ValueError):
+        return None
+    # As bytes: compare_digest raises TypeError on str with non-ASCII characters
+    if not hmac.compare_digest(signature.encode(), _sign(body).encode()):
+        return None
+    try:
+        claims = json.loads(_unb64(body))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims
@@ -0,0 +1,53 @@
+"""
+Version counters and conditional GETs for the slowly changing catalogs.
+
+Each catalog has a row in catalog_versions that write endpoints bump in the
+same transaction as their change, so every worker sees the new version as
+soon as the write commits. The version becomes the list endpoint's ETag;
+a client that sends it back in If-None-Match gets an empty 304 and reuses its
+copy, which costs one primary-key lookup instead of loading and serializing
+the whole table.
+"""
+import time
+
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+
+from .models import CatalogVersion
+from .fast_json import FastJSONResponse
+
+CATALOGS = ("topics", "questions", "students")
+
+
+def ensure_versions(db: Session):
+    # Start from a timestamp, not 0, so a recreated database can't reuse ETags clients still hold
+    base = int(time.time() * 1000)
+    existing = {name for (name,) in db.query(CatalogVersion.name)}
+    for name in CATALOGS:
+        if name not in existing:
+            db.add(CatalogVersion(name=name, version=base))
+    db.commit()
+
+
+def bump(db: Session, name: str):
+    """Marks a catalog as changed. The caller commits, together with the change itself."""
+    updated = db.query(CatalogVersion).filter(CatalogVersion.name == name).update(
+        {CatalogVersion.version: CatalogVersion.version + 1}
+    )
+    if not updated:
+        db.add(CatalogVersion(name=name, version=int(time.time() * 1000)))
+
+
+def etag(db: Session, name: str) -> str:
+    version = db.query(CatalogVersion.version).filter(CatalogVersion.name == name).scalar()
+    # Weak: the gzip and brotli encodings of one version carry the same tag
+    return f'W/"{name}-{version or 0}"'
+
+
+def conditional_response(request: Request, db: Session, name: str, build):
+    """304 if the client already has the current version, else build() as JSON with its ETag."""
+    tag = etag(db, name)
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}  # Cache, but always revalidate
+    if tag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(build(), headers=headers)
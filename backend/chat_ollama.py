@@ -1,54 +1,98 @@
-import requests
 import json
+import os
+import queue
+import threading
+import time
 from sqlalchemy.orm import Session
-from .models import Student, StudentTopicState, Event, DriftEvent, Resource
-from .recommender import get_recommendations
+from .context_cache import context_cache
+from .ollama_client import client, get_async_client, OLLAMA_URL
+from . import llm_cache
+from .llm_scheduler import llm_scheduler, SchedulerBusy, Waiter
+from .prompt_builder import PromptBuilder, keyword_overlap, query_words, payload_tokens
+from . import metrics
+from .json_stream import QuestionStreamParser
 
-OLLAMA_URL = "http://localhost:11434/api/chat"
 MODEL = "phi3:mini"
 
-def retrieve_enhanced_context(db: Session, student_id: int):
-    # 1. Weak Topics
-    states = db.query(StudentTopicState).filter(StudentTopicState.student_id == student_id).all()
-    weak_topics = [s.topic.name for s in states if s.mastery_probability < 0.6]
-    
-    # 2. Last 5 Quiz Results
-    last_events = db.query(Event).filter_by(student_id=student_id).order_by(Event.timestamp.desc()).limit(5).all()
-    history_summary = []
-    for e in last_events:
-        res = "Correct" if e.is_correct else "Incorrect"
-        history_summary.append(f"{e.topic.name}: {res}")
-    
-    # 3. Drift Status
-    recent_drift = db.query(DriftEvent).filter_by(student_id=student_id).order_by(DriftEvent.detected_at.desc()).first()
-    drift_status = "Drift Detected Recently" if recent_drift else "Stable"
-    
-    # 4. Top Recommendations
-    recs = get_recommendations(db, student_id)[:3]
-    rec_summary = [f"{r['title']} ({r['reason']})" for r in recs]
-    
-    # 5. Course Content Keywords (Simple Search)
-    # Return basic chunks - in real app use vector DB
-    # We will search for resources matching weak_topics names
-    context_notes = []
-    if weak_topics:
-        # Simple OR search
-        resources = db.query(Resource).filter(Resource.content.contains(weak_topics[0])).limit(2).all()
-        for r in resources:
-            context_notes.append(f"From {r.title}: {r.content[:200]}...")
+# Assessment generation: one LLM call per batch, all batches queue for LLM slots at once.
+# Each batch owns the ID block [i * QUESTIONS_PER_BATCH + 1, (i + 1) * QUESTIONS_PER_BATCH].
+ASSESSMENT_BATCHES = [
+    "Fundamentals, Definitions, and Core Concepts",
+    "Advanced Topics, Edge Cases, and Real-world Applications",
+]
+QUESTIONS_PER_BATCH = 12
+MAX_ASSESSMENT_BATCHES = 6
+ASSESSMENT_DEADLINE = float(os.environ.get("ASSESSMENT_DEADLINE", "300"))  # seconds from the first batch's start
+
+def cache_lookup(payload: dict, call_type: str, use_cache: bool = True):
+    """
+    Returns (key, cacheable, cached content or None) for a generation call.
+    The key also coalesces identical in-flight calls; it is None for calls that
+    must stay non-deterministic. Responses are only cached for the call types
+    in llm_cache.TTLS.
+    """
+    key = llm_cache.cache_key(payload) if use_cache else None
+    cacheable = bool(key) and llm_cache.CACHE_ENABLED and call_type in llm_cache.TTLS
+    return key, cacheable, llm_cache.get_cache().get(key, call_type) if cacheable else None
+
+def ollama_chat(payload: dict, call_type: str, parse=None, use_cache: bool = True, timeout=None, priority: str = None):
+    """
+    Every non-streaming Ollama call goes through here.
+    Responses are cached by content hash (see cache_lookup);
+    `parse` validates the raw content, and only content that parses is cached.
+    Pass use_cache=False for calls that must stay non-deterministic.
+    The call itself waits for a scheduler slot in `priority` (defaults to the call
+    type's class); identical concurrent requests share one call.
+    """
+    key, cacheable, cached = cache_lookup(payload, call_type, use_cache)
+    if cached is not None:
+        return parse(cached) if parse else cached
+
+    content = llm_scheduler.run(
+        priority or call_type,
+        lambda: client.chat(payload, call_type, timeout=timeout)['message']['content'],
+        coalesce_key=key,
+    )
+    # Coalesced callers share `content`, so each parses its own copy
+    result = parse(content) if parse else content
+    if cacheable:
+        llm_cache.get_cache().put(key, call_type, content)
+    return result
+
+def retrieve_enhanced_context(db: Session, student_id: int, message: str = "", builder: PromptBuilder = None):
+    # Weak topics, last 5 results, drift status, top recommendations and course notes,
+    # kept up to date incrementally by the quiz endpoints (see context_cache.py)
+    profile = context_cache.get_profile(db, student_id)
+
+    # Each section is trimmed to its token budget, keeping what's most relevant to the question
+    builder = builder or PromptBuilder()
+    words = query_words(message)
+    n_weak = len(profile['weak_topics'])
+    weak_topics = builder.section(
+        "weak_topics", profile['weak_topics'],
+        # Weakest first, unless the student is asking about a specific topic
+        scores=[keyword_overlap(t, words) * 100 + (n_weak - i) for i, t in enumerate(profile['weak_topics'])],
+    )
+    history = builder.section("history", profile['history'])  # newest first
+    recs = profile['recommendations']
+    recs = builder.section("recommendations", recs, scores=[keyword_overlap(r, words) * 10 - i for i, r in enumerate(recs)])
+    notes = profile['notes']
+    notes = builder.section("notes", notes, scores=[keyword_overlap(n, words) for n in notes])
 
     return f"""
     Student Profile:
     - Weak Topics: {', '.join(weak_topics) if weak_topics else 'None'}
-    - Recent Performance: {'; '.join(history_summary)}
-    - Learning State: {drift_status}
-    - Recommended Next Steps: {'; '.join(rec_summary)}
+    - Recent Performance: {'; '.join(history)}
+    - Learning State: {profile['drift_status']}
+    - Recommended Next Steps: {'; '.join(recs)}
     - Relevant Course Notes:
-      {chr(10).join(context_notes)}
+      {chr(10).join(notes)}
     """
 
-def chat_with_ollama(student_id: int, message: str, db: Session):
-    context = retrieve_enhanced_context(db, student_id)
+def build_tutor_payload(student_id: int, message: str, db: Session, stream: bool = False):
+    builder = PromptBuilder()
+    message = builder.text("message", message)
+    context = retrieve_enhanced_context(db, student_id, message, builder)
     
     system_prompt = f"""You are a helpful AI tutor for a student on the Drift-Aware Learning Platform.
     
@@ -70,19 +114,94 @@ def chat_with_ollama(student_id: int, message: str, db: Session):
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": message}
         ],
-        "stream": False
+        "stream": stream
     }
+    metrics.observe("prompt_tokens.chat", payload_tokens(payload))
+    return payload
 
+def complete_tutor_chat(payload: dict):
     try:
-        response = requests.post(OLLAMA_URL, json=payload, timeout=60)
-        response.raise_for_status()
-        return response.json()['message']['content']
+        return ollama_chat(payload, "chat")
+    except SchedulerBusy:
+        raise
     except Exception as e:
         return f"Error communicating with AI Assistant: {str(e)}. Make sure Ollama is running."
 
-def generate_sub_quiz(subject: str, focus_area: str, start_id: int):
+def chat_with_ollama(student_id: int, message: str, db: Session):
+    return complete_tutor_chat(build_tutor_payload(student_id, message, db))
+
+async def stream_chat_with_ollama(payload: dict):
+    """
+    Yields the tutor's reply piece by piece as Ollama produces it.
+    The payload is built up front (see build_tutor_payload) so no DB session
+    is needed while streaming.
+    """
+    try:
+        await llm_scheduler.acquire_async("chat_stream")
+    except SchedulerBusy:
+        yield "The AI tutor is very busy right now. Please try again in a moment."
+        return
+    try:
+        async for chunk in get_async_client().stream(payload, "chat_stream"):
+            content = chunk.get('message', {}).get('content', '')
+            if content:
+                yield content
+    except Exception as e:
+        yield f"Error communicating with AI Assistant: {str(e)}. Make sure Ollama is running."
+    finally:
+        llm_scheduler.release()
+
+def sanitize_question(q):
+    """Returns a cleaned copy of a generated question, or None if it can't be used."""
+    if not isinstance(q, dict): return None
+    
+    # --- STRICT FILTERING ---
+    # If crucial data is missing, we DISCARD the question rather than showing "Missing".
+    
+    # 1. Check Text
+    if not isinstance(q.get('text'), str) or len(q['text']) < 5: 
+        return None # Skip bad text
+    
+    # 2. Check Options
+    raw_opts = q.get('options', [])
+    clean_opts = []
+    if isinstance(raw_opts, list):
+        for opt in raw_opts:
+            clean_opts.append(str(opt) if not isinstance(opt, dict) else opt.get('text', ''))
+    
+    # We strictly need at least 2 valid options to make a question. 
+    # Ideally 4. We will fill up to 4 with "None of the above" type fillers if we have at least 2.
+    # If < 2 real options, discard.
+    clean_opts = [o for o in clean_opts if o and len(str(o)) > 1]
+    
+    if len(clean_opts) < 2:
+        return None 
+    
+    # Pad with generic destructors if 2 or 3 options
+    required_fillers = 4 - len(clean_opts)
+    fillers = ["None of the above", "All of the above", "Not applicable"]
+    for i in range(required_fillers):
+        clean_opts.append(fillers[i])
+    
+    q = dict(q)
+    q['options'] = clean_opts[:4]
+    
+    # 3. Fix Correct Index
+    try:
+        idx = int(q.get('correct_index', 0))
+        if idx < 0 or idx >= 4: idx = 0
+        q['correct_index'] = idx
+    except: q['correct_index'] = 0
+    
+    return q
+
+def build_quiz_payload(subject: str, focus_area: str, num_questions: int):
+    # Subject and focus come from the client; bound them so prefill time stays bounded
+    builder = PromptBuilder()
+    subject = builder.text("subject", subject)
+    focus_area = builder.text("focus_area", focus_area)
     system_prompt = f"""You are an expert exam setter. 
-    Task: Create a 12-question Multiple Choice Quiz for '{subject}'.
+    Task: Create a {num_questions}-question Multiple Choice Quiz for '{subject}'.
     Focus Area: {focus_area}.
     
     RULES:
@@ -107,99 +226,173 @@ def generate_sub_quiz(subject: str, focus_area: str, start_id: int):
     payload = {
         "model": MODEL,
         "messages": [{"role": "system", "content": system_prompt}],
-        "stream": False, "format": "json"
+        "stream": True, "format": "json"
     }
+    metrics.observe("prompt_tokens.generate", payload_tokens(payload))
+    return payload
+
+def iter_sub_quiz(subject: str, focus_area: str, start_id: int, num_questions: int = QUESTIONS_PER_BATCH, timeout=None, use_cache: bool = True, priority: str = "generate", cancel: Waiter = None, on_start=None):
+    """
+    Streams one batch from the model and yields each question as soon as it is
+    complete and valid, with IDs start_id, start_id + 1, ...
+    Questions already yielded survive a bad question or a broken stream later on.
+    Stops early (closing the stream, or leaving the LLM queue) once `cancel` is
+    cancelled through llm_scheduler.cancel. on_start() is called when the batch
+    gets its slot, just before the request is sent.
+    Identical batches already streaming share that stream (see llm_scheduler.stream).
+    """
+    if cancel is not None and cancel.cancelled:
+        return
+    payload = build_quiz_payload(subject, focus_area, num_questions)
+    key, cacheable, cached = cache_lookup(payload, "generate", use_cache)
+
+    def open_stream():
+        # Cancelled between getting the slot and here: don't send a request nobody will read
+        if cancel is not None and cancel.cancelled:
+            return iter(())
+        if on_start is not None:
+            on_start()
+        # Read timeout is 300s (see ollama_client.TIMEOUTS) for slower Windows machines,
+        # unless the caller passes a tighter one to fit its deadline
+        return client.stream(payload, "generate", timeout=timeout)
+
+    if cached is not None:
+        chunks = [{"message": {"content": cached}, "done": True}]
+    else:
+        chunks = llm_scheduler.stream(priority, open_stream, coalesce_key=key, waiter=cancel)
+
+    parser = QuestionStreamParser()
+    emitted = 0
+    content = []
+    complete = False
     try:
-        # TIMEOUT increased to 300s for slower Windows machines
-        response = requests.post(OLLAMA_URL, json=payload, timeout=300)
-        response.raise_for_status()
-        raw_content = response.json()['message']['content']
-        
-        # Clean Markdown
-        if "```json" in raw_content:
-            raw_content = raw_content.split("```json")[1].split("```")[0]
-        elif "```" in raw_content:
-            raw_content = raw_content.split("```")[1].split("```")[0]
-        
-        result = json.loads(raw_content.strip())
-        
-        sanitized_questions = []
-        if isinstance(result, dict) and 'questions' in result:
-            raw_list = result['questions']
-        elif isinstance(result, list):
-            raw_list = result
-        else:
-            return None 
-
-        for q in raw_list:
-            if not isinstance(q, dict): continue
-            
-            # --- STRICT FILTERING ---
-            # If crucial data is missing, we DISCARD the question rather than showing "Missing".
-            
-            # 1. Check Text
-            if 'text' not in q or len(q['text']) < 5: 
-                continue # Skip bad text
-            
-            # 2. Check Options
-            raw_opts = q.get('options', [])
-            clean_opts = []
-            if isinstance(raw_opts, list):
-                for opt in raw_opts:
-                    clean_opts.append(str(opt) if not isinstance(opt, dict) else opt.get('text', ''))
-            
-            # We strictly need at least 2 valid options to make a question. 
-            # Ideally 4. We will fill up to 4 with "None of the above" type fillers if we have at least 2.
-            # If < 2 real options, discard.
-            clean_opts = [o for o in clean_opts if o and len(str(o)) > 1]
-            
-            if len(clean_opts) < 2:
-                continue 
-            
-            # Pad with generic destructors if 2 or 3 options
-            required_fillers = 4 - len(clean_opts)
-            fillers = ["None of the above", "All of the above", "Not applicable"]
-            for i in range(required_fillers):
-                clean_opts.append(fillers[i])
-            
-            q['options'] = clean_opts[:4]
-            q['id'] = start_id # Assign distinct IDs sequentially later
-            start_id += 1
-            
-            # 3. Fix Correct Index
+        for chunk in chunks:
+            if cancel is not None and cancel.cancelled:
+                break
+            piece = chunk.get('message', {}).get('content', '')
+            content.append(piece)
+            for q in parser.feed(piece):
+                q = sanitize_question(q)
+                # Never spill into the next batch's ID block
+                if q and emitted < num_questions:
+                    q['id'] = start_id + emitted
+                    emitted += 1
+                    yield q
+            if chunk.get('done'):
+                complete = True
+    except SchedulerBusy:
+        raise
+    except Exception as e:
+        print(f"Error generation failed after {emitted} questions: {e}")
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()  # Hands the slot back now, not when the generator is collected
+
+    if parser.errors:
+        metrics.incr("quiz.malformed_questions", parser.errors)
+    if cacheable and cached is None and complete and emitted:
+        llm_cache.get_cache().put(key, "generate", "".join(content))
+
+def generate_sub_quiz(subject: str, focus_area: str, start_id: int, num_questions: int = QUESTIONS_PER_BATCH, timeout=None, use_cache: bool = True, priority: str = "generate"):
+    questions = list(iter_sub_quiz(subject, focus_area, start_id, num_questions, timeout, use_cache, priority))
+    return {"questions": questions} if questions else None
+
+def stream_assessment_quiz(subject: str, batches=None, questions_per_batch: int = QUESTIONS_PER_BATCH, deadline: float = ASSESSMENT_DEADLINE, use_cache: bool = True, priority: str = "generate"):
+    """
+    Runs all batches concurrently and yields ("question", q) as each question is
+    parsed, from whichever batch produces it, then one ("summary", {...}).
+    Each batch has its own thread and waits for an LLM slot like any other
+    call, so the scheduler bounds how many run and concurrent assessments
+    share the slots instead of queueing behind each other.
+    The deadline counts from when the first batch starts, not from the request.
+    At the deadline the remaining batches are cancelled: queued ones leave the
+    LLM queue without calling Ollama, and questions already produced are kept.
+    In-flight calls are bounded by a read timeout equal to the deadline, so
+    their threads are released on time.
+    Raises SchedulerBusy if nothing was generated because the LLM queue was full.
+    """
+    batches = (batches or ASSESSMENT_BATCHES)[:MAX_ASSESSMENT_BATCHES]
+    requested = time.monotonic()
+    started = None  # When the first batch got a slot (or a cached answer)
+    timeout = (3.05, deadline)
+    cancel = Waiter()
+    events = queue.Queue()
+
+    def run_batch(i, focus):
+        try:
+            for q in iter_sub_quiz(subject, focus, i * questions_per_batch + 1, questions_per_batch, timeout, use_cache, priority,
+                                   cancel, on_start=lambda: events.put(("started", i, None))):
+                events.put(("question", i, q))
+        except SchedulerBusy as e:
+            events.put(("busy", i, e))
+        except Exception as e:
+            print(f"Error generation batch {i} failed: {e}")
+        finally:
+            events.put(("done", i, None))
+
+    for i, focus in enumerate(batches):
+        threading.Thread(target=run_batch, args=(i, focus), name=f"quizgen-{i}", daemon=True).start()
+
+    counts = [0] * len(batches)
+    finished = set()
+    busy = None
+    try:
+        while len(finished) < len(batches):
+            remaining = None  # Until a batch starts, the scheduler's queue limits bound the wait
+            if started is not None:
+                remaining = deadline - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
             try:
-                idx = int(q.get('correct_index', 0))
-                if idx < 0 or idx >= 4: idx = 0
-                q['correct_index'] = idx
-            except: q['correct_index'] = 0
-            
-            sanitized_questions.append(q)
-            
-        return {"questions": sanitized_questions}
+                kind, i, item = events.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if started is None and kind in ("started", "question"):
+                started = time.monotonic()
+            if kind == "question":
+                if not any(counts):
+                    metrics.observe("assessment.first_question", time.monotonic() - requested)
+                counts[i] += 1
+                yield "question", item
+            elif kind == "busy":
+                busy = item
+            elif kind == "done":
+                finished.add(i)
+    finally:
+        # Also reached when the client disconnects from a streamed assessment
+        llm_scheduler.cancel(cancel)
 
-    except Exception as e:
-        print(f"Error generation failed: {e}")
-        return None         
+    if not any(counts) and busy:
+        raise busy
 
-def generate_assessment_quiz(subject: str):
+    completed = sum(1 for i in finished if counts[i])
+    yield "summary", {
+        "batches_requested": len(batches),
+        "batches_completed": completed,
+        "partial": completed < len(batches),
+        "generation_seconds": round(time.monotonic() - requested, 2),
+    }
+
+def generate_assessment_quiz(subject: str, batches=None, questions_per_batch: int = QUESTIONS_PER_BATCH, deadline: float = ASSESSMENT_DEADLINE, use_cache: bool = True, priority: str = "generate"):
+    """Collects stream_assessment_quiz into one assessment; None if nothing was generated."""
     questions = []
-    
-    # Batch 1: Fundamentals
-    q1 = generate_sub_quiz(subject, "Fundamentals, Definitions, and Core Concepts", 1)
-    if q1 and 'questions' in q1:
-        questions.extend(q1['questions'])
-        
-    # Batch 2: Advanced
-    q2 = generate_sub_quiz(subject, "Advanced Topics, Edge Cases, and Real-world Applications", 11)
-    if q2 and 'questions' in q2:
-        questions.extend(q2['questions'])
-        
+    summary = {}
+    for kind, item in stream_assessment_quiz(subject, batches, questions_per_batch, deadline, use_cache, priority):
+        if kind == "question":
+            questions.append(item)
+        else:
+            summary = item
+
     if not questions:
         return None
-        
-    return {"questions": questions}
+
+    # Batch order, not completion order, so IDs come out ascending
+    questions.sort(key=lambda q: q['id'])
+    return {"questions": questions, **summary}
 
 def analyze_assessment_results(subject: str, score: int, total: int, incorrect_topics: list):
+    # Order doesn't change the advice; sorting lets repeated score patterns share a cache entry
+    incorrect_topics = sorted(incorrect_topics)
     system_prompt = f"""You are an expert academic advisor.
     Student just took a {subject} exam.
     Score: {score}/{total}.
@@ -223,10 +416,9 @@ def analyze_assessment_results(subject: str, score: int, total: int, incorrect_t
     }
     
     try:
-        response = requests.post(OLLAMA_URL, json=payload, timeout=60)
-        response.raise_for_status()
-        content = response.json()['message']['content']
-        return json.loads(content)
+        return ollama_chat(payload, "analyze", parse=json.loads)
+    except SchedulerBusy:
+        raise
     except Exception as e:
         print(f"Error analyzing results: {e}")
         return {
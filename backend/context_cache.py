@@ -0,0 +1,175 @@
+"""
+Per-student tutor context, cached and updated incrementally.
+
+Building the tutor's student profile from scratch costs several queries plus
+the full recommendation pipeline. Instead the profile is loaded once and then
+patched by the quiz endpoints as events and drift rows are written. The
+derived parts (recommendations, course notes) are only recomputed when their
+inputs change: recommendations when a topic crosses a mastery band or a drift
+window opens/closes, notes when the weakest topic changes.
+
+The cache is per process; PROFILE_TTL bounds how stale a profile can get when
+another worker handled the student's latest events.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session, joinedload
+
+from .models import StudentTopicState, Event, DriftEvent, Resource
+from .recommender import get_recommendations
+from . import metrics
+
+MAX_STUDENTS = 2000
+PROFILE_TTL = 300  # seconds
+RECENT_EVENTS = 5
+DRIFT_WINDOW = timedelta(days=1)  # Same window the recommender uses
+
+
+def _band(mastery: float) -> int:
+    # Mirrors the difficulty bands in recommender.get_recommendations
+    if mastery < 0.4:
+        return 0
+    if mastery < 0.7:
+        return 1
+    return 2
+
+
+class StudentProfile:
+    def __init__(self):
+        self.mastery = {}  # topic_id -> [topic_name, mastery]
+        self.recent = deque(maxlen=RECENT_EVENTS)  # (topic_name, is_correct), newest first
+        self.last_drift = {}  # topic_id -> detected_at (only drifts inside DRIFT_WINDOW matter)
+        self.has_drift = False
+        self.recs = None
+        self.recs_signature = None
+        self.notes = []
+        self.notes_key = None
+        self.loaded_at = time.monotonic()
+
+    def weak_topics(self):
+        # Weakest first: it's the most relevant context for the tutor
+        weak = [(mastery, name) for name, mastery in self.mastery.values() if mastery < 0.6]
+        return [name for _, name in sorted(weak)]
+
+    def recs_signature_now(self):
+        cutoff = datetime.utcnow() - DRIFT_WINDOW
+        drifted = {tid for tid, at in self.last_drift.items() if at >= cutoff}
+        return tuple(
+            (tid, _band(mastery), mastery < 0.6, tid in drifted)
+            for tid, (_, mastery) in sorted(self.mastery.items())
+        )
+
+
+class ContextCache:
+    def __init__(self, max_students: int = MAX_STUDENTS):
+        self.max_students = max_students
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped when resources change; recommendations and notes depend on them
+        self._catalog_version = 0
+
+    def _load(self, db: Session, student_id: int) -> StudentProfile:
+        profile = StudentProfile()
+        states = db.query(StudentTopicState).options(joinedload(StudentTopicState.topic)).filter(
+            StudentTopicState.student_id == student_id
+        ).all()
+        for s in states:
+            profile.mastery[s.topic_id] = [s.topic.name, s.mastery_probability]
+
+        last_events = db.query(Event).options(joinedload(Event.topic)).filter(
+            Event.student_id == student_id
+        ).order_by(Event.timestamp.desc()).limit(RECENT_EVENTS).all()
+        for e in last_events:
+            profile.recent.append((e.topic.name, e.is_correct))
+
+        profile.has_drift = db.query(DriftEvent.id).filter_by(student_id=student_id).first() is not None
+        cutoff = datetime.utcnow() - DRIFT_WINDOW
+        for topic_id, detected_at in db.query(DriftEvent.topic_id, DriftEvent.detected_at).filter(
+            DriftEvent.student_id == student_id, DriftEvent.detected_at >= cutoff
+        ):
+            if detected_at > profile.last_drift.get(topic_id, cutoff):
+                profile.last_drift[topic_id] = detected_at
+        return profile
+
+    def _get(self, db: Session, student_id: int) -> StudentProfile:
+        with self._lock:
+            profile = self._profiles.get(student_id)
+            if profile is not None and time.monotonic() - profile.loaded_at < PROFILE_TTL:
+                self._profiles.move_to_end(student_id)
+                metrics.incr("context.cache_hits")
+                return profile
+
+        metrics.incr("context.cache_misses")
+        profile = self._load(db, student_id)
+        with self._lock:
+            self._profiles[student_id] = profile
+            while len(self._profiles) > self.max_students:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def get_profile(self, db: Session, student_id: int) -> dict:
+        """Returns the assembled tutor context for a student."""
+        with metrics.timed("context.build"):
+            profile = self._get(db, student_id)
+            # Snapshot under the lock: the quiz endpoints patch profiles concurrently
+            with self._lock:
+                weak_topics = profile.weak_topics()
+                signature = (self._catalog_version, profile.recs_signature_now())
+                notes_key = (self._catalog_version, weak_topics[0] if weak_topics else None)
+                recent = list(profile.recent)
+                has_drift = profile.has_drift
+                recs = profile.recs if signature == profile.recs_signature else None
+                notes = profile.notes if notes_key == profile.notes_key else None
+
+            # Derived parts are rebuilt outside the lock (they query the database) and stored under it
+            if recs is None:
+                recs = get_recommendations(db, student_id)[:3]
+                with self._lock:
+                    profile.recs, profile.recs_signature = recs, signature
+
+            if notes is None:
+                notes = []
+                if weak_topics:
+                    # Return basic chunks - in real app use vector DB
+                    resources = db.query(Resource).filter(Resource.content.contains(weak_topics[0])).limit(2).all()
+                    notes = [f"From {r.title}: {r.content[:200]}..." for r in resources]
+                with self._lock:
+                    profile.notes, profile.notes_key = notes, notes_key
+
+            return {
+                "weak_topics": weak_topics,
+                "history": [f"{name}: {'Correct' if ok else 'Incorrect'}" for name, ok in recent],
+                "drift_status": "Drift Detected Recently" if has_drift else "Stable",
+                "recommendations": [f"{r['title']} ({r['reason']})" for r in recs],
+                "notes": list(notes),
+            }
+
+    def record_event(self, student_id: int, topic_id: int, topic_name: str, is_correct: bool, mastery: float):
+        """Applies a committed quiz event to the cached profile, if there is one."""
+        with self._lock:
+            profile = self._profiles.get(student_id)
+            if profile is None:
+                return
+            profile.mastery.setdefault(topic_id, [topic_name, mastery])[1] = mastery
+            profile.recent.appendleft((topic_name, is_correct))
+
+    def record_drift(self, student_id: int, topic_id: int):
+        with self._lock:
+            profile = self._profiles.get(student_id)
+            if profile is None:
+                return
+            profile.has_drift = True
+            profile.last_drift[topic_id] = datetime.utcnow()
+
+    def invalidate_catalog(self):
+        with self._lock:
+            self._catalog_version += 1
+
+    def __len__(self):
+        return len(self._profiles)
+
+
+context_cache = ContextCache()
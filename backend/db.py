@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -17,3 +17,13 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def add_missing_columns(table):
+    """create_all() skips tables that already exist; this adds columns (and their indexes) added to the model since."""
+    with engine.begin() as conn:
+        existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
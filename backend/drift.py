@@ -1,16 +1,45 @@
-from river import drift
-import collections
+"""
+Per-(student, topic) ADWIN drift detectors.
+
+DriftDetector keeps them in process memory, which is only correct with a
+single worker: with several, each worker's ADWIN would see a fragment of a
+student's error stream. SharedDriftDetector (DRIFT_STATE=shared) keeps every
+detector pickled in a local SQLite file instead. Each update loads, updates
+and stores the detector inside one BEGIN IMMEDIATE transaction, so updates
+from all workers are applied one at a time in commit order. A per-process copy
+tagged with the row's version skips the unpickle when this worker made the
+last update.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+DRIFT_STATE = os.environ.get("DRIFT_STATE", "memory")  # "memory" or "shared"
+DRIFT_STATE_PATH = os.environ.get("DRIFT_STATE_PATH", "./drift_state.db")
+
+
+def _new_detector(**params):
+    # river is heavy to import; it is loaded on first use (or by the warm-up)
+    from river import drift
+    return drift.ADWIN(**params)
+
 
 class DriftDetector:
-    def __init__(self):
+    def __init__(self, **adwin_params):
         # We maintain a separate ADWIN instance for each student-topic pair
         # Key: (student_id, topic_id) -> ADWIN instance
         self.detectors = {}
+        self.adwin_params = adwin_params  # e.g. delta=0.002 (river's defaults when empty)
+
+    def _new_detector(self):
+        return _new_detector(**self.adwin_params)
 
     def get_detector(self, student_id: int, topic_id: int):
         key = (student_id, topic_id)
         if key not in self.detectors:
-            self.detectors[key] = drift.ADWIN()
+            self.detectors[key] = self._new_detector()
         return self.detectors[key]
 
     def update(self, student_id: int, topic_id: int, error: float) -> bool:
@@ -24,4 +53,103 @@ class DriftDetector:
 
     def reset_detector(self, student_id: int, topic_id: int):
         key = (student_id, topic_id)
-        self.detectors[key] = drift.ADWIN()
+        self.detectors[key] = self._new_detector()
+
+    def __len__(self):
+        return len(self.detectors)
+
+
+class SharedDriftDetector:
+    def __init__(self, path: str = DRIFT_STATE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._cache = {}  # key -> (version, detector) as last seen by this process
+        self._cache_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS drift_state ("
+            " student_id INTEGER, topic_id INTEGER, version INTEGER, state BLOB, updated_at REAL,"
+            " PRIMARY KEY (student_id, topic_id))"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL + NORMAL: commits don't fsync; a power cut can lose the last few updates, not corrupt the file
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _load(self, conn, key):
+        row = conn.execute(
+            "SELECT version, state FROM drift_state WHERE student_id = ? AND topic_id = ?", key
+        ).fetchone()
+        if row is None:
+            return 0, _new_detector()
+        version, state = row
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached
+        return version, pickle.loads(state)
+
+    def _store(self, conn, key, version, detector):
+        conn.execute(
+            "INSERT INTO drift_state (student_id, topic_id, version, state, updated_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (student_id, topic_id) DO UPDATE SET"
+            " version = excluded.version, state = excluded.state, updated_at = excluded.updated_at",
+            (*key, version, pickle.dumps(detector, protocol=pickle.HIGHEST_PROTOCOL), time.time()),
+        )
+        with self._cache_lock:
+            self._cache[key] = (version, detector)
+
+    def update(self, student_id: int, topic_id: int, error: float) -> bool:
+        """Same contract as DriftDetector.update, consistent across processes."""
+        key = (student_id, topic_id)
+        conn = self._conn()
+        # Takes the database write lock: concurrent updates from any worker queue here
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version, detector = self._load(conn, key)
+            detector.update(error)
+            drifted = detector.drift_detected
+            self._store(conn, key, version + 1, detector)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            with self._cache_lock:
+                self._cache.pop(key, None)  # The cached copy may hold the rolled-back update
+            raise
+        return drifted
+
+    def reset_detector(self, student_id: int, topic_id: int):
+        key = (student_id, topic_id)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version, _ = self._load(conn, key)
+            self._store(conn, key, version + 1, _new_detector())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def version(self, student_id: int, topic_id: int) -> int:
+        """Number of updates applied to this key so far (0 if none)."""
+        row = self._conn().execute(
+            "SELECT version FROM drift_state WHERE student_id = ? AND topic_id = ?", (student_id, topic_id)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM drift_state").fetchone()[0]
+
+
+def make_drift_detector():
+    """The detector for this deployment: in-memory for one worker, shared for several."""
+    if DRIFT_STATE == "shared":
+        return SharedDriftDetector()
+    return DriftDetector()
@@ -0,0 +1,165 @@
+"""
+In-process fan-out of drift events to live subscribers (the instructors'
+drift monitoring stream).
+
+The quiz endpoints publish each DriftEvent right after it is committed; every
+subscriber whose student/topic filter matches gets it on its own asyncio
+queue. Publishing happens on threadpool threads, so delivery goes through
+loop.call_soon_threadsafe. Event ids are DriftEvent primary keys, which makes
+them usable as a resume cursor: a reconnecting client passes the last id it
+saw and the stream replays newer rows from the database before going live.
+
+The hub only sees drifts detected by its own worker. When running several
+workers, set DRIFT_HUB_POLL (seconds) and each hub also picks up rows other
+workers wrote with one primary-key range query per interval.
+
+A subscriber that falls QUEUE_SIZE events behind is disconnected rather than
+buffered without bound; it reconnects with its cursor and catches up.
+"""
+import asyncio
+import os
+import threading
+from collections import deque
+
+from sqlalchemy.orm import joinedload
+
+from .db import SessionLocal
+from .models import DriftEvent
+from . import metrics
+
+QUEUE_SIZE = 100
+RECENT_IDS = 1000  # Published ids remembered so the poller doesn't resend local events
+POLL_INTERVAL = float(os.environ.get("DRIFT_HUB_POLL", "0"))  # seconds; 0 = local events only
+REPLAY_LIMIT = 200  # Events per replay query; a reconnect pages until it has caught up
+
+
+def event_payload(d: DriftEvent) -> dict:
+    return {
+        "id": d.id,
+        "student_id": d.student_id,
+        "student": d.student.name if d.student else "Unknown",
+        "topic_id": d.topic_id,
+        "topic": d.topic.name if d.topic else "Unknown",
+        "date": d.detected_at.isoformat(),
+        "metric_value": d.metric_value,
+        "notes": d.notes,
+    }
+
+
+class Subscription:
+    def __init__(self, loop, student_ids=None, topic_ids=None):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.student_ids = set(student_ids) if student_ids else None
+        self.topic_ids = set(topic_ids) if topic_ids else None
+        self.overflowed = False
+
+    def matches(self, event: dict) -> bool:
+        if self.student_ids is not None and event["student_id"] not in self.student_ids:
+            return False
+        if self.topic_ids is not None and event["topic_id"] not in self.topic_ids:
+            return False
+        return True
+
+    def _deliver(self, event):
+        # Runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop the backlog and tell the stream to close; the client resumes from its cursor
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            metrics.incr("drift_hub.overflows")
+
+
+class DriftHub:
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._subs = set()
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=RECENT_IDS)
+        self._recent_set = set()
+        self._poll_cursor = None  # Highest event id the poller has seen
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, student_ids=None, topic_ids=None) -> Subscription:
+        sub = Subscription(asyncio.get_running_loop(), student_ids, topic_ids)
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def publish(self, event: dict):
+        """Fans a committed drift event out to matching subscribers. Safe to call from any thread."""
+        with self._lock:
+            if event["id"] in self._recent_set:
+                return  # Already published locally, now seen again by the poller
+            if len(self._recent) == self._recent.maxlen:
+                self._recent_set.discard(self._recent[0])
+            self._recent.append(event["id"])
+            self._recent_set.add(event["id"])
+            subs = [s for s in self._subs if s.matches(event)]
+        metrics.incr("drift_hub.published")
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._deliver, event)
+            except RuntimeError:
+                pass  # Loop closed; the subscriber is going away
+
+    def replay(self, db, after_id: int, student_ids=None, topic_ids=None, limit: int = REPLAY_LIMIT) -> list:
+        """Committed events newer than after_id matching the filters, oldest first."""
+        query = db.query(DriftEvent).options(joinedload(DriftEvent.student), joinedload(DriftEvent.topic)).filter(
+            DriftEvent.id > after_id
+        )
+        if student_ids:
+            query = query.filter(DriftEvent.student_id.in_(student_ids))
+        if topic_ids:
+            query = query.filter(DriftEvent.topic_id.in_(topic_ids))
+        return [event_payload(d) for d in query.order_by(DriftEvent.id.asc()).limit(limit)]
+
+    def __len__(self):
+        return len(self._subs)
+
+    # --- Cross-worker polling ---
+
+    def _poll_once(self):
+        db = self.session_factory()
+        try:
+            if self._poll_cursor is None:
+                # Start from the current tail; history is served by replay()
+                self._poll_cursor = db.query(DriftEvent.id).order_by(DriftEvent.id.desc()).limit(1).scalar() or 0
+                return
+            for event in self.replay(db, self._poll_cursor):
+                self._poll_cursor = event["id"]
+                self.publish(event)
+        finally:
+            db.close()
+
+    def _loop(self):
+        while not self._stop.wait(POLL_INTERVAL):
+            try:
+                self._poll_once()
+            except Exception as e:
+                print(f"Error polling drift events: {e}")
+
+    def start(self):
+        if POLL_INTERVAL <= 0 or self.session_factory is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="drift-hub-poll", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+drift_hub = DriftHub()
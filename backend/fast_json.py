@@ -0,0 +1,138 @@
+"""
+Fast response path for the large read endpoints.
+
+FastJSONResponse serializes with orjson (falling back to the stdlib when it
+isn't installed). Hot endpoints build plain dicts from rows they already trust
+and return FastJSONResponse directly, which skips FastAPI's jsonable_encoder
+pass and response_model re-validation.
+
+CompressionMiddleware compresses responses of at least COMPRESS_MIN_SIZE bytes
+with brotli when the client accepts it and the optional `brotli` package is
+installed, else gzip. Streaming responses (tutor chat, NDJSON assessments, SSE)
+are passed through untouched so tokens still reach the client immediately.
+It is plain ASGI, so it doesn't depend on Starlette's GZip internals.
+"""
+import json
+import os
+import zlib
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))  # bytes
+GZIP_LEVEL = 6  # Level 9 costs ~2x the CPU for a few % smaller bodies
+BROTLI_QUALITY = 4  # Fast brotli still beats gzip -6 on JSON
+STREAMING_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson", "text/plain")
+
+
+def _default(obj):
+    # numpy scalars (e.g. similarity scores) and anything else with a plain-Python twin
+    if hasattr(obj, "item"):
+        return obj.item()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class _Gzip:
+    """zlib in gzip framing, with the same process/flush/finish calls as brotli.Compressor."""
+
+    def __init__(self, level: int = GZIP_LEVEL):
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, body: bytes) -> bytes:
+        return self._zlib.compress(body)
+
+    def flush(self) -> bytes:
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._zlib.flush()
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = Headers(scope=scope).get("Accept-Encoding", "")
+        if brotli is not None and "br" in accept:
+            encoding, make_compressor = "br", lambda: brotli.Compressor(quality=BROTLI_QUALITY)
+        elif "gzip" in accept:
+            encoding, make_compressor = "gzip", _Gzip
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        start = None  # Held back until the first body chunk shows whether to compress
+        compressor = None  # None = not decided yet, False = passing through
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if compressor is False:
+                await send(message)
+                return
+            if message["type"] != "http.response.body":
+                # e.g. http.response.pathsend: not ours to compress
+                compressor = False
+                await send(start)
+                await send(message)
+                return
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if compressor is None:
+                headers = Headers(raw=start["headers"])
+                if ("content-encoding" in headers
+                        or headers.get("content-type", "").startswith(STREAMING_CONTENT_TYPES)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    compressor = False
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = make_compressor()
+                headers = MutableHeaders(scope=start)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    # The whole body is here: send it in one piece with its new length
+                    out = compressor.process(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(out))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": out})
+                    return
+                del headers["Content-Length"]
+                await send(start)
+
+            out = compressor.process(body) + (compressor.flush() if more_body else compressor.finish())
+            await send({"type": "http.response.body", "body": out, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,120 @@
+"""
+Dedupe index for retried quiz submissions.
+
+Clients attach an idempotency key to each answer (the `Idempotency-Key`
+header or `idempotency_key` in the body) and reuse it when they retry. The
+first request with a key is applied; repeats get the stored result back
+without touching BKT, ADWIN or the database.
+
+Results stay in memory for WINDOW seconds, at most MAX_KEYS of them, oldest
+evicted first; a hit is one dict lookup. Past the window, after a restart or
+in another worker, the key is still found in the unique
+`events.idempotency_key` column, whose row also stores the result. A retry
+racing the original in another worker loses on that constraint.
+
+A retry that arrives while the original is still being applied waits for it
+instead of applying the answer a second time.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+
+WINDOW = float(os.environ.get("IDEMPOTENCY_WINDOW", "900"))  # seconds
+MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+
+class AlreadyApplied(Exception):
+    """Raised by an apply() callback when the key turns out to be taken already (e.g. by another worker)."""
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SubmissionIndex:
+    def __init__(self, window: float = WINDOW, max_keys: int = MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # key -> (expires_at, result), oldest first
+        self._inflight = {}  # key -> _Flight
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Entries are inserted in expiry order, so expired ones are always at the front
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_keys:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key: str, result):
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.window, result)
+            self._evict(now)
+
+    def run(self, key: str, apply, lookup):
+        """
+        Returns (result, replayed). apply() computes and commits a new result;
+        lookup() returns the stored result for the key, or None if there is none.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                metrics.incr("idempotency.memory_hits")
+                return entry[1], True
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            metrics.incr("idempotency.waited")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            result = lookup()
+            replayed = result is not None
+            if not replayed:
+                try:
+                    result = apply()
+                except AlreadyApplied:
+                    result, replayed = lookup(), True
+            if replayed:
+                metrics.incr("idempotency.db_hits")
+            self.put(key, result)
+            flight.result = result
+            return result, replayed
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+submission_index = SubmissionIndex()
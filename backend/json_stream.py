@@ -0,0 +1,62 @@
+"""
+Incremental extraction of quiz questions from streamed model output.
+
+The model is asked for {"questions": [{...}, {...}]} (or sometimes returns a
+bare list). QuestionStreamParser is fed the text as it arrives and returns each
+question object as soon as its closing brace is seen, so one malformed
+question only loses itself instead of the whole batch. Text outside the JSON
+(markdown fences, chatter) is ignored.
+"""
+import json
+
+
+class QuestionStreamParser:
+    def __init__(self):
+        self._stack = []        # open containers: '{' or '['
+        self._in_string = False
+        self._escape = False
+        self._current = None    # chars of the question object being read, or None
+        self.errors = 0         # question objects that were not valid JSON
+
+    def _at_question_level(self) -> bool:
+        # Elements of a top-level list, or of a list directly inside the top-level object
+        return self._stack == ["["] or self._stack == ["{", "["]
+
+    def feed(self, text: str) -> list:
+        """Consumes a chunk of output and returns the question dicts it completed."""
+        completed = []
+        for ch in text:
+            if self._current is not None:
+                self._current.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                if self._stack:
+                    self._in_string = True
+            elif ch == "{" or ch == "[":
+                if ch == "{" and self._current is None and self._at_question_level():
+                    self._current = [ch]
+                self._stack.append(ch)
+            elif ch == "}" or ch == "]":
+                if not self._stack:
+                    continue  # stray closer outside any JSON
+                self._stack.pop()
+                if ch == "}" and self._current is not None and self._at_question_level():
+                    raw = "".join(self._current)
+                    self._current = None
+                    try:
+                        obj = json.loads(raw)
+                    except ValueError:
+                        self.errors += 1
+                        continue
+                    if isinstance(obj, dict):
+                        completed.append(obj)
+        return completed
@@ -0,0 +1,123 @@
+"""
+Content-addressed cache for Ollama responses.
+
+Entries are keyed by a SHA-256 of (model, normalized messages, format), so the
+same prompt hits the same entry regardless of incidental whitespace. A small
+in-memory LRU sits in front of an on-disk SQLite store; the store is bounded
+to MAX_ENTRIES and evicts least-recently-used rows. Each call type has its own
+TTL; call types without one (the tutor chat) are never cached.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "./llm_cache.db")
+CACHE_ENABLED = os.environ.get("LLM_CACHE", "1") == "1"
+MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "5000"))
+MEMORY_ENTRIES = 256
+
+# call type -> seconds an entry stays valid
+TTLS = {
+    "analyze": 7 * 24 * 3600,
+    "generate": 3600,
+}
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(payload: dict) -> str:
+    material = {
+        "model": payload.get("model"),
+        "format": payload.get("format"),
+        "messages": [(m.get("role"), _normalize(m.get("content", ""))) for m in payload.get("messages", [])],
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES, memory_entries: int = MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (call_type, value, created_at)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, call_type TEXT, value TEXT,"
+            " created_at REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, call_type: str):
+        ttl = TTLS.get(call_type)
+        if ttl is None:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT call_type, value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                entry = tuple(row) if row else None
+            if entry is None or entry[0] != call_type or now - entry[2] > ttl:
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, call_type: str, value: str):
+        if call_type not in TTLS:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, (call_type, value, now))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, call_type, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, call_type, value, now, now),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+            if count > self.max_entries:
+                # Evict down to 90% so we don't pay for an eviction on every insert
+                excess = count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (excess,),
+                )
+                self._memory.clear()
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+            return {"entries": count, "memory_entries": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> LLMCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+    return _cache
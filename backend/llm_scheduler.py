@@ -0,0 +1,261 @@
+"""
+Admission control for LLM work.
+
+All Ollama calls take a slot from one scheduler before they are sent. At most
+MAX_CONCURRENT calls run at once; the rest wait in a priority queue so
+interactive chat overtakes batch generation. Each priority class has a queue
+limit and a maximum wait: past either, the call is rejected with SchedulerBusy
+(mapped to a fast 503) instead of timing out inside Ollama. Identical
+in-flight requests, streamed or not, are coalesced onto a single call.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from . import metrics
+
+MAX_CONCURRENT = int(os.environ.get("LLM_MAX_CONCURRENT", "2"))
+
+# call type / class -> priority (lower runs first)
+PRIORITIES = {
+    "chat": 0,
+    "chat_stream": 0,
+    "analyze": 1,
+    "generate": 2,
+    "background": 3,
+}
+# Requests are rejected when this many calls are already queued.
+# Background work only queues when the queue is nearly empty, so it never crowds out students.
+QUEUE_LIMITS = {0: 32, 1: 16, 2: 8, 3: 2}
+# Longest a request may wait for a slot before it is rejected (None = no limit)
+MAX_WAIT = {0: 20.0, 1: 30.0, 2: 120.0, 3: None}
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+class Waiter:
+    """
+    Lets a caller give up its place in the queue (see LLMScheduler.cancel).
+    One waiter may cover several calls, e.g. all batches of one assessment;
+    `granted` is then meaningless. Changed only under the scheduler's lock.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.granted = False
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _StreamFlight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority, seq)
+        self._active = 0
+        self._seq = itertools.count()
+        self._inflight = {}  # coalescing key -> _Flight
+        self._inflight_lock = threading.Lock()
+
+    def _priority(self, call_type: str) -> int:
+        return PRIORITIES.get(call_type, PRIORITIES["generate"])
+
+    def check_admission(self, call_type: str):
+        """Raises SchedulerBusy if a request of this type would be rejected right now."""
+        priority = self._priority(call_type)
+        with self._cond:
+            if len(self._queue) >= QUEUE_LIMITS[priority]:
+                metrics.incr(f"llm.rejected.{call_type}")
+                raise SchedulerBusy(f"LLM queue is full ({len(self._queue)} waiting)")
+
+    def acquire(self, call_type: str, waiter: Waiter = None) -> bool:
+        """Waits for a slot. Returns False, without a slot, if `waiter` was cancelled first."""
+        priority = self._priority(call_type)
+        max_wait = MAX_WAIT[priority]
+        start = time.perf_counter()
+        with self._cond:
+            if len(self._queue) >= QUEUE_LIMITS[priority]:
+                metrics.incr(f"llm.rejected.{call_type}")
+                raise SchedulerBusy(f"LLM queue is full ({len(self._queue)} waiting)")
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._queue, ticket)
+            while True:
+                # Checked before taking a slot too: the caller may have gone before we got the lock
+                if waiter is not None and waiter.cancelled:
+                    # The caller is gone: give up our place in the queue
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+                    return False
+                if self._active < self.max_concurrent and self._queue[0] == ticket:
+                    break
+                remaining = None if max_wait is None else max_wait - (time.perf_counter() - start)
+                if remaining is not None and remaining <= 0:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+                    metrics.incr(f"llm.rejected.{call_type}")
+                    raise SchedulerBusy(f"Waited {max_wait:.0f}s for an LLM slot")
+                self._cond.wait(remaining)
+            heapq.heappop(self._queue)
+            self._active += 1
+            if waiter is not None:
+                waiter.granted = True
+            # Someone else may now be at the head with a free slot
+            self._cond.notify_all()
+        metrics.observe(f"llm.queue_wait.{call_type}", time.perf_counter() - start)
+        return True
+
+    def cancel(self, waiter: Waiter):
+        """Makes every acquire waiting with `waiter` leave the queue without a slot."""
+        with self._cond:
+            waiter.cancelled = True
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, call_type: str):
+        self.acquire(call_type)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire_async(self, call_type: str):
+        # Waiting happens on a worker thread so the event loop keeps serving.
+        # Cancelling the coroutine doesn't stop that thread, so on cancel we
+        # either pull it out of the queue or hand back the slot it just got.
+        waiter = Waiter()
+        try:
+            await asyncio.to_thread(self.acquire, call_type, waiter)
+        except asyncio.CancelledError:
+            with self._cond:
+                waiter.cancelled = True
+                granted = waiter.granted
+                self._cond.notify_all()
+            if granted:
+                self.release()
+            raise
+
+    def run(self, call_type: str, fn, coalesce_key: str = None):
+        """
+        Runs fn() in a slot. Callers passing the same coalesce_key while a call
+        is in flight wait for it and share its result instead of queueing their own.
+        """
+        if coalesce_key is None:
+            with self.slot(call_type):
+                return fn()
+
+        with self._inflight_lock:
+            flight = self._inflight.get(coalesce_key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[coalesce_key] = _Flight()
+
+        if not leader:
+            metrics.incr(f"llm.coalesced.{call_type}")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            with self.slot(call_type):
+                flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(coalesce_key, None)
+            flight.done.set()
+
+    def stream(self, call_type: str, open_stream, coalesce_key: str = None, waiter: Waiter = None):
+        """
+        Yields the chunks of open_stream() (called once a slot is free). Callers
+        passing the same coalesce_key while a stream is in flight get its chunks,
+        replayed from the start, instead of opening their own; their stream ends
+        wherever the first caller stopped reading. Yields nothing if `waiter` is
+        cancelled while queued.
+        """
+        with self._inflight_lock:
+            flight = self._inflight.get(coalesce_key) if coalesce_key is not None else None
+            leader = flight is None
+            if leader:
+                flight = _StreamFlight()
+                if coalesce_key is not None:
+                    self._inflight[coalesce_key] = flight
+
+        if not leader:
+            metrics.incr(f"llm.coalesced.{call_type}")
+            seen = 0
+            while True:
+                with flight.cond:
+                    while seen == len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    chunks, done, error = flight.chunks[seen:], flight.done, flight.error
+                seen += len(chunks)
+                yield from chunks
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+
+        try:
+            if not self.acquire(call_type, waiter):
+                return
+            try:
+                stream = open_stream()
+                try:
+                    for chunk in stream:
+                        with flight.cond:
+                            flight.chunks.append(chunk)
+                            flight.cond.notify_all()
+                        yield chunk
+                finally:
+                    # Also reached when our reader stops early: don't hold the slot for an unread stream
+                    if hasattr(stream, "close"):
+                        stream.close()
+            finally:
+                self.release()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            if coalesce_key is not None:
+                with self._inflight_lock:
+                    self._inflight.pop(coalesce_key, None)
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"active": self._active, "queued": len(self._queue), "max_concurrent": self.max_concurrent}
+
+
+llm_scheduler = LLMScheduler()
@@ -1,24 +1,96 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+# Imported first so PROFILE_IMPORTS=1 can time everything that follows
+from . import warmup
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 
-from .db import get_db, engine, Base
+from .db import get_db, engine, Base, SessionLocal, add_missing_columns
 from .models import Student, Instructor, Topic, Resource, Event, StudentTopicState, DriftEvent, Question
 from .bkt import BKTTracker
-from .drift import DriftDetector
+from .drift import make_drift_detector
 from .recommender import get_recommendations
-from .chat_ollama import chat_with_ollama
-from .auth import verify_password, get_password_hash
+from .auth import (get_password_hash_async, verify_password_async, shutdown_hash_pool,
+                   create_session_token, verify_session_token, get_hash_pool, get_password_hash)
+from .assessment_pool import assessment_pool
+from .context_cache import context_cache
+from .drift_hub import drift_hub, event_payload, REPLAY_LIMIT
+from .idempotency import submission_index, AlreadyApplied
+from .llm_scheduler import llm_scheduler, SchedulerBusy
+from .fast_json import FastJSONResponse, CompressionMiddleware
+from . import catalog, metrics, profiling, progress
+
+# Pre-generated assessments (see assessment_pool.py); subjects listed here are filled at startup
+POOL_ENABLED = os.environ.get("ASSESSMENT_POOL", "1") == "1"
+POOL_SUBJECTS = [s.strip() for s in os.environ.get("ASSESSMENT_POOL_SUBJECTS", "").split(",") if s.strip()]
+# Reject calls without a session token (off by default so scripts can call the API directly)
+REQUIRE_SESSION = os.environ.get("REQUIRE_SESSION", "0") == "1"
 
 # Create Tables
 Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Drift-Aware Learning Platform")
+add_missing_columns(Event.__table__)
+with SessionLocal() as _db:
+    catalog.ensure_versions(_db)
+
+@warmup.register_warmup("db_connection")
+def _warm_db_connection():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+@warmup.register_warmup("auth_hash_pool")
+def _warm_auth_hash_pool():
+    # Spawning the bcrypt workers takes a moment; don't make the first login pay for it
+    get_hash_pool().submit(get_password_hash, "warmup").result()
+
+@warmup.register_warmup("chat_module")
+def _warm_chat_module():
+    from . import chat_ollama
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy imports and caches are loaded in the background; /ready flips to 200 when done
+    warmup.start_warmup_thread()
+    if POOL_ENABLED:
+        assessment_pool.start(subjects=POOL_SUBJECTS)
+    drift_hub.start()
+    yield
+    drift_hub.stop()
+    assessment_pool.stop()
+    shutdown_hash_pool()
+
+app = FastAPI(title="Drift-Aware Learning Platform", lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+if profiling.ENABLED:
+    # Must be set before any route is declared
+    app.router.route_class = profiling.ProfilingRoute
+    app.add_middleware(profiling.ProfilingMiddleware)
+    profiling.instrument_engine(engine)
 
 # Instantiate Global Detection Manager
-drift_manager = DriftDetector()
+drift_manager = make_drift_detector()
+
+# Read at scrape time by /metrics
+metrics.register_gauge("drift_detectors", lambda: len(drift_manager))
+metrics.register_gauge("context_cache_profiles", lambda: len(context_cache))
+metrics.register_gauge("drift_stream_subscribers", lambda: len(drift_hub))
+metrics.register_gauge("idempotency_keys", lambda: len(submission_index))
+metrics.register_gauge("llm_scheduler", llm_scheduler.stats)
+metrics.register_gauge("assessment_pool_pending_refills", assessment_pool.pending_refills)
+
+def _llm_cache_sizes():
+    from . import llm_cache
+    stats = llm_cache.get_cache().stats()
+    return {"entries": stats["entries"], "memory_entries": stats["memory_entries"]}
+metrics.register_gauge("llm_cache", _llm_cache_sizes)
 
 # --- Pydantic Models ---
 class LoginRequest(BaseModel):
@@ -30,6 +102,7 @@ class LoginResponse(BaseModel):
     username: str
     role: str
     name: str
+    token: Optional[str] = None
 
 class QuestionCreate(BaseModel):
     topic_id: int
@@ -50,6 +123,7 @@ class QuizSubmit(BaseModel):
     student_id: int
     question_id: int
     selected_index: int
+    idempotency_key: Optional[str] = None  # Or the Idempotency-Key header; see idempotency.py
 
 class ChatRequest(BaseModel):
     student_id: int
@@ -64,6 +138,9 @@ class ResourceCreate(BaseModel):
 
 class AssessmentRequest(BaseModel):
     subject: str
+    # Optional focus areas, one LLM batch each (defaults to Fundamentals + Advanced)
+    batches: Optional[List[str]] = None
+    questions_per_batch: Optional[int] = None
 
 class AssessmentAnalysisRequest(BaseModel):
     subject: str
@@ -76,39 +153,138 @@ class StudentRegister(BaseModel):
     password: str
     name: str
 
+@app.exception_handler(SchedulerBusy)
+def llm_busy_handler(request, exc: SchedulerBusy):
+    # Fail fast so clients can back off, rather than queueing until Ollama times out
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+# --- OPS ENDPOINTS ---
+
+@app.get("/ready")
+def readiness():
+    report = warmup.readiness_report()
+    if not report["ready"]:
+        return JSONResponse(status_code=503, content=report)
+    return report
+
+@app.get("/stats")
+def runtime_stats():
+    from . import llm_cache
+    stats = metrics.snapshot()
+    stats["llm_cache"] = llm_cache.get_cache().stats()
+    stats["llm_scheduler"] = llm_scheduler.stats()
+    return stats
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- AUTH ENDPOINTS ---
 
+def session_user(authorization: Optional[str] = Header(None)):
+    """
+    Claims of the caller's session token. Token-less callers are anonymous (None)
+    unless REQUIRE_SESSION is set; a token that doesn't verify is always a 401.
+    """
+    if not authorization:
+        if REQUIRE_SESSION:
+            raise HTTPException(status_code=401, detail="Missing session token")
+        return None
+    claims = verify_session_token(authorization.removeprefix("Bearer ").strip())
+    if claims is None:
+        # Otherwise a forged token would pass as anonymous and skip check_student_access
+        raise HTTPException(status_code=401, detail="Invalid or expired session token")
+    return claims
+
+def check_student_access(user, student_id: int):
+    # Students may only act as themselves; instructors may act for anyone
+    if user and user["role"] == "student" and user["sub"] != student_id:
+        raise HTTPException(status_code=403, detail="Session belongs to another student")
+
+def require_instructor(user=Depends(session_user)):
+    if not user or user["role"] != "instructor":
+        raise HTTPException(status_code=403, detail="Instructor session required")
+    return user
+
+def login_response(user, role: str):
+    return {"id": user.id, "username": user.username, "role": role, "name": user.name,
+            "token": create_session_token(user.id, role)}
+
 @app.post("/register/student", response_model=LoginResponse)
-def register_student(student: StudentRegister, db: Session = Depends(get_db)):
-    if db.query(Student).filter(Student.username == student.username).first():
+async def register_student(student: StudentRegister, db: Session = Depends(get_db)):
+    exists = await run_in_threadpool(lambda: db.query(Student.id).filter(Student.username == student.username).first())
+    if exists:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_pwd = get_password_hash(student.password)
+    hashed_pwd = await get_password_hash_async(student.password)
     db_student = Student(username=student.username, password_hash=hashed_pwd, name=student.name)
-    db.add(db_student)
-    db.commit()
-    db.refresh(db_student)
+
+    def save():
+        db.add(db_student)
+        catalog.bump(db, "students")
+        db.commit()
+        db.refresh(db_student)
+    await run_in_threadpool(save)
     
-    return {"id": db_student.id, "username": db_student.username, "role": "student", "name": db_student.name}
+    return login_response(db_student, "student")
 
+# Login is async so the bcrypt wait happens in the hashing pool, not on a threadpool thread
 @app.post("/login/student", response_model=LoginResponse)
-def login_student(creds: LoginRequest, db: Session = Depends(get_db)):
-    student = db.query(Student).filter(Student.username == creds.username).first()
-    if not student or not verify_password(creds.password, student.password_hash):
+async def login_student(creds: LoginRequest, db: Session = Depends(get_db)):
+    student = await run_in_threadpool(lambda: db.query(Student).filter(Student.username == creds.username).first())
+    if not student or not await verify_password_async(creds.password, student.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    return {"id": student.id, "username": student.username, "role": "student", "name": student.name}
+    return login_response(student, "student")
 
 @app.post("/login/instructor", response_model=LoginResponse)
-def login_instructor(creds: LoginRequest, db: Session = Depends(get_db)):
-    instructor = db.query(Instructor).filter(Instructor.username == creds.username).first()
-    if not instructor or not verify_password(creds.password, instructor.password_hash):
+async def login_instructor(creds: LoginRequest, db: Session = Depends(get_db)):
+    instructor = await run_in_threadpool(lambda: db.query(Instructor).filter(Instructor.username == creds.username).first())
+    if not instructor or not await verify_password_async(creds.password, instructor.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    return {"id": instructor.id, "username": instructor.username, "role": "instructor", "name": instructor.name}
+    return login_response(instructor, "instructor")
+
+@app.get("/session")
+def current_session(user=Depends(session_user)):
+    """Lets a client check a stored token instead of logging in again."""
+    if user is None:
+        raise HTTPException(status_code=401, detail="Missing session token")
+    return user
+
+# --- ADMIN ENDPOINTS ---
+
+# Slowest profiled requests; empty unless the backend runs with PROFILING=1 (see profiling.py)
+@app.get("/admin/profiles")
+def list_profiles(user=Depends(require_instructor)):
+    return {"enabled": profiling.ENABLED, "profiled": profiling.profile_buffer.profiled,
+            "profiles": profiling.profile_buffer.list()}
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile_report(profile_id: int, user=Depends(require_instructor)):
+    profile = profiling.profile_buffer.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found (it may have been evicted)")
+    return PlainTextResponse(profile.report())
+
+@app.get("/admin/profiles/{profile_id}/download")
+def download_profile(profile_id: int, user=Depends(require_instructor)):
+    profile = profiling.profile_buffer.get(profile_id)
+    if profile is None or profile.stats is None:
+        raise HTTPException(status_code=404, detail="No cProfile data for this profile")
+    return Response(
+        profiling.dump_stats(profile),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.prof"'},
+    )
+
+@app.delete("/admin/profiles")
+def clear_profiles(user=Depends(require_instructor)):
+    profiling.profile_buffer.clear()
+    return {"status": "cleared"}
 
 # --- INSTRUCTOR ENDPOINTS ---
 
 @app.post("/questions")
-def create_question(q: QuestionCreate, db: Session = Depends(get_db)):
+def create_question(q: QuestionCreate, db: Session = Depends(get_db), user=Depends(require_instructor)):
     db_q = Question(
         topic_id=q.topic_id,
         text=q.text,
@@ -117,32 +293,42 @@ def create_question(q: QuestionCreate, db: Session = Depends(get_db)):
         difficulty=q.difficulty
     )
     db.add(db_q)
+    catalog.bump(db, "questions")
     db.commit()
     return {"status": "created", "id": db_q.id}
 
 @app.get("/questions", response_model=List[QuestionResponse])
-def get_questions(db: Session = Depends(get_db)):
-    questions = db.query(Question).all()
-    # In a real app we'd filter or map more carefully
-    return questions
+def get_questions(request: Request, db: Session = Depends(get_db)):
+    def build():
+        # Selecting just the public columns keeps correct_index out without re-validating every row
+        rows = db.query(Question.id, Question.topic_id, Question.text, Question.options, Question.difficulty).all()
+        return [
+            {"id": r.id, "topic_id": r.topic_id, "text": r.text, "options": r.options, "difficulty": r.difficulty}
+            for r in rows
+        ]
+    return catalog.conditional_response(request, db, "questions", build)
 
 @app.get("/students")
-def list_students(db: Session = Depends(get_db)):
-    students = db.query(Student).all()
-    # Return simple list for instructor view
-    return [{"id": s.id, "name": s.name, "username": s.username} for s in students]
+def list_students(request: Request, db: Session = Depends(get_db)):
+    def build():
+        students = db.query(Student.id, Student.name, Student.username).all()
+        # Return simple list for instructor view
+        return [{"id": s.id, "name": s.name, "username": s.username} for s in students]
+    return catalog.conditional_response(request, db, "students", build)
 
 @app.post("/resources")
-def create_resource(resource: ResourceCreate, db: Session = Depends(get_db)):
+def create_resource(resource: ResourceCreate, db: Session = Depends(get_db), user=Depends(require_instructor)):
     db_resource = Resource(**resource.dict())
     db.add(db_resource)
     db.commit()
+    context_cache.invalidate_catalog()
     return {"status": "created"}
 
 # --- STUDENT ENDPOINTS ---
 
 @app.get("/students/{student_id}/dashboard")
-def get_dashboard(student_id: int, db: Session = Depends(get_db)):
+def get_dashboard(student_id: int, db: Session = Depends(get_db), user=Depends(session_user)):
+    check_student_access(user, student_id)
     student = db.query(Student).get(student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
@@ -158,29 +344,54 @@ def get_dashboard(student_id: int, db: Session = Depends(get_db)):
         # Recent Drift
         recent_drifts = db.query(DriftEvent).filter_by(student_id=student_id).order_by(DriftEvent.detected_at.desc()).limit(5).all()
         
-        # History for Line Chart (Last 50 events)
-        history_events = db.query(Event).filter_by(student_id=student_id).order_by(Event.timestamp.asc()).limit(50).all()
+        # History for Line Chart (Last 50 events, oldest first); /students/{id}/progress has the full history
+        history_events = db.query(Event).filter_by(student_id=student_id).order_by(Event.timestamp.desc()).limit(50).all()[::-1]
         progress_data = [{"event": i+1, "score": 1.0 if e.is_correct else 0.0, "time": e.timestamp} for i, e in enumerate(history_events)]
 
-        return {
+        return FastJSONResponse({
             "student": student.name,
             "mastery": mastery_data,
             "recommendations": recs,
             "drift_events": [{"topic": d.topic_id, "date": d.detected_at} for d in recent_drifts],
             "progress": progress_data
-        }
+        })
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+def _naive_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    # Event timestamps are stored as naive UTC
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+@app.get("/students/{student_id}/progress")
+def get_progress_history(student_id: int, by: str = "attempt", topic_id: Optional[int] = None,
+                         start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         bucket_size: Optional[str] = None, max_points: int = progress.MAX_POINTS, window: int = 5,
+                         db: Session = Depends(get_db), user=Depends(session_user)):
+    """Quiz accuracy over attempts or time, bucketed in SQL to at most max_points points."""
+    check_student_access(user, student_id)
+    if bucket_size is not None and bucket_size not in progress.RESOLUTIONS and not bucket_size.isdigit():
+        raise HTTPException(status_code=422, detail=f"bucket_size must be a number or one of {', '.join(progress.RESOLUTIONS)}")
+    size = progress.RESOLUTIONS.get(bucket_size) or (int(bucket_size) if bucket_size else None)
+    try:
+        history = progress.progress_history(db, student_id, by=by, topic_id=topic_id, start=_naive_utc(start),
+                                            end=_naive_utc(end), bucket_size=size, max_points=max_points, window=window)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return FastJSONResponse(history)
+
 @app.get("/topics")
-def list_topics(db: Session = Depends(get_db)):
-    topics = db.query(Topic).all()
-    return [{"id": t.id, "name": t.name} for t in topics]
+def list_topics(request: Request, db: Session = Depends(get_db)):
+    return catalog.conditional_response(
+        request, db, "topics", lambda: [{"id": t.id, "name": t.name} for t in db.query(Topic.id, Topic.name)]
+    )
 
 @app.get("/quiz/generate")
-def generate_quiz_question(topic_id: int, student_id: int, db: Session = Depends(get_db)):
+def generate_quiz_question(topic_id: int, student_id: int, db: Session = Depends(get_db), user=Depends(session_user)):
+    check_student_access(user, student_id)
     # Simple logic: get a random question for the topic.
     # Advanced logic (TODO): Pick based on difficulty matching BKT mastery.
     questions = db.query(Question).filter(Question.topic_id == topic_id).all()
@@ -196,17 +407,54 @@ def generate_quiz_question(topic_id: int, student_id: int, db: Session = Depends
     }
 
 @app.post("/events/submit_quiz")
-def submit_quiz_answer(submission: QuizSubmit, db: Session = Depends(get_db)):
-    question = db.query(Question).get(submission.question_id)
-    if not question:
-        raise HTTPException(status_code=404, detail="Question not found")
-    
-    is_correct = (submission.selected_index == question.correct_index)
-    topic_id = question.topic_id
-    
-    # --- BKT & Drift Logic (Same as before) ---
-    state = db.query(StudentTopicState).filter_by(student_id=submission.student_id, topic_id=topic_id).first()
-    topic = db.query(Topic).get(topic_id)
+def submit_quiz_answer(submission: QuizSubmit, response: Response, db: Session = Depends(get_db),
+                       user=Depends(session_user), idempotency_key: Optional[str] = Header(None)):
+    check_student_access(user, submission.student_id)
+    key = idempotency_key or submission.idempotency_key
+    if not key:
+        return apply_quiz_submission(submission, db)
+
+    # Keys are scoped to the student so two clients can't collide on each other's keys
+    key = f"{submission.student_id}:{key}"
+
+    def lookup():
+        return db.query(Event.result).filter(Event.idempotency_key == key).scalar()
+
+    result, replayed = submission_index.run(key, lambda: apply_quiz_submission(submission, db, key), lookup)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+def apply_quiz_submission(submission: QuizSubmit, db: Session, key: Optional[str] = None):
+    with metrics.timed("submit_quiz.state_select"):
+        question = db.query(Question).get(submission.question_id)
+        if not question:
+            raise HTTPException(status_code=404, detail="Question not found")
+
+        is_correct = (submission.selected_index == question.correct_index)
+        topic_id = question.topic_id
+
+        # --- BKT & Drift Logic (Same as before) ---
+        state = db.query(StudentTopicState).filter_by(student_id=submission.student_id, topic_id=topic_id).first()
+        topic = db.query(Topic).get(topic_id)
+
+    # Log Event
+    db_event = Event(
+        student_id=submission.student_id,
+        topic_id=topic_id,
+        resource_id=question.id, # Using resource_id to store question ID for now
+        event_type="quiz_real",
+        is_correct=is_correct,
+        idempotency_key=key
+    )
+    db.add(db_event)
+    if key:
+        # Claim the key before touching BKT/ADWIN: a duplicate from another worker fails here
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            raise AlreadyApplied(key)
     
     if not state:
         state = StudentTopicState(
@@ -221,14 +469,16 @@ def submit_quiz_answer(submission: QuizSubmit, db: Session = Depends(get_db)):
         db.add(state)
         # We need to flush to get ID if needed, but for now object is enough
     
-    bkt = BKTTracker(state.p_init, state.p_learn, state.p_guess, state.p_slip)
-    predicted_prob = bkt.predict_correctness(state.mastery_probability)
-    actual = 1.0 if is_correct else 0.0
-    error = abs(actual - predicted_prob)
+    with metrics.timed("submit_quiz.bkt"):
+        bkt = BKTTracker(state.p_init, state.p_learn, state.p_guess, state.p_slip)
+        predicted_prob = bkt.predict_correctness(state.mastery_probability)
+        actual = 1.0 if is_correct else 0.0
+        error = abs(actual - predicted_prob)
 
-    new_mastery = bkt.update_mastery(state.mastery_probability, is_correct)
+        new_mastery = bkt.update_mastery(state.mastery_probability, is_correct)
     
-    is_drift = drift_manager.update(submission.student_id, topic_id, error)
+    with metrics.timed("submit_quiz.adwin"):
+        is_drift = drift_manager.update(submission.student_id, topic_id, error)
     drift_msg = "Stable"
     
     if is_drift:
@@ -244,26 +494,25 @@ def submit_quiz_answer(submission: QuizSubmit, db: Session = Depends(get_db)):
 
     state.mastery_probability = new_mastery
     state.last_updated = datetime.utcnow()
-    
-    # Log Event
-    db_event = Event(
-        student_id=submission.student_id,
-        topic_id=topic_id,
-        resource_id=question.id, # Using resource_id to store question ID for now
-        event_type="quiz_real",
-        is_correct=is_correct,
-        prediction_error=error
-    )
-    db.add(db_event)
-    
-    db.commit()
-    
-    return {
+
+    result = {
         "correct": is_correct,
         "correct_index": question.correct_index,
         "new_mastery": new_mastery,
         "drift_status": drift_msg
     }
+    db_event.prediction_error = error
+    if key:
+        db_event.result = result
+    
+    with metrics.timed("submit_quiz.commit"):
+        db.commit()
+    context_cache.record_event(submission.student_id, topic_id, topic.name, is_correct, new_mastery)
+    if is_drift:
+        context_cache.record_drift(submission.student_id, topic_id)
+        drift_hub.publish(event_payload(drift_event))
+    
+    return result
 
 class QuizEventCreate(BaseModel):
     student_id: int
@@ -271,7 +520,8 @@ class QuizEventCreate(BaseModel):
     is_correct: bool
 
 @app.post("/events/simulate")
-def simulate_quiz_event(event: QuizEventCreate, db: Session = Depends(get_db)):
+def simulate_quiz_event(event: QuizEventCreate, db: Session = Depends(get_db), user=Depends(session_user)):
+    check_student_access(user, event.student_id)
     # 1. Get/Init State
     state = db.query(StudentTopicState).filter_by(student_id=event.student_id, topic_id=event.topic_id).first()
     topic = db.query(Topic).get(event.topic_id)
@@ -322,6 +572,10 @@ def simulate_quiz_event(event: QuizEventCreate, db: Session = Depends(get_db)):
     )
     db.add(db_event)
     db.commit()
+    context_cache.record_event(event.student_id, event.topic_id, topic.name, event.is_correct, new_mastery)
+    if is_drift:
+        context_cache.record_drift(event.student_id, event.topic_id)
+        drift_hub.publish(event_payload(drift_event))
     
     return {
         "new_mastery": new_mastery,
@@ -331,36 +585,195 @@ def simulate_quiz_event(event: QuizEventCreate, db: Session = Depends(get_db)):
     }
 
 @app.get("/drifts/all")
-def list_all_drifts(db: Session = Depends(get_db)):
+def list_all_drifts(db: Session = Depends(get_db), user=Depends(session_user)):
     drifts = db.query(DriftEvent).join(Student).join(Topic).order_by(DriftEvent.detected_at.desc()).limit(20).all()
-    return [{
+    return FastJSONResponse([{
         "student": d.student.name,
         "topic": d.topic.name if d.topic else "Unknown",
         "date": d.detected_at,
         "notes": d.notes
-    } for d in drifts]
+    } for d in drifts])
+
+def _id_list(value: Optional[str]):
+    return [int(v) for v in value.split(",") if v.strip()] if value else None
+
+@app.get("/drifts/stream")
+async def stream_drifts(request: Request, student_ids: Optional[str] = None, topic_ids: Optional[str] = None,
+                        cursor: Optional[int] = None, user=Depends(session_user)):
+    """
+    Server-Sent Events feed of drift detections. Filter with comma-separated
+    student_ids/topic_ids. On reconnect pass the last event id (Last-Event-ID
+    header or ?cursor=) to replay what was missed; without one the stream
+    starts with the newest events only.
+    """
+    import json
+    students = _id_list(student_ids)
+    topics = _id_list(topic_ids)
+    if user and user["role"] == "student":
+        students = [user["sub"]]  # Students only ever see their own drifts
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        cursor = int(last_event_id)
+
+    def latest_id():
+        with SessionLocal() as db:
+            return db.query(DriftEvent.id).order_by(DriftEvent.id.desc()).limit(1).scalar() or 0
+
+    def load_page(after_id):
+        with SessionLocal() as db:
+            return drift_hub.replay(db, after_id, students, topics)
+
+    def frame(event):
+        return f"id: {event['id']}\nevent: drift\ndata: {json.dumps(event)}\n\n"
+
+    async def events():
+        # Subscribe before replaying so nothing committed in between is lost; replayed ids are skipped below.
+        # Done here, not in the handler, so a response that is never iterated leaves no subscription behind.
+        sub = drift_hub.subscribe(students, topics)
+        try:
+            start_id = cursor if cursor is not None else await run_in_threadpool(latest_id)
+            yield f"retry: 3000\n: cursor {start_id}\n\n"
+            # Page through everything the client missed, however much, before going live
+            while cursor is not None:
+                page = await run_in_threadpool(load_page, start_id)
+                for event in page:
+                    yield frame(event)
+                if page:
+                    start_id = page[-1]["id"]
+                if len(page) < REPLAY_LIMIT:
+                    break
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return  # Fell too far behind; the client reconnects from its cursor
+                if event["id"] <= start_id:
+                    continue
+                yield frame(event)
+        finally:
+            drift_hub.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/chat")
-def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db), user=Depends(session_user)):
+    check_student_access(user, request.student_id)
+    from .chat_ollama import build_tutor_payload, complete_tutor_chat
+    from .prompt_builder import payload_tokens
     try:
-        response = chat_with_ollama(request.student_id, request.message, db)
-        return {"response": response}
+        payload = build_tutor_payload(request.student_id, request.message, db)
+        response = complete_tutor_chat(payload)
+        return {"response": response, "prompt_tokens": payload_tokens(payload)}
+    except SchedulerBusy:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, db: Session = Depends(get_db), user=Depends(session_user)):
+    check_student_access(user, request.student_id)
+    from .chat_ollama import build_tutor_payload, stream_chat_with_ollama
+    from .prompt_builder import payload_tokens
+    # Context is assembled now, while the DB session is still open; only the LLM call streams.
+    # The stream itself runs on the async client so it doesn't hold a threadpool thread.
+    # Reject up front while we can still send a 503; the stream itself waits for its slot
+    llm_scheduler.check_admission("chat_stream")
+    payload = await run_in_threadpool(build_tutor_payload, request.student_id, request.message, db, stream=True)
+    return StreamingResponse(
+        stream_chat_with_ollama(payload),
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Prompt-Tokens": str(payload_tokens(payload))},
+    )
+
 @app.post("/assessment/generate")
-def generate_assessment(req: AssessmentRequest):
+def generate_assessment(req: AssessmentRequest, user=Depends(session_user)):
     # Import locally to avoid circle if at top (though separate modules preferred)
-    from .chat_ollama import generate_assessment_quiz
-    quiz = generate_assessment_quiz(req.subject)
+    from .chat_ollama import generate_assessment_quiz, QUESTIONS_PER_BATCH
+    custom = req.batches is not None or req.questions_per_batch is not None
+
+    # Default-shaped assessments are served from the pre-generated pool when possible
+    if POOL_ENABLED and not custom:
+        pooled = assessment_pool.take(req.subject)
+        if pooled:
+            return pooled
+
+    quiz = generate_assessment_quiz(
+        req.subject,
+        batches=req.batches,
+        questions_per_batch=max(1, min(req.questions_per_batch or QUESTIONS_PER_BATCH, 20)),
+        # A set that will feed the pool must be new, not a cached copy of one already pooled
+        use_cache=not (POOL_ENABLED and not custom),
+    )
     if not quiz:
         raise HTTPException(status_code=500, detail="Failed to generate quiz from AI.")
+    if POOL_ENABLED and not custom:
+        assessment_pool.add(req.subject, quiz)
+    quiz["source"] = "generated"
     return quiz
 
+@app.post("/assessment/generate/stream")
+def generate_assessment_stream(req: AssessmentRequest, user=Depends(session_user)):
+    """
+    Same assessment as /assessment/generate, as NDJSON: one {"type": "question"}
+    line per question as soon as it is parsed, then a {"type": "done"} summary.
+    """
+    import json
+    from .chat_ollama import stream_assessment_quiz, QUESTIONS_PER_BATCH
+    custom = req.batches is not None or req.questions_per_batch is not None
+
+    def line(obj):
+        return json.dumps(obj) + "\n"
+
+    if POOL_ENABLED and not custom:
+        pooled = assessment_pool.take(req.subject)
+        if pooled:
+            def replay():
+                for q in pooled["questions"]:
+                    yield line({"type": "question", "question": q})
+                yield line({"type": "done", "partial": False, "source": pooled.get("source", "pool")})
+            return StreamingResponse(replay(), media_type="application/x-ndjson")
+
+    # Reject up front while we can still send a 503
+    llm_scheduler.check_admission("generate")
+
+    def generate():
+        questions = []
+        try:
+            for kind, item in stream_assessment_quiz(
+                req.subject,
+                batches=req.batches,
+                questions_per_batch=max(1, min(req.questions_per_batch or QUESTIONS_PER_BATCH, 20)),
+                use_cache=not (POOL_ENABLED and not custom),
+            ):
+                if kind == "question":
+                    questions.append(item)
+                    yield line({"type": "question", "question": item})
+                else:
+                    summary = item
+        except SchedulerBusy as e:
+            yield line({"type": "error", "detail": str(e)})
+            return
+        if not questions:
+            yield line({"type": "error", "detail": "Failed to generate quiz from AI."})
+            return
+        if POOL_ENABLED and not custom:
+            questions.sort(key=lambda q: q['id'])
+            assessment_pool.add(req.subject, {"questions": questions, **summary})
+        yield line({"type": "done", "source": "generated", **summary})
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/assessment/pool")
+def assessment_pool_status(user=Depends(session_user)):
+    return {"fresh_sets": assessment_pool.fresh_counts()}
+
 @app.post("/assessment/analyze")
-def analyze_assessment(req: AssessmentAnalysisRequest):
+def analyze_assessment(req: AssessmentAnalysisRequest, user=Depends(session_user)):
     from .chat_ollama import analyze_assessment_results
     analysis = analyze_assessment_results( req.subject, req.score, req.total, req.incorrect_topics)
     return analysis
@@ -0,0 +1,168 @@
+"""
+In-process metrics registry.
+
+Latencies are fixed-bucket histograms (count, sum, max and per-bucket counts)
+per name, counters are plain integers, and gauges are callbacks read at scrape
+time (cache sizes, queue depths). Everything is process-local and guarded by
+one lock; recording is a bisect, a lock and a few additions, around a
+microsecond, so stage timers can sit on the hot path.
+
+`GET /metrics` renders all of it in the Prometheus text format; `/stats`
+keeps the JSON summary.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+_lock = threading.Lock()
+_latencies = {}  # name -> [count, total, max, bucket_counts, bucket_bounds]
+_counters = {}   # name -> int
+_gauges = {}     # name -> callable returning a number (or a dict of label -> number)
+
+# Upper bounds in seconds; covers sub-millisecond stages up to multi-minute LLM calls
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_BUCKETS = (50, 100, 200, 400, 800, 1200, 1600, 2400, 3200, 4800)
+# Names observed in something other than seconds
+BUCKETS_BY_PREFIX = {"prompt_tokens.": TOKEN_BUCKETS}
+
+
+def _buckets_for(name: str):
+    for prefix, buckets in BUCKETS_BY_PREFIX.items():
+        if name.startswith(prefix):
+            return buckets
+    return TIME_BUCKETS
+
+
+def observe(name: str, seconds: float):
+    with _lock:
+        entry = _latencies.get(name)
+        if entry is None:
+            buckets = _buckets_for(name)
+            entry = _latencies[name] = [0, 0.0, seconds, [0] * (len(buckets) + 1), buckets]
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+        entry[3][bisect_left(entry[4], seconds)] += 1
+
+
+def incr(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def register_gauge(name: str, fn):
+    """fn() is called at scrape time; it may return a number or {label_value: number}."""
+    _gauges[name] = fn
+
+
+class timed:
+    """Times a block: `with metrics.timed("submit_quiz.commit"): ...`"""
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def timed_function(name: str):
+    """Decorator form of timed()."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def _quantile(count, bucket_counts, buckets, mx, q):
+    # Upper bound of the bucket holding the q-th observation; good enough for dashboards
+    target = q * count
+    seen = 0
+    for bound, n in zip(buckets, bucket_counts):
+        seen += n
+        if seen >= target:
+            return min(bound, mx)
+    return mx
+
+
+def snapshot():
+    with _lock:
+        latencies = {
+            name: {
+                "count": c,
+                "avg": total / c if c else 0.0,
+                "max": mx,
+                "p50": _quantile(c, counts, buckets, mx, 0.5),
+                "p95": _quantile(c, counts, buckets, mx, 0.95),
+            }
+            for name, (c, total, mx, counts, buckets) in _latencies.items()
+        }
+        return {"latency": latencies, "counters": dict(_counters), "gauges": _read_gauges()}
+
+
+def _read_gauges():
+    values = {}
+    for name, fn in list(_gauges.items()):
+        try:
+            values[name] = fn()
+        except Exception as e:
+            print(f"Error reading gauge {name}: {e}")
+    return values
+
+
+def _metric_name(name: str, suffix: str = "") -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name) + suffix
+
+
+def _fmt(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        latencies = [(name, c, total, list(counts), buckets) for name, (c, total, _, counts, buckets) in _latencies.items()]
+        counters = dict(_counters)
+    gauges = _read_gauges()
+
+    lines = []
+    for name, count, total, counts, buckets in sorted(latencies):
+        metric = _metric_name(name, "" if buckets is not TIME_BUCKETS else "_seconds")
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in zip(buckets, counts):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{metric}_sum {_fmt(total)}")
+        lines.append(f"{metric}_count {count}")
+
+    for name, value in sorted(counters.items()):
+        metric = _metric_name(name, "_total")
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+
+    for name, value in sorted(gauges.items()):
+        metric = _metric_name(name)
+        lines.append(f"# TYPE {metric} gauge")
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                label = str(label).replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{metric}{{key="{label}"}} {_fmt(v)}')
+        else:
+            lines.append(f"{metric} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
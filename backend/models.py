@@ -99,6 +99,10 @@ class Event(Base):
     # Debug info
     prediction_error = Column(Float, nullable=True) # Computed error for drift detection
 
+    # Client dedupe key for quiz submissions (see idempotency.py) and the response it got
+    idempotency_key = Column(String, unique=True, index=True, nullable=True)
+    result = Column(JSON, nullable=True)
+
     student = relationship("Student", back_populates="events")
     topic = relationship("Topic")
 
@@ -114,3 +118,18 @@ class DriftEvent(Base):
 
     student = relationship("Student", back_populates="drift_events")
     topic = relationship("Topic")
+
+class AssessmentSet(Base):
+    __tablename__ = "assessment_sets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    subject = Column(String, index=True) # Normalized (lower-case, single spaces)
+    questions = Column(JSON) # Validated question list, same shape as /assessment/generate
+    created_at = Column(DateTime, default=datetime.utcnow)
+    served_count = Column(Integer, default=0)
+
+class CatalogVersion(Base):
+    __tablename__ = "catalog_versions"
+
+    name = Column(String, primary_key=True) # "topics", "questions", "students"
+    version = Column(Integer, nullable=False) # Bumped in the same transaction as every write to that catalog
@@ -0,0 +1,203 @@
+"""
+Shared HTTP clients for the Ollama API.
+
+One pooled, keep-alive client per process instead of a fresh TCP connection per
+call. Each call type has its own (connect, read) timeout; failures to connect
+(refused, or timed out while connecting) and 502/503/504 responses are retried
+with jittered exponential backoff. Nothing else is: generation isn't
+idempotent, so a connection that drops after the request went out must not
+run the same generation twice, and read timeouts mean the model is busy,
+where retrying would only add load to it.
+
+`client` is the synchronous variant used from threadpool endpoints;
+`get_async_client()` returns the asyncio variant for async endpoints.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+from . import metrics
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434/api/chat")
+MAX_CONNECTIONS = int(os.environ.get("OLLAMA_MAX_CONNECTIONS", "8"))
+MAX_RETRIES = int(os.environ.get("OLLAMA_MAX_RETRIES", "2"))
+BACKOFF_BASE = 0.25  # seconds
+
+# call type -> (connect timeout, read timeout) in seconds.
+# For streams the read timeout is the longest gap allowed between two chunks.
+TIMEOUTS = {
+    "chat": (3.05, 60),
+    "chat_stream": (3.05, 60),
+    "generate": (3.05, 300),
+    "analyze": (3.05, 60),
+}
+RETRY_STATUSES = {502, 503, 504}
+
+
+def _backoff(attempt: int) -> float:
+    # "Full jitter": spreads retries from many workers instead of synchronising them
+    return random.uniform(0, BACKOFF_BASE * (2 ** attempt))
+
+
+def _never_sent(error: requests.ConnectionError) -> bool:
+    """True if the request provably never reached Ollama, so sending it again is safe."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError; its reason says which phase failed.
+    # NewConnectionError (connection refused) is a ConnectTimeoutError too.
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+def _record(call_type: str, start: float, error: bool = False):
+    metrics.observe(f"ollama.{call_type}", time.perf_counter() - start)
+    metrics.incr(f"ollama.{call_type}.calls")
+    if error:
+        metrics.incr(f"ollama.{call_type}.errors")
+
+
+class OllamaClient:
+    def __init__(self, url: str = OLLAMA_URL, max_connections: int = MAX_CONNECTIONS, max_retries: int = MAX_RETRIES):
+        self.url = url
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        # pool_block: callers wait for a free connection rather than opening extra ones
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, payload: dict, call_type: str, stream: bool, timeout=None):
+        timeout = timeout or TIMEOUTS.get(call_type, TIMEOUTS["chat"])
+        for attempt in range(self.max_retries + 1):
+            retryable = attempt < self.max_retries
+            try:
+                response = self.session.post(self.url, json=payload, timeout=timeout, stream=stream)
+            except requests.ConnectionError as e:
+                if not retryable or not _never_sent(e):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or not retryable:
+                    response.raise_for_status()
+                    return response
+                response.close()
+            metrics.incr(f"ollama.{call_type}.retries")
+            time.sleep(_backoff(attempt))
+
+    def chat(self, payload: dict, call_type: str = "chat", timeout=None) -> dict:
+        """
+        Posts a non-streaming /api/chat request and returns the decoded body.
+        `timeout` overrides the call type's (connect, read) pair, e.g. to fit a deadline.
+        """
+        start = time.perf_counter()
+        try:
+            response = self._post(payload, call_type, stream=False, timeout=timeout)
+            body = response.json()
+        except Exception:
+            _record(call_type, start, error=True)
+            raise
+        _record(call_type, start)
+        return body
+
+    def stream(self, payload: dict, call_type: str = "chat_stream", timeout=None):
+        """Yields decoded NDJSON chunks of a streaming /api/chat request."""
+        start = time.perf_counter()
+        error = False
+        try:
+            with self._post(payload, call_type, stream=True, timeout=timeout) as response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    yield chunk
+                    if chunk.get("done"):
+                        break
+        except Exception:
+            error = True
+            raise
+        finally:
+            _record(call_type, start, error)
+
+
+class AsyncOllamaClient:
+    def __init__(self, url: str = OLLAMA_URL, max_connections: int = MAX_CONNECTIONS, max_retries: int = MAX_RETRIES):
+        import httpx
+        self._httpx = httpx
+        self.url = url
+        self.max_retries = max_retries
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def _timeout(self, call_type: str):
+        connect, read = TIMEOUTS.get(call_type, TIMEOUTS["chat"])
+        return self._httpx.Timeout(connect=connect, read=read, write=connect, pool=read)
+
+    async def _send(self, payload: dict, call_type: str, stream: bool):
+        httpx = self._httpx
+        for attempt in range(self.max_retries + 1):
+            retryable = attempt < self.max_retries
+            request = self.client.build_request("POST", self.url, json=payload, timeout=self._timeout(call_type))
+            try:
+                response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                # Both are raised before the request is written, so a retry can't duplicate it
+                if not retryable:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or not retryable:
+                    if response.is_error:
+                        await response.aclose()
+                    response.raise_for_status()
+                    return response
+                await response.aclose()
+            metrics.incr(f"ollama.{call_type}.retries")
+            await asyncio.sleep(_backoff(attempt))
+
+    async def chat(self, payload: dict, call_type: str = "chat") -> dict:
+        start = time.perf_counter()
+        try:
+            response = await self._send(payload, call_type, stream=False)
+            body = response.json()
+        except Exception:
+            _record(call_type, start, error=True)
+            raise
+        _record(call_type, start)
+        return body
+
+    async def stream(self, payload: dict, call_type: str = "chat_stream"):
+        start = time.perf_counter()
+        error = False
+        try:
+            response = await self._send(payload, call_type, stream=True)
+            try:
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    yield chunk
+                    if chunk.get("done"):
+                        break
+            finally:
+                await response.aclose()
+        except Exception:
+            error = True
+            raise
+        finally:
+            _record(call_type, start, error)
+
+
+client = OllamaClient()
+_async_client = None
+
+
+def get_async_client() -> AsyncOllamaClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOllamaClient()
+    return _async_client
@@ -0,0 +1,243 @@
+"""
+Opt-in live request profiling (PROFILING=1).
+
+A request is profiled when it is sampled (PROFILE_SAMPLE_RATE, a fraction),
+when its path starts with one of PROFILE_ROUTES, or when the client sends
+`X-Profile: 1`. Profiled requests record wall time, every SQL statement
+(count and time, grouped by statement) and a cProfile of the endpoint
+function. The slowest PROFILE_KEEP profiles are kept in memory and served by
+the /admin/profiles endpoints, including a .prof file for snakeviz/pstats.
+
+How it hangs together: ProfilingMiddleware decides whether to profile and
+puts a RequestProfile in a contextvar; SQLAlchemy cursor events and the
+endpoint wrapper installed by ProfilingRoute find it there (the contextvar
+follows sync endpoints into the threadpool). Only one cProfile runs at a
+time; requests that overlap it still get timings and SQL stats.
+
+With PROFILING unset none of this is installed and the request path is
+untouched.
+"""
+import cProfile
+import functools
+import heapq
+import inspect
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.datastructures import Headers
+
+ENABLED = os.environ.get("PROFILING", "0") == "1"
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.01"))
+ROUTES = [r.strip() for r in os.environ.get("PROFILE_ROUTES", "").split(",") if r.strip()]
+KEEP = int(os.environ.get("PROFILE_KEEP", "20"))
+TOP_FUNCTIONS = 30  # Rows in the text report
+MAX_STATEMENTS = 25  # Distinct SQL statements tracked per request
+
+_current = ContextVar("request_profile", default=None)
+_cprofile_lock = threading.Lock()  # Python 3.12+ allows only one active profiler
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, reason: str):
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.started_at = datetime.utcnow()
+        self.status = None
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = {}  # statement -> [count, seconds]
+        self.stats = None  # cProfile stats dict once the endpoint has run
+        self._lock = threading.Lock()
+
+    def record_sql(self, statement: str, seconds: float):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_time += seconds
+            entry = self.statements.get(statement)
+            if entry is None and len(self.statements) < MAX_STATEMENTS:
+                entry = self.statements[statement] = [0, 0.0]
+            if entry is not None:
+                entry[0] += 1
+                entry[1] += seconds
+
+    def summary(self, profile_id: int) -> dict:
+        return {
+            "id": profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 2),
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_time * 1000, 2),
+            "has_cprofile": self.stats is not None,
+        }
+
+    def report(self) -> str:
+        lines = [
+            f"{self.method} {self.path} -> {self.status} in {self.duration * 1000:.1f}ms ({self.reason})",
+            f"SQL: {self.sql_count} statements, {self.sql_time * 1000:.1f}ms",
+        ]
+        for statement, (count, seconds) in sorted(self.statements.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"  {count:>4}x {seconds * 1000:>8.2f}ms  {' '.join(statement.split())[:160]}")
+        if self.stats is not None:
+            out = io.StringIO()
+            stats = pstats.Stats(_StatsHolder(self.stats), stream=out)
+            stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            lines.append(out.getvalue())
+        return "\n".join(lines)
+
+
+class _StatsHolder:
+    # pstats.Stats accepts anything with create_stats() and a .stats dict
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class ProfileBuffer:
+    """Keeps the slowest `keep` profiles."""
+
+    def __init__(self, keep: int = KEEP):
+        self.keep = keep
+        self._heap = []  # (duration, id, profile): the fastest kept profile is evicted first
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.profiled = 0
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self.profiled += 1
+            item = (profile.duration, next(self._ids), profile)
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, item)
+            elif profile.duration > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def list(self):
+        with self._lock:
+            items = sorted(self._heap, key=lambda item: -item[0])
+        return [profile.summary(pid) for _, pid, profile in items]
+
+    def get(self, profile_id: int):
+        with self._lock:
+            for _, pid, profile in self._heap:
+                if pid == profile_id:
+                    return profile
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+
+
+profile_buffer = ProfileBuffer()
+
+
+def _should_profile(scope) -> str:
+    path = scope.get("path", "")
+    if path.startswith("/admin/profiles"):
+        return None
+    if Headers(scope=scope).get("x-profile") == "1":
+        return "header"
+    if any(path.startswith(route) for route in ROUTES):
+        return "route"
+    if SAMPLE_RATE and random.random() < SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, buffer: ProfileBuffer = profile_buffer):
+        self.app = app
+        self.buffer = buffer
+
+    async def __call__(self, scope, receive, send):
+        reason = _should_profile(scope) if scope["type"] == "http" else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], reason)
+        token = _current.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.duration = time.perf_counter() - start
+            _current.reset(token)
+            self.buffer.add(profile)
+
+
+def _profiled_call(profile, fn, args, kwargs):
+    if not _cprofile_lock.acquire(blocking=False):
+        return fn(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.create_stats()
+        profile.stats = profiler.stats
+        _cprofile_lock.release()
+
+
+def _wrap_endpoint(fn):
+    if inspect.iscoroutinefunction(fn):
+        # cProfile is per thread, and the event loop thread also runs every other request;
+        # async endpoints get timings and SQL stats only
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        return _profiled_call(profile, fn, args, kwargs)
+    return wrapper
+
+
+class ProfilingRoute(APIRoute):
+    """Route class that runs sync endpoints under cProfile when their request is being profiled."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _wrap_endpoint(endpoint), **kwargs)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current.get()
+        starts = conn.info.get("profile_start")
+        if profile is not None and starts:
+            profile.record_sql(statement, time.perf_counter() - starts.pop())
+
+
+def dump_stats(profile: RequestProfile) -> bytes:
+    """The cProfile stats in the .prof file format pstats/snakeviz read."""
+    return marshal.dumps(profile.stats)
@@ -0,0 +1,120 @@
+"""
+Progress history: a student's quiz attempts aggregated into buckets in SQL,
+so the response is at most max_points long however many attempts there are.
+
+Buckets are runs of consecutive attempts (by="attempt") or fixed time
+intervals (by="time"). bucket_size is in attempts or seconds; when it is not
+given, or would produce more than max_points buckets, it is widened to fit.
+Time buckets start on calendar boundaries (UTC): a size that is a whole
+number of minutes, hours, days or weeks is floored to the start of the
+largest of those it divides into, weeks starting on Monday.
+Time bucketing uses strftime("%s"), which only SQLite has.
+Each point carries its attempt count, accuracy and a rolling accuracy over the
+last `window` buckets (weighted by attempts, restarted at the start of the
+requested range).
+"""
+import calendar
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import Integer, cast, func, select
+
+from .models import Event
+
+MAX_POINTS = 200
+POINTS_LIMIT = 2000  # Ceiling on max_points, whatever the client asks for
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400}
+
+
+def _epoch(dt: datetime) -> int:
+    # Timestamps are naive UTC (datetime.utcnow)
+    return calendar.timegm(dt.utctimetuple())
+
+
+def _align(epoch: int, size: int) -> int:
+    """Floors epoch to the largest calendar unit that size is a whole number of."""
+    for unit in sorted(RESOLUTIONS.values(), reverse=True):
+        if size % unit == 0:
+            offset = 4 * 86400 if unit == RESOLUTIONS["week"] else 0  # 1970-01-05 was a Monday
+            return epoch - (epoch - offset) % unit
+    return epoch
+
+
+def progress_history(db, student_id: int, by: str = "attempt", topic_id: int = None,
+                     start: datetime = None, end: datetime = None, bucket_size: int = None,
+                     max_points: int = MAX_POINTS, window: int = 5) -> dict:
+    if by not in ("attempt", "time"):
+        raise ValueError("by must be 'attempt' or 'time'")
+    max_points = max(1, min(max_points, POINTS_LIMIT))
+    window = max(1, window)
+
+    conditions = [Event.student_id == student_id, Event.is_correct.isnot(None)]
+    if topic_id is not None:
+        conditions.append(Event.topic_id == topic_id)
+    if start is not None:
+        conditions.append(Event.timestamp >= start)
+    if end is not None:
+        conditions.append(Event.timestamp < end)
+
+    total, first_at, last_at = db.execute(
+        select(func.count(Event.id), func.min(Event.timestamp), func.max(Event.timestamp)).where(*conditions)
+    ).one()
+    result = {"student_id": student_id, "topic_id": topic_id, "by": by, "total_attempts": total, "points": []}
+    if not total:
+        result["bucket_size"] = bucket_size
+        return result
+
+    # 1. Bucket number for every attempt
+    if by == "attempt":
+        size = max(bucket_size or 1, math.ceil(total / max_points))
+        attempt_no = func.row_number().over(order_by=(Event.timestamp, Event.id)) - 1
+        bucket = attempt_no // size
+    else:
+        first = _epoch(start or first_at)
+        stop = _epoch(end) if end is not None else _epoch(last_at) + 1
+        size = max(bucket_size or 1, math.ceil((stop - first) / max_points))
+        while True:
+            base = _align(first, size)
+            # Flooring can add a partial bucket at the front; widen again if that's one too many
+            needed = math.ceil((stop - base) / max_points)
+            if needed <= size:
+                break
+            size = needed
+        bucket = (cast(func.strftime("%s", Event.timestamp), Integer) - base) // size
+    attempts = select(bucket.label("bucket"), Event.timestamp, cast(Event.is_correct, Integer).label("correct")).where(
+        *conditions
+    ).subquery()
+
+    # 2. Per-bucket totals
+    buckets = select(
+        attempts.c.bucket,
+        func.count().label("attempts"),
+        func.sum(attempts.c.correct).label("correct"),
+        func.min(attempts.c.timestamp).label("first_at"),
+        func.max(attempts.c.timestamp).label("last_at"),
+    ).group_by(attempts.c.bucket).subquery()
+
+    # 3. Rolling sums over the previous `window` buckets
+    frame = {"order_by": buckets.c.bucket, "rows": (-(window - 1), 0)}
+    rows = db.execute(select(
+        buckets,
+        func.sum(buckets.c.correct).over(**frame).label("rolling_correct"),
+        func.sum(buckets.c.attempts).over(**frame).label("rolling_attempts"),
+    ).order_by(buckets.c.bucket)).all()
+
+    for row in rows:
+        point = {
+            "bucket": row.bucket,
+            "attempts": row.attempts,
+            "accuracy": row.correct / row.attempts,
+            "rolling_accuracy": row.rolling_correct / row.rolling_attempts,
+            "first_at": row.first_at,
+            "last_at": row.last_at,
+        }
+        if by == "attempt":
+            point["first_attempt"] = row.bucket * size + 1
+        else:
+            point["bucket_start"] = datetime(1970, 1, 1) + timedelta(seconds=base + row.bucket * size)
+        result["points"].append(point)
+    result["bucket_size"] = size
+    return result
@@ -0,0 +1,94 @@
+"""
+Token-budgeted prompt assembly.
+
+Prompt length drives prefill time on CPU-only Ollama, so every variable part
+of a prompt goes through a PromptBuilder section with its own token budget.
+Items in a section are ranked by relevance and kept in that order while they
+fit; one that doesn't is skipped, and smaller, lower-ranked items can still
+fill the rest of the budget. A top item that alone exceeds the budget is cut
+to fit. Token counts are estimated (words and punctuation, which tracks
+phi3's tokenizer closely enough for budgeting) so no tokenizer has to be
+loaded.
+
+Budgets can be overridden with PROMPT_BUDGETS="notes=150,history=40".
+"""
+import os
+import re
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# section -> max tokens
+BUDGETS = {
+    "message": 300,
+    "weak_topics": 40,
+    "history": 60,
+    "recommendations": 80,
+    "notes": 250,
+    "subject": 30,
+    "focus_area": 40,
+}
+for _item in os.environ.get("PROMPT_BUDGETS", "").split(","):
+    if "=" in _item:
+        _name, _value = _item.split("=", 1)
+        BUDGETS[_name.strip()] = int(_value)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    if budget <= 0:
+        return ""
+    matches = list(_TOKEN_RE.finditer(text))
+    if len(matches) <= budget:
+        return text
+    return text[:matches[budget - 1].end()] + "…"
+
+
+def keyword_overlap(text: str, query_words: set) -> int:
+    return len(set(w.lower() for w in re.findall(r"\w+", text)) & query_words)
+
+
+def query_words(text: str) -> set:
+    # Short words ("is", "the") carry no relevance signal
+    return {w.lower() for w in re.findall(r"\w+", text) if len(w) > 3}
+
+
+class PromptBuilder:
+    def __init__(self, budgets: dict = None):
+        self.budgets = budgets or BUDGETS
+        self.report = {}
+
+    def section(self, name: str, items: list, scores: list = None) -> list:
+        """
+        Returns the items that fit in the section's budget, most relevant first.
+        Items are kept in their given order when no scores are passed; ties keep
+        their original order too.
+        """
+        budget = self.budgets.get(name, 100)
+        order = range(len(items))
+        if scores is not None:
+            order = sorted(order, key=lambda i: -scores[i])
+
+        kept, used = [], 0
+        for i in order:
+            cost = estimate_tokens(items[i])
+            if used + cost > budget:
+                if not kept:
+                    # Better a truncated top item than an empty section
+                    kept.append(truncate_to_tokens(items[i], budget))
+                    used = budget
+                continue
+            kept.append(items[i])
+            used += cost
+
+        self.report[name] = {"tokens": used, "kept": len(kept), "dropped": len(items) - len(kept)}
+        return kept
+
+    def text(self, name: str, text: str) -> str:
+        return self.section(name, [text])[0] if text else ""
+
+
+def payload_tokens(payload: dict) -> int:
+    return sum(estimate_tokens(m.get("content", "")) for m in payload.get("messages", []))
@@ -2,7 +2,18 @@ from sqlalchemy.orm import Session
 from .models import Student, Resource, StudentTopicState, DriftEvent, Topic
 from datetime import datetime, timedelta
 import random
+from .warmup import register_warmup
+from . import metrics
 
+@register_warmup("tfidf")
+def warm_tfidf():
+    # The first fit triggers sklearn/scipy's own lazy imports; pay for them before traffic arrives
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+    matrix = TfidfVectorizer().fit_transform(["warm up corpus", "warm up query"])
+    cosine_similarity(matrix[-1], matrix[:-1])
+
+@metrics.timed_function("recommendations")
 def get_recommendations(db: Session, student_id: int):
     # 1. Get student's weak topics (Mastery < 0.6)
     # 2. Check for recent drift events (last 24 hours)
@@ -0,0 +1,182 @@
+"""
+Offline BKT + drift simulation: no database, no server.
+
+SimulatedLearner is the one model of a simulated student used everywhere:
+here, by the load generator (scripts/simulate_events.py) and by the dataset
+generator (scripts/generate_dataset.py), so sweeps, load tests and generated
+data all describe the same students. A learner has a hidden knowledge state
+per topic: knowing it they answer correctly unless they slip, otherwise they
+guess, and after every attempt they may learn it. forget() is the injected
+drift: the topic is lost and relearned at `relearn` times the usual rate.
+
+simulate_batch() makes up response streams for a batch of virtual students
+and runs them through the same BKTTracker / DriftDetector pipeline as the quiz
+endpoint (including its mastery adaptation on drift). Learners are drawn from
+the `world` parameters; a drift_fraction of them forget the topic at a random
+point, which is the drift the detector should find. The tracker and detector
+use the `config` parameters, so tracker settings can differ from the world
+that produced the data.
+
+run_sweep() runs every config over the same students (batches share seeds
+across configs) on a process pool and reports, per config: detection rate and
+delay in attempts, false alarms per 1000 pre-drift attempts, and the mean
+absolute error of the mastery estimate against the true knowledge state.
+"""
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from .bkt import BKTTracker
+from .drift import DriftDetector
+
+# The world that generates responses
+DEFAULT_WORLD = {
+    "p_init": 0.3,
+    "p_learn": 0.1,
+    "p_guess": 0.2,
+    "p_slip": 0.1,
+    "drift_fraction": 0.5,  # Share of students who forget the topic
+    "drift_window": (0.3, 0.7),  # Onsets fall in this part of a student's attempts
+    "relearn": 0.2,  # Learning rate multiplier after forgetting
+}
+# What the tracker and detector are configured with
+DEFAULT_CONFIG = {"p_init": 0.3, "p_learn": 0.1, "p_guess": 0.2, "p_slip": 0.1, "delta": 0.002}
+
+
+def draw_ability(rng) -> float:
+    """A student's learning-rate multiplier."""
+    return rng.uniform(0.5, 1.5)
+
+
+class SimulatedLearner:
+    """One student's hidden knowledge of one topic."""
+
+    def __init__(self, rng, p_init, p_learn, p_guess, p_slip, ability=1.0, relearn=DEFAULT_WORLD["relearn"]):
+        self.rng = rng
+        self.learn = min(1.0, p_learn * ability)
+        self.p_guess = p_guess
+        self.p_slip = p_slip
+        self.relearn = relearn
+        self.knows = rng.random() < p_init
+        self.forgotten = False
+
+    def attempt(self, distracted: bool = False) -> bool:
+        """Answers one question; True if correct. A distracted student guesses and learns nothing."""
+        knows = self.knows and not distracted
+        correct = self.rng.random() < (1 - self.p_slip if knows else self.p_guess)
+        if not self.knows and not distracted and self.rng.random() < self.learn:
+            self.knows = True
+        return correct
+
+    def forget(self):
+        self.knows = False
+        if not self.forgotten:
+            self.learn *= self.relearn
+            self.forgotten = True
+
+
+def simulate_batch(config: dict, world: dict, students: int, attempts: int, seed: int) -> dict:
+    """Runs one batch of students; returns additive totals (see merge_stats)."""
+    rng = random.Random(seed)
+    tracker = BKTTracker(config["p_init"], config["p_learn"], config["p_guess"], config["p_slip"])
+    detector = DriftDetector(delta=config["delta"])
+    lo, hi = world["drift_window"]
+    stats = {"students": students, "attempts": 0, "drifting": 0, "delays": [], "false_alarms": 0,
+             "pre_drift_attempts": 0, "false_alarm_students": 0, "abs_error": 0.0,
+             "post_drift_abs_error": 0.0, "post_drift_attempts": 0}
+
+    for student in range(students):
+        onset = int(rng.uniform(lo, hi) * attempts) if rng.random() < world["drift_fraction"] else None
+        learner = SimulatedLearner(rng, world["p_init"], world["p_learn"], world["p_guess"], world["p_slip"],
+                                   ability=draw_ability(rng), relearn=world["relearn"])
+        mastery = config["p_init"]
+        detected_at = None
+        alarms = 0
+        for i in range(attempts):
+            if i == onset:
+                learner.forget()
+            correct = learner.attempt()
+
+            # Same steps as /events/submit_quiz
+            error = abs((1.0 if correct else 0.0) - tracker.predict_correctness(mastery))
+            mastery = tracker.update_mastery(mastery, correct)
+            if detector.update(student, 0, error):
+                mastery = (mastery + 0.5) / 2.0
+                if onset is not None and i >= onset:
+                    if detected_at is None:
+                        detected_at = i
+                else:
+                    alarms += 1
+
+            miss = abs(mastery - (1.0 if learner.knows else 0.0))
+            stats["abs_error"] += miss
+            if onset is not None and i >= onset:
+                stats["post_drift_abs_error"] += miss
+                stats["post_drift_attempts"] += 1
+            else:
+                stats["pre_drift_attempts"] += 1
+
+        stats["attempts"] += attempts
+        stats["false_alarms"] += alarms
+        stats["false_alarm_students"] += alarms > 0
+        if onset is not None:
+            stats["drifting"] += 1
+            stats["delays"].append(None if detected_at is None else detected_at - onset)
+        detector.detectors.pop((student, 0), None)  # Keep memory flat over the batch
+    return stats
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)] if ordered else None
+
+
+def merge_stats(parts) -> dict:
+    total = {}
+    for part in parts:
+        for key, value in part.items():
+            total[key] = total.get(key, 0 if key != "delays" else []) + value
+    delays = [d for d in total["delays"] if d is not None]
+    return {
+        "students": total["students"],
+        "attempts": total["attempts"],
+        "drifting_students": total["drifting"],
+        "detection_rate": len(delays) / total["drifting"] if total["drifting"] else None,
+        "delay_median": _percentile(delays, 50),
+        "delay_p95": _percentile(delays, 95),
+        "false_alarms_per_1k": 1000 * total["false_alarms"] / total["pre_drift_attempts"] if total["pre_drift_attempts"] else 0.0,
+        "false_alarm_students": total["false_alarm_students"] / total["students"],
+        "mastery_mae": total["abs_error"] / total["attempts"],
+        "mastery_mae_after_drift": (total["post_drift_abs_error"] / total["post_drift_attempts"]
+                                    if total["post_drift_attempts"] else None),
+    }
+
+
+def _run_job(job):
+    index, config, world, students, attempts, seed = job
+    return index, simulate_batch(config, world, students, attempts, seed)
+
+
+def run_sweep(configs, world=None, students: int = 1000, attempts: int = 200, batch_size: int = 100,
+              workers: int = None, seed: int = 0) -> list:
+    """
+    Simulates `students` students for every config. Returns one summary per
+    config (in order): the config and its merged stats.
+    """
+    world = {**DEFAULT_WORLD, **(world or {})}
+    configs = [{**DEFAULT_CONFIG, **c} for c in configs]
+    batches = [(b, min(batch_size, students - b * batch_size)) for b in range((students + batch_size - 1) // batch_size)]
+    # Batch b has the same seed under every config, so configs are compared on the same students
+    jobs = [(i, config, world, n, attempts, seed * 1_000_003 + b) for i, config in enumerate(configs) for b, n in batches]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [_run_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+
+    parts = [[] for _ in configs]
+    for index, stats in results:
+        parts[index].append(stats)
+    return [{"config": config, **merge_stats(p)} for config, p in zip(configs, parts)]
@@ -1,7 +1,36 @@
 import unittest
+import json
+import time
+from unittest import mock
 import requests
 from backend.bkt import BKTTracker
-from backend.drift import DriftDetector
+from backend.drift import DriftDetector, SharedDriftDetector
+from backend import chat_ollama
+from backend.llm_cache import LLMCache, cache_key
+from backend.llm_scheduler import LLMScheduler, SchedulerBusy, Waiter
+from backend.prompt_builder import PromptBuilder, estimate_tokens
+from backend.auth import create_session_token, verify_session_token
+
+def _drift_error_stream(key_index, n=160):
+    # Low error, then a sudden jump halfway: ADWIN should fire shortly after the change
+    import random
+    rng = random.Random(key_index)
+    return [(0.1 if i < n // 2 else 0.8) + rng.uniform(-0.05, 0.05) for i in range(n)]
+
+def _shared_drift_worker(path, rank, workers, keys):
+    """Applies every `workers`-th update, waiting for its turn on each key so per-key order is kept."""
+    detector = SharedDriftDetector(path)
+    results = []
+    for k, (student_id, topic_id) in enumerate(keys):
+        for seq, error in enumerate(_drift_error_stream(k)):
+            if seq % workers != rank:
+                continue
+            while detector.version(student_id, topic_id) != seq:
+                time.sleep(0.0005)
+            if detector.update(student_id, topic_id, error):
+                results.append((student_id, topic_id, seq))
+    return results
+
 
 class TestCoreModules(unittest.TestCase):
 
@@ -35,5 +64,653 @@ class TestCoreModules(unittest.TestCase):
         # We rely on 'river' library correctness, just checking if function runs without error
         self.assertIsNotNone(drift_detected)
 
+    def test_parallel_assessment_ids_and_partial_results(self):
+        def fake_stream(payload, call_type, timeout=None):
+            prompt = payload['messages'][0]['content']
+            if "Slow Batch" in prompt:
+                time.sleep(2)
+            questions = [{"text": f"Question number {i}?", "options": ["Alpha", "Beta", "Gamma", "Delta"], "correct_index": 1}
+                         for i in range(15)]  # model over-delivers; must be capped per batch
+            content = json.dumps({"questions": questions})
+            for i in range(0, len(content), 7):
+                yield {"message": {"content": content[i:i + 7]}, "done": False}
+            yield {"done": True}
+
+        with mock.patch.object(chat_ollama.client, "stream", side_effect=fake_stream):
+            quiz = chat_ollama.generate_assessment_quiz("Math", batches=["A", "B", "C"], questions_per_batch=12, use_cache=False)
+            ids = [q['id'] for q in quiz['questions']]
+            self.assertEqual(len(ids), 36)
+            self.assertEqual(len(set(ids)), 36, "Batches must never produce duplicate IDs")
+            self.assertEqual(ids, sorted(ids))
+            self.assertFalse(quiz['partial'])
+
+            start = time.monotonic()
+            quiz = chat_ollama.generate_assessment_quiz("Math", batches=["Fast", "Slow Batch"], deadline=0.5, use_cache=False)
+            self.assertLess(time.monotonic() - start, 1.5)
+            self.assertTrue(quiz['partial'])
+            self.assertEqual(quiz['batches_completed'], 1)
+
+    def test_streamed_generation_coalesces_and_respects_cancel(self):
+        import threading
+        from backend import llm_cache
+        calls = []
+
+        def fake_stream(payload, call_type, timeout=None):
+            calls.append(1)
+            questions = [{"text": f"Question number {i}?", "options": ["Alpha", "Beta", "Gamma", "Delta"], "correct_index": 1}
+                         for i in range(12)]
+            content = json.dumps({"questions": questions})
+            for i in range(0, len(content), 50):
+                time.sleep(0.005)
+                yield {"message": {"content": content[i:i + 50]}, "done": False}
+            yield {"done": True}
+
+        scheduler = LLMScheduler(max_concurrent=1)
+        with mock.patch.object(chat_ollama.client, "stream", side_effect=fake_stream), \
+                mock.patch.object(chat_ollama, "llm_scheduler", scheduler), \
+                mock.patch.object(llm_cache, "CACHE_ENABLED", False):
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(chat_ollama.generate_sub_quiz("Math", "Basics", 1)))
+                       for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(len(calls), 1, "Identical in-flight generations share one stream")
+            self.assertEqual([len(r["questions"]) for r in results], [12] * 3)
+            self.assertEqual(scheduler.stats()["active"], 0)
+
+            # A batch whose deadline passes while it queues leaves the queue and never sends its request
+            scheduler.acquire("generate")
+            cancel = Waiter()
+            got = []
+            t = threading.Thread(target=lambda: got.extend(chat_ollama.iter_sub_quiz("Math", "Other", 1, cancel=cancel)))
+            t.start()
+            time.sleep(0.05)
+            scheduler.cancel(cancel)
+            t.join(1)
+            self.assertEqual((got, len(calls), scheduler.stats()["queued"]), ([], 1, 0))
+            scheduler.release()
+
+    def test_assessment_batches_share_scheduler_slots(self):
+        import threading
+
+        def fake_stream(payload, call_type, timeout=None):
+            questions = [{"text": f"Question number {i}?", "options": ["Alpha", "Beta", "Gamma", "Delta"], "correct_index": 1}
+                         for i in range(4)]
+            content = json.dumps({"questions": questions})
+            cut = content.index("}, {") + 3  # The first question, complete
+            time.sleep(0.05)
+            yield {"message": {"content": content[:cut]}, "done": False}
+            time.sleep(0.2)  # Still holding the slot
+            yield {"message": {"content": content[cut:]}, "done": True}
+
+        scheduler = LLMScheduler(max_concurrent=1)
+        with mock.patch.object(chat_ollama.client, "stream", side_effect=fake_stream) as stream, \
+                mock.patch.object(chat_ollama, "llm_scheduler", scheduler):
+            # Queued behind other work for longer than the deadline: the clock starts with the batches
+            scheduler.acquire("generate")
+            threading.Timer(0.8, scheduler.release).start()
+            quiz = chat_ollama.generate_assessment_quiz("Math", batches=["A", "B"], questions_per_batch=4, deadline=0.7, use_cache=False)
+            self.assertEqual((len(quiz["questions"]), quiz["partial"]), (8, False))
+            self.assertEqual(stream.call_count, 2)
+
+            # A client leaving after the first question cancels the batch still queued for the slot
+            generator = chat_ollama.stream_assessment_quiz("Math", batches=["C", "D"], questions_per_batch=4, use_cache=False)
+            self.assertEqual(next(generator)[0], "question")
+            generator.close()
+            time.sleep(0.3)
+            self.assertEqual(stream.call_count, 3, "The cancelled batch never calls Ollama")
+            self.assertEqual(scheduler.stats(), {"active": 0, "queued": 0, "max_concurrent": 1})
+
+    def test_incremental_question_parser(self):
+        from backend.json_stream import QuestionStreamParser
+        good = {"text": "What does {x} mean in \"f-strings\"?", "options": ["A [list]", "Braces }", "Gamma", "Delta"], "correct_index": 5}
+        text = '```json\n{"questions": [' + json.dumps(good) + ', {"text": "broken", "options": [1,,]}, ' + json.dumps(good) + ']}\n```'
+        parser = QuestionStreamParser()
+        seen = []
+        for i in range(0, len(text), 3):  # arbitrary chunk boundaries
+            seen.extend(parser.feed(text[i:i + 3]))
+        self.assertEqual(len(seen), 2, "The malformed question is dropped, its neighbours survive")
+        self.assertEqual(parser.errors, 1)
+        self.assertEqual(seen[0]["options"][1], "Braces }")
+        self.assertEqual(chat_ollama.sanitize_question(seen[0])["correct_index"], 0)
+
+    def test_assessment_pool_refills_only_popular_subjects(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        from backend import assessment_pool as pool_module
+        from backend.assessment_pool import AssessmentPool
+        from backend.db import Base
+        from backend.models import AssessmentSet
+        engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        generated = []
+
+        def generator(subject):
+            generated.append(subject)
+            return {"questions": [{"id": i, "text": f"{subject} question {i}?"} for i in range(10)]}
+
+        pool = AssessmentPool(session_factory, generator=generator)
+        self.assertIsNone(pool.take("Pythn"))  # A typo, asked for once
+        pool.run_once()
+        self.assertEqual(generated, [], "One-off subjects are never pooled")
+
+        for _ in range(pool_module.DEMAND_THRESHOLD):
+            self.assertIsNone(pool.take("Python "))
+        self.assertEqual(pool.pending_refills(), 1)
+        pool.run_once()
+        self.assertEqual(generated, ["python"] * pool_module.POOL_TARGET)
+        served = pool.take("python")
+        self.assertEqual((len(served["questions"]), served["source"]), (10, "pool"))
+
+        # Sets rotate out, but nobody has asked for the subject lately: no more generations
+        with session_factory() as db:
+            db.query(AssessmentSet).filter(AssessmentSet.id <= 3).update({AssessmentSet.served_count: pool_module.MAX_SERVES_PER_SET})
+            db.commit()
+        later = time.time() + pool_module.DEMAND_WINDOW + 1
+        with mock.patch("backend.assessment_pool.time.time", return_value=later):
+            pool.run_once()
+        self.assertEqual(len(generated), pool_module.POOL_TARGET)
+        self.assertEqual(pool.fresh_counts(), {"python": 2})
+
+    def test_llm_cache_keys_ttl_and_eviction(self):
+        payload = {"model": "m", "format": "json", "messages": [{"role": "system", "content": "Score:  3/5\n  Go"}]}
+        same = {"model": "m", "format": "json", "messages": [{"role": "system", "content": "Score: 3/5 Go"}]}
+        self.assertEqual(cache_key(payload), cache_key(same))
+        self.assertNotEqual(cache_key(payload), cache_key(dict(payload, format=None)))
+
+        cache = LLMCache(path=":memory:", max_entries=10, memory_entries=2)
+        cache.put("k", "analyze", "value")
+        self.assertEqual(cache.get("k", "analyze"), "value")
+        cache.put("chat-key", "chat", "never stored")  # chat has no TTL -> opted out
+        self.assertIsNone(cache.get("chat-key", "chat"))
+
+        with mock.patch("backend.llm_cache.time.time", return_value=time.time() + 8 * 24 * 3600):
+            self.assertIsNone(cache.get("k", "analyze"), "Entry should expire after its TTL")
+
+        for i in range(12):
+            cache.put(f"key{i}", "generate", str(i))
+        self.assertLessEqual(cache.stats()["entries"], 10)
+        self.assertEqual(cache.get("key11", "generate"), "11")
+
+    def test_ollama_client_retries_only_unsent_requests(self):
+        import io
+        from http.client import RemoteDisconnected
+        from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+        from backend import ollama_client
+        from backend.ollama_client import OllamaClient
+
+        def response(status, body=None):
+            resp = requests.Response()
+            resp.status_code = status
+            resp._content = json.dumps(body or {}).encode()
+            resp.raw = io.BytesIO()
+            return resp
+
+        refused = requests.ConnectionError(MaxRetryError(None, "/api/chat", NewConnectionError(None, "Connection refused")))
+        dropped = requests.ConnectionError(ProtocolError("Connection aborted.", RemoteDisconnected("closed")))
+        client = OllamaClient(url="http://ollama.test/api/chat", max_retries=2)
+        sleeps = []
+        with mock.patch.object(ollama_client.time, "sleep", side_effect=sleeps.append):
+            client.session.post = mock.Mock(side_effect=[refused, response(503), response(200, {"message": {"content": "hi"}})])
+            self.assertEqual(client.chat({"model": "m"})["message"]["content"], "hi")
+            self.assertEqual(client.session.post.call_count, 3)
+            self.assertEqual(len(sleeps), 2)
+            for attempt, delay in enumerate(sleeps):
+                self.assertLessEqual(delay, ollama_client.BACKOFF_BASE * 2 ** attempt, "Backoff grows exponentially, with jitter")
+
+            # The request may have reached Ollama before the connection dropped: never send it again
+            client.session.post = mock.Mock(side_effect=[dropped, response(200)])
+            with self.assertRaises(requests.ConnectionError):
+                client.chat({"model": "m"})
+            self.assertEqual(client.session.post.call_count, 1)
+
+            client.session.post = mock.Mock(side_effect=[requests.ConnectTimeout(), response(503), response(503)])
+            with self.assertRaises(requests.HTTPError):
+                client.chat({"model": "m"})
+            self.assertEqual(client.session.post.call_count, 3, "Gives up after max_retries")
+
+    def test_scheduler_priority_backpressure_and_coalescing(self):
+        import threading
+        scheduler = LLMScheduler(max_concurrent=1)
+        order = []
+        scheduler.acquire("generate")  # occupy the only slot
+
+        def worker(call_type):
+            with scheduler.slot(call_type):
+                order.append(call_type)
+
+        threads = [threading.Thread(target=worker, args=(t,)) for t in ("generate", "analyze", "chat")]
+        for t in threads:
+            t.start()
+            time.sleep(0.05)  # make arrival order deterministic
+        self.assertEqual(scheduler.stats()["queued"], 3)
+        scheduler.release()
+        for t in threads:
+            t.join()
+        self.assertEqual(order, ["chat", "analyze", "generate"], "Interactive work must run first")
+
+        # Background work is rejected as soon as a couple of calls are queued
+        scheduler.acquire("generate")
+        blocked = [threading.Thread(target=worker, args=("chat",)) for _ in range(2)]
+        for t in blocked:
+            t.start()
+        time.sleep(0.05)
+        with self.assertRaises(SchedulerBusy):
+            scheduler.acquire("background")
+        scheduler.release()
+        for t in blocked:
+            t.join()
+
+        calls = []
+        def slow_call():
+            calls.append(1)
+            time.sleep(0.2)
+            return "answer"
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(scheduler.run("analyze", slow_call, coalesce_key="k")))
+                   for _ in range(4)]
+        for t in callers:
+            t.start()
+        for t in callers:
+            t.join()
+        self.assertEqual(results, ["answer"] * 4)
+        self.assertEqual(len(calls), 1, "Identical in-flight requests should share one call")
+
+    def test_scheduler_cancel_while_queued(self):
+        import asyncio
+        scheduler = LLMScheduler(max_concurrent=1)
+
+        async def scenario():
+            scheduler.acquire("generate")  # occupy the only slot
+            waiting = asyncio.create_task(scheduler.acquire_async("chat_stream"))
+            await asyncio.sleep(0.05)
+            self.assertEqual(scheduler.stats()["queued"], 1)
+            waiting.cancel()  # the client disconnected while queued
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            await asyncio.sleep(0.05)
+            self.assertEqual(scheduler.stats()["queued"], 0, "A cancelled waiter leaves the queue")
+            scheduler.release()
+            self.assertEqual(scheduler.stats()["active"], 0, "Nobody holds a slot once the holder releases")
+            await asyncio.wait_for(scheduler.acquire_async("chat_stream"), 1)
+            scheduler.release()
+
+            # Cancelled before the worker thread gets the lock, with a slot free
+            with scheduler._cond:
+                starting = asyncio.create_task(scheduler.acquire_async("chat"))
+                await asyncio.sleep(0.05)
+                starting.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await starting
+            await asyncio.sleep(0.05)
+            self.assertEqual((scheduler.stats()["active"], scheduler.stats()["queued"]), (0, 0),
+                             "The thread must not take a slot nobody will release")
+
+        asyncio.run(scenario())
+
+    def test_prompt_builder_budgets_and_relevance(self):
+        builder = PromptBuilder({"notes": 12, "message": 5})
+        notes = ["From Algebra Basics: solving linear equations", "From History: the french revolution", "From Python: pandas data frames"]
+        kept = builder.section("notes", notes, scores=[0, 0, 2])
+        self.assertEqual(kept[0], notes[2], "Most relevant item goes first")
+        self.assertLessEqual(sum(estimate_tokens(n) for n in kept), 12)
+        self.assertGreater(builder.report["notes"]["dropped"], 0)
+
+        # A large #2 item is skipped, but the small #3 still fits
+        small = PromptBuilder({"history": 10})
+        kept = small.section("history", ["one two three", "a b c d e f g h i j k l", "four five"])
+        self.assertEqual(kept, ["one two three", "four five"])
+        self.assertEqual(small.report["history"], {"tokens": 5, "kept": 2, "dropped": 1})
+
+        long_message = "please explain " * 50
+        self.assertLessEqual(estimate_tokens(builder.text("message", long_message)), 6)  # budget + ellipsis
+
+    def test_session_tokens(self):
+        token = create_session_token(7, "student")
+        claims = verify_session_token(token)
+        self.assertEqual((claims["sub"], claims["role"]), (7, "student"))
+
+        body, signature = token.split(".")
+        forged = create_session_token(8, "instructor").split(".")[0]
+        self.assertIsNone(verify_session_token(f"{forged}.{signature}"), "Claims can't be swapped under an old signature")
+        self.assertIsNone(verify_session_token(body))
+        self.assertIsNone(verify_session_token(create_session_token(7, "student", ttl=-1)), "Expired tokens are rejected")
+        self.assertIsNone(verify_session_token("abc.é"), "Non-ASCII signatures are rejected, not a TypeError")
+
+    def test_session_checks_on_endpoints(self):
+        import os
+        import tempfile
+        from fastapi.testclient import TestClient
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)  # main creates its SQLite file in the working directory on import
+            try:
+                from backend import main
+                client = TestClient(main.app)
+                student = {"Authorization": f"Bearer {create_session_token(1, 'student')}"}
+                question = {"topic_id": 1, "text": "2 + 2?", "options": ["3", "4"], "correct_index": 1, "difficulty": 0.1}
+
+                for token in ("abc.é", "forged.token", create_session_token(1, "student", ttl=-1)):
+                    resp = client.get("/students/1/dashboard", headers={"Authorization": f"Bearer {token}".encode()})
+                    self.assertEqual(resp.status_code, 401, f"{token!r} must not pass as anonymous")
+                self.assertEqual(client.get("/students/2/dashboard", headers=student).status_code, 403)
+                self.assertEqual(client.post("/questions", json=question, headers=student).status_code, 403)
+                self.assertEqual(client.post("/resources", json={"title": "t", "content": "c", "topic_id": 1, "difficulty": 0.5, "tags": ""},
+                                             headers=student).status_code, 403)
+                self.assertEqual(client.post("/questions", json=question).status_code, 403)
+            finally:
+                os.chdir(cwd)
+
+    def test_context_cache_patches_match_a_fresh_build(self):
+        from datetime import datetime, timedelta
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from backend.context_cache import ContextCache, PROFILE_TTL
+        from backend.db import Base
+        from backend.models import Student, Topic, Resource, StudentTopicState, Event, DriftEvent
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        db.add(Student(id=1, username="s1", name="S"))
+        db.add_all([Topic(id=1, name="Algebra"), Topic(id=2, name="Python")])
+        db.add_all([Resource(title=f"{name} level {d}", content=f"{name} notes at level {d}", topic_id=tid, difficulty=d, tags=name.lower())
+                    for tid, name in ((1, "Algebra"), (2, "Python")) for d in (0.2, 0.5, 0.8)])
+        db.add_all([StudentTopicState(student_id=1, topic_id=1, mastery_probability=0.8),
+                    StudentTopicState(student_id=1, topic_id=2, mastery_probability=0.5)])
+        t0 = datetime.utcnow() - timedelta(hours=1)
+        db.add_all([Event(student_id=1, topic_id=2, event_type="quiz_real", is_correct=i % 2 == 0, timestamp=t0 + timedelta(minutes=i))
+                    for i in range(6)])
+        db.commit()
+
+        cache = ContextCache()
+        before = cache.get_profile(db, 1)
+        self.assertEqual((before["weak_topics"], before["drift_status"]), (["Python"], "Stable"))
+
+        # A wrong Algebra answer drops it two bands and opens a drift window, as /events/submit_quiz writes it
+        db.query(StudentTopicState).filter_by(student_id=1, topic_id=1).update({StudentTopicState.mastery_probability: 0.3})
+        db.add(Event(student_id=1, topic_id=1, event_type="quiz_real", is_correct=False, timestamp=datetime.utcnow()))
+        db.add(DriftEvent(student_id=1, topic_id=1, metric_value=0.8))
+        db.commit()
+        cache.record_event(1, 1, "Algebra", False, 0.3)
+        cache.record_drift(1, 1)
+
+        patched = cache.get_profile(db, 1)
+        self.assertEqual(patched, ContextCache().get_profile(db, 1), "A patched profile matches one built from the database")
+        self.assertNotEqual(patched["recommendations"], before["recommendations"], "Recommendations follow the band change")
+        self.assertEqual(patched["weak_topics"][0], "Algebra")
+        self.assertTrue(patched["notes"][0].startswith("From Algebra"))
+
+        # Another worker's write isn't patched in, so it shows up once the TTL runs out
+        db.query(StudentTopicState).filter_by(student_id=1, topic_id=2).update({StudentTopicState.mastery_probability: 0.9})
+        db.commit()
+        self.assertEqual(cache.get_profile(db, 1), patched)
+        with mock.patch("backend.context_cache.time.monotonic", return_value=time.monotonic() + PROFILE_TTL + 1):
+            self.assertEqual(cache.get_profile(db, 1), ContextCache().get_profile(db, 1))
+            self.assertEqual(cache.get_profile(db, 1)["weak_topics"], ["Algebra"])
+
+    def test_fast_json_and_compression(self):
+        from datetime import datetime
+        from fastapi import FastAPI
+        from fastapi.responses import StreamingResponse
+        from fastapi.testclient import TestClient
+        from backend import fast_json
+        from backend.fast_json import FastJSONResponse, CompressionMiddleware
+
+        class FakeBrotli:
+            class Compressor:
+                def __init__(self, quality):
+                    self.data = b""
+
+                def process(self, body):
+                    self.data += body
+                    return b""
+
+                def flush(self):
+                    return b""
+
+                def finish(self):
+                    return b"br:" + self.data
+
+        rows = [{"id": i, "text": f"Question {i}", "at": datetime(2024, 1, 1)} for i in range(100)]
+        app = FastAPI()
+        app.add_middleware(CompressionMiddleware, minimum_size=500)
+        app.get("/big")(lambda: FastJSONResponse(rows))
+        app.get("/small")(lambda: FastJSONResponse({"ok": True}))
+        app.get("/ndjson")(lambda: StreamingResponse((f'{{"n": {i}}}\n' * 50 for i in range(3)), media_type="application/x-ndjson"))
+        app.get("/sse")(lambda: StreamingResponse(("data: x\n\n" * 100 for _ in range(3)), media_type="text/event-stream"))
+        app.get("/chunked")(lambda: StreamingResponse((b'"' + b"x" * 600 + b'",' for _ in range(3)), media_type="application/json"))
+        client = TestClient(app)
+
+        resp = client.get("/big", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["content-encoding"], "gzip")
+        self.assertEqual(resp.json()[5], {"id": 5, "text": "Question 5", "at": "2024-01-01T00:00:00"})
+        self.assertNotIn("content-encoding", client.get("/big", headers={"Accept-Encoding": "identity"}).headers)
+        self.assertNotIn("content-encoding", client.get("/small", headers={"Accept-Encoding": "gzip"}).headers)
+        resp = client.get("/chunked", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual((resp.headers["content-encoding"], resp.content), ("gzip", (b'"' + b"x" * 600 + b'",') * 3))
+
+        with mock.patch.object(fast_json, "brotli", FakeBrotli):
+            resp = client.get("/big", headers={"Accept-Encoding": "gzip, br"})
+            self.assertEqual(resp.headers["content-encoding"], "br")
+            self.assertEqual(resp.headers["vary"], "Accept-Encoding")
+            self.assertEqual(resp.content, b"br:" + fast_json.dumps(rows))
+
+            # Streams pass through uncompressed, so each chunk can be flushed as it is produced
+            for path, first_line in (("/ndjson", '{"n": 0}'), ("/sse", "data: x")):
+                with client.stream("GET", path, headers={"Accept-Encoding": "gzip, br"}) as resp:
+                    self.assertNotIn("content-encoding", resp.headers)
+                    self.assertEqual(next(resp.iter_lines()), first_line)
+
+    def test_catalog_etags(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from backend import catalog
+        from backend.db import Base
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        catalog.ensure_versions(db)
+        before = {name: catalog.etag(db, name) for name in catalog.CATALOGS}
+        catalog.ensure_versions(db)  # Idempotent: a worker starting up must not invalidate anything
+        self.assertEqual(before, {name: catalog.etag(db, name) for name in catalog.CATALOGS})
+
+        catalog.bump(db, "questions")
+        db.commit()
+        self.assertNotEqual(catalog.etag(db, "questions"), before["questions"])
+        self.assertEqual(catalog.etag(db, "topics"), before["topics"])
+
+        request = mock.Mock(headers={"If-None-Match": catalog.etag(db, "topics")})
+        self.assertEqual(catalog.conditional_response(request, db, "topics", lambda: []).status_code, 304)
+        request = mock.Mock(headers={"If-None-Match": before["questions"]})
+        resp = catalog.conditional_response(request, db, "questions", lambda: [{"id": 1}])
+        self.assertEqual((resp.status_code, resp.body), (200, b'[{"id":1}]'))
+
+    def test_progress_history_buckets(self):
+        from datetime import datetime, timedelta
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from backend.db import Base
+        from backend.models import Event
+        from backend.progress import progress_history
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        t0 = datetime(2024, 1, 1)
+        # 1000 attempts an hour apart: 25% correct for the first 600, then all correct
+        db.add_all([Event(student_id=1, topic_id=1, event_type="quiz_real", is_correct=i >= 600 or i % 4 == 0,
+                          timestamp=t0 + timedelta(hours=i)) for i in range(1000)])
+        db.add(Event(student_id=2, topic_id=1, event_type="quiz_real", is_correct=True, timestamp=t0))
+        db.commit()
+
+        history = progress_history(db, 1, max_points=10, window=2)
+        self.assertEqual((history["total_attempts"], history["bucket_size"], len(history["points"])), (1000, 100, 10))
+        self.assertEqual([p["accuracy"] for p in history["points"][:6]], [0.25] * 6)
+        self.assertEqual(history["points"][-1]["first_attempt"], 901)
+        self.assertEqual(history["points"][6]["rolling_accuracy"], (25 + 100) / 200)
+
+        by_day = progress_history(db, 1, by="time", bucket_size=86400, start=t0 + timedelta(days=10), end=t0 + timedelta(days=12))
+        self.assertEqual([(p["attempts"], p["accuracy"]) for p in by_day["points"]], [(24, 0.25), (24, 0.25)])
+        self.assertEqual(by_day["points"][1]["bucket_start"], t0 + timedelta(days=11))
+
+        # Named sizes start on calendar boundaries, not at the first attempt
+        from_noon = progress_history(db, 1, by="time", bucket_size=86400, start=t0 + timedelta(days=10, hours=12, minutes=30),
+                                     end=t0 + timedelta(days=12))
+        self.assertEqual([p["bucket_start"] for p in from_noon["points"]], [t0 + timedelta(days=10), t0 + timedelta(days=11)])
+        self.assertEqual([p["attempts"] for p in from_noon["points"]], [11, 24])
+        weekly = progress_history(db, 1, by="time", bucket_size=7 * 86400, start=t0 + timedelta(days=9, hours=5))
+        self.assertEqual(weekly["points"][0]["bucket_start"], t0 + timedelta(days=7), "Weeks start on Monday")
+
+        capped = progress_history(db, 1, by="time", bucket_size=60, max_points=7)
+        self.assertLessEqual(len(capped["points"]), 7, "A too-fine resolution is widened to fit max_points")
+        self.assertEqual(sum(p["attempts"] for p in capped["points"]), 1000)
+
+    def test_metrics_histograms_and_overhead(self):
+        from backend import metrics
+        for seconds in (0.0002, 0.003, 0.003, 2.0):
+            metrics.observe("test.stage", seconds)
+        metrics.incr("test.events", 3)
+        metrics.register_gauge("test_queue", lambda: {"active": 1, "queued": 4})
+        text = metrics.render_prometheus()
+        self.assertIn('test_stage_seconds_bucket{le="0.0005"} 1', text)
+        self.assertIn('test_stage_seconds_bucket{le="0.005"} 3', text)
+        self.assertIn('test_stage_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("test_events_total 3", text)
+        self.assertIn('test_queue{key="queued"} 4', text)
+        self.assertEqual(metrics.snapshot()["latency"]["test.stage"]["p50"], 0.005)
+
+        n = 20000
+        start = time.perf_counter()
+        for _ in range(n):
+            with metrics.timed("test.overhead"):
+                pass
+        per_stage = (time.perf_counter() - start) / n
+        self.assertLess(per_stage, 20e-6, f"Stage timer costs {per_stage * 1e6:.1f}us")
+
+    def test_profile_buffer_keeps_slowest(self):
+        from backend.profiling import ProfileBuffer, RequestProfile
+        buffer = ProfileBuffer(keep=3)
+        for ms in (5, 50, 1, 30, 80, 2):
+            profile = RequestProfile("GET", f"/r{ms}", "sampled")
+            profile.duration = ms / 1000
+            profile.record_sql("SELECT 1", 0.001)
+            buffer.add(profile)
+        kept = buffer.list()
+        self.assertEqual([p["path"] for p in kept], ["/r80", "/r50", "/r30"])
+        self.assertEqual(buffer.profiled, 6)
+        self.assertIn("1x", buffer.get(kept[0]["id"]).report())
+
+    def test_drift_hub_filters_dedupes_and_overflow(self):
+        import asyncio
+        import threading
+        from backend import drift_hub as hub_module
+        from backend.drift_hub import DriftHub
+
+        def event(i, student=1, topic=1):
+            return {"id": i, "student_id": student, "topic_id": topic}
+
+        async def scenario():
+            hub = DriftHub(session_factory=None)
+            algebra = hub.subscribe(topic_ids=[1])
+            student2 = hub.subscribe(student_ids=[2])
+            # Published from a worker thread, like the sync quiz endpoints do
+            t = threading.Thread(target=lambda: [hub.publish(e) for e in (event(1), event(2, student=2, topic=3), event(1))])
+            t.start()
+            t.join()
+            await asyncio.sleep(0.05)
+            got = [algebra.queue.get_nowait()["id"] for _ in range(algebra.queue.qsize())]
+            self.assertEqual(got, [1], "Duplicate ids are published once")
+            self.assertEqual(student2.queue.get_nowait()["id"], 2)
+
+            with mock.patch.object(hub_module, "QUEUE_SIZE", 2):
+                slow = hub.subscribe()
+            for i in range(10, 14):
+                hub.publish(event(i))
+            await asyncio.sleep(0.05)
+            self.assertTrue(slow.overflowed)
+            self.assertIsNone(slow.queue.get_nowait(), "An overflowing subscriber is told to reconnect")
+
+        asyncio.run(scenario())
+
+    def test_shared_drift_state_matches_single_process(self):
+        import multiprocessing
+        import os
+        import tempfile
+        keys = [(1, 1), (1, 2), (2, 1)]
+
+        expected = []
+        single = DriftDetector()
+        for k, (student_id, topic_id) in enumerate(keys):
+            for seq, error in enumerate(_drift_error_stream(k)):
+                if single.update(student_id, topic_id, error):
+                    expected.append((student_id, topic_id, seq))
+        self.assertTrue(expected, "The test streams must contain detectable drift")
+
+        for workers in (1, 3):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "drift_state.db")
+                SharedDriftDetector(path)  # Create the schema before the workers race to
+                with multiprocessing.get_context("spawn").Pool(workers) as pool:
+                    parts = pool.starmap(_shared_drift_worker, [(path, rank, workers, keys) for rank in range(workers)])
+                detected = sorted(hit for part in parts for hit in part)
+                self.assertEqual(detected, sorted(expected), f"{workers} worker(s) must detect exactly what one process does")
+
+    def test_submission_index_dedupes_and_expires(self):
+        import threading
+        from backend.idempotency import SubmissionIndex, AlreadyApplied
+        index = SubmissionIndex(window=60, max_keys=3)
+        applied = []
+        gate = threading.Event()
+
+        def apply():
+            gate.wait(1)
+            applied.append(1)
+            return {"new_mastery": 0.4}
+
+        # A retry that arrives while the original is running waits for it
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(index.run("1:a", apply, lambda: None))) for _ in range(3)]
+        for t in threads:
+            t.start()
+        gate.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(applied), 1)
+        self.assertEqual(sorted(r[1] for r in results), [False, True, True])
+        self.assertEqual(index.run("1:a", apply, lambda: None), ({"new_mastery": 0.4}, True))
+
+        # Not in memory: the stored result is used, and a key lost to another worker replays theirs
+        self.assertEqual(index.run("1:b", apply, lambda: {"stored": True}), ({"stored": True}, True))
+        stored = iter([None, {"other": True}])
+
+        def taken():
+            raise AlreadyApplied("1:c")
+        self.assertEqual(index.run("1:c", taken, lambda: next(stored)), ({"other": True}, True))
+        self.assertEqual(len(applied), 1)
+
+        # Bounded by size (oldest first) and by time
+        index.put("1:d", {})
+        self.assertEqual(len(index), 3)
+        self.assertIsNone(index.get("1:a"))
+        index.window = 0
+        index.put("1:e", {})
+        self.assertIsNone(index.get("1:e"))
+
+    def test_offline_simulation_sweep(self):
+        from backend.simulation import run_sweep
+        configs = [{"delta": 0.0001}, {"delta": 0.05}]
+        strict, eager = run_sweep(configs, students=60, attempts=200, batch_size=25, workers=1, seed=3)
+        self.assertEqual(strict["drifting_students"], eager["drifting_students"], "Configs see the same students")
+        self.assertEqual((strict["attempts"], strict["config"]["p_learn"]), (60 * 200, 0.1))
+        self.assertGreater(eager["detection_rate"], strict["detection_rate"])
+        self.assertGreaterEqual(eager["false_alarms_per_1k"], strict["false_alarms_per_1k"])
+        self.assertLess(eager["mastery_mae"], 0.5)
+        again = run_sweep(configs[:1], students=60, attempts=200, batch_size=25, workers=1, seed=3)[0]
+        self.assertEqual(again, strict, "Same seed, same result")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,129 @@
+"""
+Startup instrumentation and warm-up.
+
+Heavy libraries (river, scikit-learn, numpy) are imported lazily by the modules
+that use them, so importing the app is cheap. On startup `run_warmup` preloads
+them, runs the registered cache builders and only then marks the worker as
+ready. The /ready endpoint reports the result, so a rolling restart never sends
+traffic to a cold worker.
+
+Set PROFILE_IMPORTS=1 to also record the import cost of every module loaded
+while the app starts (similar to `python -X importtime`, but queryable).
+"""
+import builtins
+import importlib
+import os
+import sys
+import threading
+import time
+
+PROCESS_START = time.perf_counter()
+
+# Modules that are too slow to import on the request path
+HEAVY_MODULES = [
+    "numpy",
+    "river.drift",
+    "sklearn.feature_extraction.text",
+    "sklearn.metrics.pairwise",
+    "requests",
+    "httpx",
+]
+
+# module name -> seconds spent importing it (inclusive of its own imports)
+import_costs = {}
+
+# name -> seconds spent in each warm-up hook
+hook_costs = {}
+
+state = {
+    "ready": False,
+    "time_to_ready": None,
+    "errors": [],
+}
+
+_hooks = []
+_original_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        import_costs.setdefault(name, time.perf_counter() - start)
+
+
+def install_import_timer():
+    """Records the cost of every module imported from now on."""
+    builtins.__import__ = _timed_import
+
+
+def uninstall_import_timer():
+    if builtins.__import__ is _timed_import:
+        builtins.__import__ = _original_import
+
+
+def register_warmup(name: str):
+    """
+    Decorator registering a function to run before the worker reports ready.
+    Used by modules that own caches worth building ahead of the first request.
+    """
+    def decorator(fn):
+        _hooks.append((name, fn))
+        return fn
+    return decorator
+
+
+def preload_modules():
+    for name in HEAVY_MODULES:
+        if name in sys.modules:
+            import_costs.setdefault(name, 0.0)
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            state["errors"].append(f"import {name}: {e}")
+        import_costs.setdefault(name, time.perf_counter() - start)
+
+
+def run_warmup():
+    preload_modules()
+    for name, fn in _hooks:
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            # A failing cache builder should not keep the worker out of rotation;
+            # the cache will simply be built by the first request instead.
+            state["errors"].append(f"{name}: {e}")
+        hook_costs[name] = time.perf_counter() - start
+
+    uninstall_import_timer()
+    state["time_to_ready"] = time.perf_counter() - PROCESS_START
+    state["ready"] = True
+
+
+def start_warmup_thread():
+    """Warms up in the background so the liveness port is up while we load."""
+    thread = threading.Thread(target=run_warmup, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def readiness_report(top: int = 15):
+    slowest = sorted(import_costs.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    return {
+        "ready": state["ready"],
+        "time_to_ready": state["time_to_ready"],
+        "uptime": time.perf_counter() - PROCESS_START,
+        "import_costs": {name: round(cost, 4) for name, cost in slowest},
+        "warmup_hooks": {name: round(cost, 4) for name, cost in hook_costs.items()},
+        "errors": state["errors"],
+    }
+
+
+if os.environ.get("PROFILE_IMPORTS") == "1":
+    install_import_timer()
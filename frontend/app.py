@@ -1,10 +1,21 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import requests
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 import pandas as pd
 import altair as alt
 
 # --- CONFIG ---
 API_URL = "http://localhost:8000"
+CATALOG_TTL = 60  # Seconds topics/students/questions are served from cache before revalidating
+DASHBOARD_TTL = 15  # Seconds a dashboard is reused across reruns (cleared after a quiz answer)
+FETCH_TIMEOUT = 10  # Seconds each backend call of a page may take before its panel gives up
+LIVE_RETRIES = 3  # Failed live drift feed connections in a row before the watch is switched off
+DEBUG = os.environ.get("FRONTEND_DEBUG", "0") == "1"  # Show per-panel load times
 st.set_page_config(page_title="Drift-Aware Learning Platform", layout="wide", page_icon="🎓")
 
 # --- STYLING ---
@@ -50,11 +61,12 @@ if 'token' not in st.session_state:
 def login(username, password, role):
     endpoint = "/login/student" if role == "Student" else "/login/instructor"
     try:
-        resp = requests.post(f"{API_URL}{endpoint}", json={"username": username, "password": password})
+        resp = http().post(f"{API_URL}{endpoint}", json={"username": username, "password": password})
         if resp.status_code == 200:
             data = resp.json()
             st.session_state['user'] = data
             st.session_state['role'] = data['role']
+            st.session_state['token'] = data.get('token')
             st.rerun()
         else:
             st.error("Invalid credentials")
@@ -64,68 +76,209 @@ def login(username, password, role):
 def logout():
     st.session_state['user'] = None
     st.session_state['role'] = None
+    st.session_state['token'] = None
     st.rerun()
 
+def session_expired():
+    # The backend no longer accepts our token (expired, or it restarted with a new secret): sign in again
+    st.session_state['session_expired'] = True
+    logout()
+
+def check_session(resp):
+    """Sends the user back to the login screen if the backend rejected our session token."""
+    if resp is not None and resp.status_code == 401 and st.session_state.get('token'):
+        session_expired()
+    return resp
+
 # --- DATA FUNCTIONS ---
+@st.cache_resource
+def http():
+    # One keep-alive connection pool per app process, shared by every session and rerun
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def auth_headers():
+    # Session token from login; the backend checks it instead of re-running bcrypt
+    token = st.session_state.get('token')
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+@st.cache_data(ttl=DASHBOARD_TTL, show_spinner=False)
+def fetch_dashboard(student_id, token):
+    # Errors raise so they aren't cached
+    resp = http().get(f"{API_URL}/students/{student_id}/dashboard",
+                      headers={"Authorization": f"Bearer {token}"} if token else {}, timeout=FETCH_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
 def get_student_data(student_id):
     try:
-        resp = requests.get(f"{API_URL}/students/{student_id}/dashboard")
-        return resp.json() if resp.status_code == 200 else None
-    except: return None
+        return fetch_dashboard(student_id, st.session_state.get('token'))
+    except requests.HTTPError as e:
+        check_session(e.response)
+        return None
+    except Exception: return None
+
+@st.cache_data(ttl=DASHBOARD_TTL, show_spinner=False)
+def fetch_progress(student_id, token, max_points=100):
+    # Already bucketed and smoothed by the backend, however long the history is
+    resp = http().get(f"{API_URL}/students/{student_id}/progress", params={"max_points": max_points},
+                      headers={"Authorization": f"Bearer {token}"} if token else {}, timeout=FETCH_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+def get_progress_history(student_id):
+    try:
+        return fetch_progress(student_id, st.session_state.get('token'))
+    except requests.HTTPError as e:
+        check_session(e.response)
+        return None
+    except Exception: return None
+
+@st.cache_resource
+def catalog_cache():
+    # path -> (etag, body), shared by all sessions; entries are revalidated on every use
+    return {}
+
+@st.cache_data(ttl=CATALOG_TTL, show_spinner=False)
+def get_catalog(path):
+    # Catalogs are the same for everyone: cached per process for CATALOG_TTL, then revalidated by ETag
+    cache = catalog_cache()
+    cached = cache.get(path)
+    headers = {}
+    if cached:
+        headers["If-None-Match"] = cached[0]
+    resp = http().get(f"{API_URL}{path}", headers=headers, timeout=FETCH_TIMEOUT)
+    if resp.status_code == 304 and cached:
+        return cached[1]
+    resp.raise_for_status()  # Raise rather than cache an empty list
+    body = resp.json()
+    if resp.headers.get("ETag"):
+        cache[path] = (resp.headers["ETag"], body)
+    return body
 
 def get_all_topics():
     try:
-        resp = requests.get(f"{API_URL}/topics")
-        return resp.json() if resp.status_code == 200 else []
+        return get_catalog("/topics")
     except: return []
 
 def get_all_students():
     try:
-        resp = requests.get(f"{API_URL}/students")
-        return resp.json() if resp.status_code == 200 else []
+        return get_catalog("/students")
     except: return []
 
 def generate_quiz_question(topic_id, student_id):
     try:
-        resp = requests.get(f"{API_URL}/quiz/generate", params={"topic_id": topic_id, "student_id": student_id})
+        resp = check_session(http().get(f"{API_URL}/quiz/generate", params={"topic_id": topic_id, "student_id": student_id}, headers=auth_headers()))
         return resp.json() if resp.status_code == 200 else None
-    except: return None
-
-def submit_quiz_answer(student_id, question_id, selected_index):
-    try:
-        resp = requests.post(f"{API_URL}/events/submit_quiz", json={
-            "student_id": student_id,
-            "question_id": question_id,
-            "selected_index": selected_index
-        })
-        return resp.json() if resp.status_code == 200 else None
-    except: return None
+    except Exception: return None
+
+def submit_quiz_answer(student_id, question_id, selected_index, idempotency_key=None):
+    # With a key the backend applies the answer once, so a dropped connection is safe to retry
+    headers = {**auth_headers(), "Idempotency-Key": idempotency_key} if idempotency_key else auth_headers()
+    for attempt in range(3 if idempotency_key else 1):
+        try:
+            resp = http().post(f"{API_URL}/events/submit_quiz", json={
+                "student_id": student_id,
+                "question_id": question_id,
+                "selected_index": selected_index
+            }, headers=headers, timeout=10)
+            if check_session(resp).status_code != 200:
+                return None
+            fetch_dashboard.clear(student_id, st.session_state.get('token'))  # Mastery just changed
+            fetch_progress.clear(student_id, st.session_state.get('token'))
+            return resp.json()
+        except requests.exceptions.RequestException:
+            time.sleep(0.5 * (attempt + 1))
+    return None
 
 def create_question_api(topic_id, text, options, correct_index, difficulty):
     try:
-        resp = requests.post(f"{API_URL}/questions", json={
+        resp = http().post(f"{API_URL}/questions", json={
             "topic_id": topic_id,
             "text": text,
             "options": options,
             "correct_index": correct_index,
             "difficulty": difficulty
-        })
-        return True if resp.status_code == 200 else False
-    except: return False
+        }, headers=auth_headers())
+        if check_session(resp).status_code != 200:
+            return False
+        get_catalog.clear("/questions")  # Show the new question on the next rerun, not after the TTL
+        return True
+    except Exception: return False
+
+def stream_tutor_reply(student_id, message):
+    try:
+        with http().post(f"{API_URL}/chat/stream", json={"student_id": student_id, "message": message}, headers=auth_headers(), stream=True, timeout=(5, 120)) as resp:
+            if check_session(resp).status_code != 200:
+                yield "Sorry, I'm having trouble connecting to my brain."
+                return
+            for chunk in resp.iter_content(chunk_size=None, decode_unicode=True):
+                if chunk:
+                    yield chunk
+    except Exception as e:
+        yield f"Error: {e}"
 
 def get_all_questions():
     try:
-        resp = requests.get(f"{API_URL}/questions")
-        return resp.json() if resp.status_code == 200 else []
+        return get_catalog("/questions")
     except: return []
 
+def get_recent_drifts(token):
+    resp = http().get(f"{API_URL}/drifts/all", headers={"Authorization": f"Bearer {token}"} if token else {}, timeout=FETCH_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+# --- CONCURRENT PAGE LOADS ---
+@st.cache_resource
+def fetch_pool():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="page-fetch")
+
+def fetch_all(calls, timeout=FETCH_TIMEOUT):
+    """
+    Runs a page's independent backend calls ({panel: fn}) in parallel.
+    Returns {panel: (data, error, seconds)}; a failed or slow call only affects its own panel.
+    Loaders run off the script thread, so they must not read st.session_state.
+    """
+    ctx = get_script_run_ctx()
+
+    def timed_call(fn):
+        add_script_run_ctx(ctx=ctx)  # Lets cached loaders run without "missing ScriptRunContext" warnings
+        start = time.perf_counter()
+        try:
+            return fn(), None, time.perf_counter() - start
+        except Exception as e:
+            return None, e, time.perf_counter() - start
+
+    futures = {name: fetch_pool().submit(timed_call, fn) for name, fn in calls.items()}
+    wait(futures.values(), timeout=timeout)
+    return {
+        name: future.result() if future.done() else (None, TimeoutError(f"no response in {timeout}s"), timeout)
+        for name, future in futures.items()
+    }
+
+def panel_data(results, name, default):
+    """The panel's data, or `default` with a warning in place of the panel if its call failed."""
+    data, error, seconds = results[name]
+    if isinstance(error, requests.HTTPError):
+        check_session(error.response)
+    if error is not None:
+        st.warning(f"Couldn't load {name} ({type(error).__name__}); the rest of the page is unaffected.")
+    if st.session_state.get('debug_timings'):
+        st.caption(f"⏱ {name}: {seconds * 1000:.0f} ms")
+    return default if error is not None else data
+
 def register(username, password, name):
     try:
-        resp = requests.post(f"{API_URL}/register/student", json={"username": username, "password": password, "name": name})
+        resp = http().post(f"{API_URL}/register/student", json={"username": username, "password": password, "name": name})
         if resp.status_code == 200:
             data = resp.json()
             st.session_state['user'] = data
             st.session_state['role'] = data['role']
+            st.session_state['token'] = data.get('token')
+            get_catalog.clear("/students")
             st.success("Registration successful! Logging in...")
             st.rerun()
         else:
@@ -138,6 +291,8 @@ def register(username, password, name):
 if not st.session_state['user']:
     # LOGIN SCREEN
     st.title("🔐 Educational Portal Login")
+    if st.session_state.pop('session_expired', False):
+        st.warning("Your session has expired. Please sign in again.")
     
     tab_login, tab_register = st.tabs(["Login", "Register (New Student)"])
     
@@ -187,6 +342,7 @@ else:
         if page == "Dashboard":
             st.title("📊 My Learning Dashboard")
             data = get_student_data(student_id)
+            history = get_progress_history(student_id)
             if data:
                 # 1. Top Metrics
                 recent_drifts = data.get('drift_events', [])
@@ -225,7 +381,7 @@ else:
                     with c3:
                         st.markdown(f"""
                         <div class="metric-card">
-                            <div class="metric-value">{len(data.get('progress', []))}</div>
+                            <div class="metric-value">{history['total_attempts'] if history else len(data.get('progress', []))}</div>
                             <div class="metric-label">Quizzes Taken</div>
                         </div>
                         """, unsafe_allow_html=True)
@@ -254,21 +410,19 @@ else:
 
                 with col_right:
                     st.subheader("📈 Progress Over Time")
-                    progress_data = data.get('progress', [])
-                    if progress_data:
-                        prog_df = pd.DataFrame(progress_data)
-                        # Calculate rolling average for smoothness
-                        prog_df['rolling_avg'] = prog_df['score'].rolling(5, min_periods=1).mean()
+                    if history and history['points']:
+                        prog_df = pd.DataFrame(history['points'])
                         
                         line = alt.Chart(prog_df).mark_line(point=True, color='#00FF00').encode(
-                            x=alt.X('event', title='Quiz Attempt'),
-                            y=alt.Y('score', title='Score', scale=alt.Scale(domain=[0, 1])),
-                            tooltip=['event', 'score']
+                            x=alt.X('first_attempt', title='Quiz Attempt'),
+                            y=alt.Y('accuracy', title='Score', scale=alt.Scale(domain=[0, 1])),
+                            tooltip=['first_attempt', 'attempts', 'accuracy']
                         )
                         
+                        # Rolling accuracy comes from the backend, weighted by attempts per bucket
                         rolling = alt.Chart(prog_df).mark_line(color='white', strokeDash=[5, 5]).encode(
-                            x='event',
-                            y='rolling_avg'
+                            x='first_attempt',
+                            y='rolling_accuracy'
                         )
                         
                         st.altair_chart((line + rolling).properties(height=350), use_container_width=True)
@@ -290,6 +444,8 @@ else:
                 if q:
                     st.session_state['current_question'] = q
                     st.session_state['quiz_submitted'] = False
+                    # One key per question shown: repeated clicks and retries count as one answer
+                    st.session_state['submission_key'] = uuid.uuid4().hex
                 else:
                     st.warning("No questions found for this topic.")
             
@@ -302,7 +458,7 @@ else:
                 
                 if st.button("Submit Answer"):
                     sel_idx = q['options'].index(choice)
-                    res = submit_quiz_answer(student_id, q['id'], sel_idx)
+                    res = submit_quiz_answer(student_id, q['id'], sel_idx, st.session_state.get('submission_key'))
                     
                     if res:
                         if res['correct']:
@@ -333,17 +489,8 @@ else:
                     st.markdown(prompt)
 
                 with st.chat_message("assistant"):
-                    with st.spinner("Thinking..."):
-                        try:
-                            resp = requests.post(f"{API_URL}/chat", json={"student_id": student_id, "message": prompt})
-                            if resp.status_code == 200:
-                                reply = resp.json()['response']
-                            else:
-                                reply = "Sorry, I'm having trouble connecting to my brain."
-                        except Exception as e:
-                            reply = f"Error: {e}"
-                        
-                        st.markdown(reply)
+                    # Render tokens as they arrive instead of waiting for the full answer
+                    reply = st.write_stream(stream_tutor_reply(student_id, prompt))
                 
                 st.session_state.messages.append({"role": "assistant", "content": reply})
 
@@ -359,16 +506,38 @@ else:
             
             if st.button("Generate Assessment"):
                 if subject:
-                    with st.spinner(f"AI is designing a syllabus-wide exam for {subject}..."):
-                        try:
-                            resp = requests.post(f"{API_URL}/assessment/generate", json={"subject": subject})
-                            if resp.status_code == 200:
-                                st.session_state['assessment_quiz'] = resp.json()
-                                st.session_state['assessment_answers'] = {} # Reset answers
+                    # Questions arrive one by one as the model writes them
+                    progress = st.progress(0.0, text=f"AI is designing a syllabus-wide exam for {subject}...")
+                    questions, summary, error = [], {}, None
+                    try:
+                        with http().post(f"{API_URL}/assessment/generate/stream", json={"subject": subject}, headers=auth_headers(), stream=True, timeout=(5, 600)) as resp:
+                            if check_session(resp).status_code != 200:
+                                error = "Failed to generate assessment. Try again."
                             else:
-                                st.error("Failed to generate assessment. Try again.")
-                        except Exception as e:
-                            st.error(f"Error: {e}")
+                                for raw in resp.iter_lines():
+                                    if not raw:
+                                        continue
+                                    msg = json.loads(raw)
+                                    if msg["type"] == "question":
+                                        questions.append(msg["question"])
+                                        progress.progress(min(len(questions) / 24, 1.0), text=f"{len(questions)} questions ready...")
+                                    elif msg["type"] == "done":
+                                        summary = msg
+                                    else:
+                                        error = msg.get("detail", "Failed to generate assessment. Try again.")
+                    except Exception as e:
+                        error = f"Error: {e}"
+                    progress.empty()
+
+                    if questions:
+                        if summary.get('source') == "generated":
+                            questions.sort(key=lambda q: q.get('id', 0))  # Batch order, not arrival order
+                        st.session_state['assessment_quiz'] = {"questions": questions, **summary}
+                        st.session_state['assessment_answers'] = {} # Reset answers
+                        if summary.get('partial') or not summary:
+                            st.warning("Some question batches took too long and were skipped; the exam is shorter than usual.")
+                    else:
+                        st.error(error or "Failed to generate assessment. Try again.")
                 else:
                     st.warning("Please enter a subject.")
 
@@ -446,7 +615,7 @@ else:
                                     "total": res['total'],
                                     "incorrect_topics": res['incorrect_topics']
                                 }
-                                analysis_resp = requests.post(f"{API_URL}/assessment/analyze", json=payload)
+                                analysis_resp = check_session(http().post(f"{API_URL}/assessment/analyze", json=payload, headers=auth_headers()))
                                 if analysis_resp.status_code == 200:
                                     report = analysis_resp.json()
                                     
@@ -474,10 +643,12 @@ else:
     elif role == "instructor":
         st.sidebar.header("Admin Controls")
         page = st.sidebar.radio("Go to:", ["Student Overview", "Question Bank", "Drift Monitoring"])
+        st.sidebar.checkbox("Show load times", value=DEBUG, key='debug_timings')
         
         if page == "Student Overview":
             st.title("👨‍🏫 Student Analytics")
-            students = get_all_students()
+            loaded = fetch_all({"students": lambda: get_catalog("/students")})
+            students = panel_data(loaded, "students", [])
             df = pd.DataFrame(students)
             st.dataframe(df, use_container_width=True)
             
@@ -493,11 +664,16 @@ else:
 
         elif page == "Question Bank":
             st.title("📝 Question Management")
+            # Both tabs render on every run, so load their data together
+            loaded = fetch_all({
+                "questions": lambda: get_catalog("/questions"),
+                "topics": lambda: get_catalog("/topics"),
+            })
             
             tab_view, tab_add = st.tabs(["View Questions", "Add Question"])
             
             with tab_view:
-                qs = get_all_questions()
+                qs = panel_data(loaded, "questions", [])
                 if qs:
                     st.dataframe(pd.DataFrame(qs)[['id', 'text', 'topic_id', 'difficulty']], use_container_width=True)
                 else:
@@ -518,7 +694,7 @@ else:
                 correct = st.selectbox("Correct Option", ["Option 1", "Option 2", "Option 3", "Option 4"])
                 corr_idx = ["Option 1", "Option 2", "Option 3", "Option 4"].index(correct)
                 
-                topics = get_all_topics()
+                topics = panel_data(loaded, "topics", [])
                 t_map = {t['id']: t['name'] for t in topics}
                 tid = st.selectbox("Topic", list(t_map.keys()), format_func=lambda x: t_map[x])
                 
@@ -532,7 +708,75 @@ else:
 
         elif page == "Drift Monitoring":
             st.title("📉 System Drift Events")
-            # Reuse logic
-            resp = requests.get(f"{API_URL}/drifts/all")
-            if resp.status_code == 200:
-                st.dataframe(pd.DataFrame(resp.json()), use_container_width=True)
+            token = st.session_state.get('token')  # Loaders run off the script thread
+            loaded = fetch_all({
+                "drift events": lambda: get_recent_drifts(token),
+                "students": lambda: get_catalog("/students"),
+                "topics": lambda: get_catalog("/topics"),
+            })
+            drifts = panel_data(loaded, "drift events", None)
+            if drifts is not None:
+                st.dataframe(pd.DataFrame(drifts), use_container_width=True)
+
+            # Live alerts: the backend pushes drifts as they are detected (SSE), no polling
+            st.subheader("🔴 Live Drift Alerts")
+            students = panel_data(loaded, "students", [])
+            topics = panel_data(loaded, "topics", [])
+            f1, f2 = st.columns(2)
+            with f1:
+                watch_students = st.multiselect("Students", [s_['id'] for s_ in students],
+                                                format_func=lambda x: next((s_['name'] for s_ in students if s_['id'] == x), x))
+            with f2:
+                watch_topics = st.multiselect("Topics", [t['id'] for t in topics],
+                                              format_func=lambda x: next((t['name'] for t in topics if t['id'] == x), x))
+            if 'drift_alerts' not in st.session_state:
+                st.session_state['drift_alerts'] = []
+                st.session_state['drift_cursor'] = None
+                st.session_state['drift_failures'] = 0
+            stopped = st.session_state.pop('drift_watch_error', None)
+            if stopped:
+                st.session_state['drift_watch'] = False  # Before the toggle is drawn, so it shows as off
+                st.error(f"Live feed stopped after {LIVE_RETRIES} failed attempts: {stopped}")
+
+            if st.toggle("Watch live (1 minute at a time)", key='drift_watch'):
+                params = {}
+                if watch_students:
+                    params["student_ids"] = ",".join(map(str, watch_students))
+                if watch_topics:
+                    params["topic_ids"] = ",".join(map(str, watch_topics))
+                if st.session_state['drift_cursor'] is not None:
+                    params["cursor"] = st.session_state['drift_cursor']  # Resume where the last watch stopped
+                feed = st.empty()
+                feed.dataframe(pd.DataFrame(st.session_state['drift_alerts']), use_container_width=True)
+                try:
+                    with http().get(f"{API_URL}/drifts/stream", params=params, headers=auth_headers(), stream=True, timeout=(5, 20)) as stream:
+                        check_session(stream)
+                        stream.raise_for_status()
+                        deadline = time.time() + 60
+                        for line in stream.iter_lines(decode_unicode=True):
+                            if line.startswith(": cursor ") and st.session_state['drift_cursor'] is None:
+                                st.session_state['drift_cursor'] = int(line.split()[-1])
+                            elif line.startswith("data: "):
+                                alert = json.loads(line[len("data: "):])
+                                st.session_state['drift_cursor'] = alert['id']
+                                st.session_state['drift_alerts'].insert(0, alert)
+                                del st.session_state['drift_alerts'][50:]
+                                st.toast(f"Drift: {alert['student']} on {alert['topic']}", icon="⚠️")
+                                feed.dataframe(pd.DataFrame(st.session_state['drift_alerts']), use_container_width=True)
+                            if time.time() > deadline:
+                                break
+                        else:
+                            raise ConnectionError("the server closed the stream")
+                    st.session_state['drift_failures'] = 0
+                except Exception as e:
+                    failures = st.session_state['drift_failures'] = st.session_state['drift_failures'] + 1
+                    if failures >= LIVE_RETRIES:
+                        st.session_state['drift_failures'] = 0
+                        st.session_state['drift_watch_error'] = str(e)
+                    else:
+                        delay = 2 ** failures
+                        st.error(f"Live feed interrupted: {e}. Reconnecting in {delay}s...")
+                        time.sleep(delay)  # Backoff, so an unreachable backend isn't retried in a tight loop
+                st.rerun()
+            elif st.session_state['drift_alerts']:
+                st.dataframe(pd.DataFrame(st.session_state['drift_alerts']), use_container_width=True)
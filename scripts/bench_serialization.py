@@ -0,0 +1,101 @@
+"""
+Serialization and compression benchmark for the large read endpoints.
+
+Builds payloads shaped like /questions, /students and the dashboard's
+`progress` array, then compares FastAPI's default path (jsonable_encoder +
+stdlib json) with FastJSONResponse, and reports bytes on the wire raw, gzipped
+and brotli-compressed (if installed):
+
+    python scripts/bench_serialization.py --questions 2000 --students 500 --events 5000
+
+With --backend it also fetches the live endpoints with and without
+Accept-Encoding to show what actually crosses the network.
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from backend.fast_json import FastJSONResponse, GZIP_LEVEL, BROTLI_QUALITY, brotli, orjson
+
+
+def build_payloads(args, rng):
+    questions = [{
+        "id": i,
+        "topic_id": rng.randrange(1, 20),
+        "text": f"Question {i}: which statement about concept {rng.randrange(100)} is correct?",
+        "options": [f"Option {c} for question {i}" for c in "ABCD"],
+        "difficulty": round(rng.random(), 2),
+    } for i in range(args.questions)]
+    students = [{"id": i, "name": f"Student {i}", "username": f"student_{i}"} for i in range(args.students)]
+    start = datetime(2024, 1, 1)
+    progress = [{"event": i + 1, "score": float(rng.random() < 0.6), "time": start + timedelta(minutes=i)}
+                for i in range(args.events)]
+    return {"/questions": questions, "/students": students, "dashboard progress": {"progress": progress}}
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_local(args):
+    payloads = build_payloads(args, random.Random(args.seed))
+    print(f"orjson: {'yes' if orjson else 'no (stdlib fallback)'}   brotli: {'yes' if brotli else 'no'}\n")
+    print(f"{'payload':<20} {'default':>10} {'fast':>10} {'speedup':>8} {'raw':>10} {'gzip':>10} {'gzip ms':>8} {'br':>10} {'br ms':>7}")
+    for name, content in payloads.items():
+        default_s, body = timed(lambda: JSONResponse(jsonable_encoder(content)).body, args.repeat)
+        fast_s, fast_body = timed(lambda: FastJSONResponse(content).body, args.repeat)
+        gzip_s, gz = timed(lambda: gzip.compress(fast_body, GZIP_LEVEL), args.repeat)
+        if brotli is not None:
+            br_s, br = timed(lambda: brotli.compress(fast_body, quality=BROTLI_QUALITY), args.repeat)
+            br_cols = f"{len(br):>10,} {br_s * 1000:>7.1f}"
+        else:
+            br_cols = f"{'-':>10} {'-':>7}"
+        print(f"{name:<20} {default_s * 1000:>8.1f}ms {fast_s * 1000:>8.1f}ms {default_s / fast_s:>7.1f}x "
+              f"{len(body):>10,} {len(gz):>10,} {gzip_s * 1000:>8.1f} {br_cols}")
+
+
+def bench_backend(args):
+    import requests
+    print(f"\nLive endpoints at {args.backend}")
+    for path in ("/questions", "/students", "/topics"):
+        for encoding in ("identity", "gzip", "br"):
+            # stream=True so we can count the compressed bytes before requests decodes them
+            start = time.perf_counter()
+            with requests.get(args.backend + path, headers={"Accept-Encoding": encoding}, stream=True) as resp:
+                wire = len(resp.raw.read(decode_content=False))
+            elapsed = time.perf_counter() - start
+            print(f"  {path:<12} {encoding:<9} {resp.headers.get('content-encoding', 'identity'):<9} "
+                  f"{wire:>10,} bytes {elapsed * 1000:>7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5, help="Best of N timings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", help="Also measure a running backend, e.g. http://localhost:8000")
+    args = parser.parse_args()
+
+    bench_local(args)
+    if args.backend:
+        bench_backend(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Bulk synthetic dataset: a database that looks like a real semester.
+
+Rebuilds the schema (like seed_data.py) and fills it with --students students,
+--topics topics with questions and resources, and --events quiz attempts
+spread over --days days:
+
+    python scripts/generate_dataset.py --students 5000 --topics 20 --events 2000000 --seed 1
+
+Students have an ability and a lognormal share of the attempts. They study in
+sessions, mostly on the topic the course is at, and their answers come from
+backend.simulation.SimulatedLearner, the same student model the drift sweep
+and the load generator use, with each topic's guess/slip/learn defaults. A
+--drift-fraction of students hit a slump partway through the semester: for
+--slump-days they answer at guessing level on every topic and forget the one
+they were on, which they then relearn at --relearn times the usual rate.
+Mastery estimates, prediction errors and drift events are computed with the
+backend's own BKTTracker and ADWIN detectors, as the quiz endpoint would, so
+student_topic_states and drift_events match the event log.
+
+Rows go in with Core executemany in --chunk sized batches, one student's
+history at a time, so memory stays flat however many events are asked for.
+The same --seed gives the same database. Everyone's password is "student";
+the instructor is admin/admin.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from backend.db import Base, engine as default_engine
+from backend.models import Student, Instructor, Topic, Resource, Question, StudentTopicState, Event, DriftEvent
+from backend.bkt import BKTTracker
+from backend.drift import DriftDetector
+from backend.auth import get_password_hash
+from backend.simulation import DEFAULT_WORLD, SimulatedLearner, draw_ability
+from backend import catalog
+
+FIRST_NAMES = ["Alice", "Bob", "Chen", "Dana", "Elif", "Femi", "Grace", "Hiro", "Ines", "Jamal", "Kira", "Luca",
+               "Maya", "Nils", "Omar", "Priya", "Quinn", "Rosa", "Sami", "Tara", "Uma", "Victor", "Wen", "Yusuf"]
+LAST_NAMES = ["Adams", "Baker", "Costa", "Dubois", "Evans", "Fischer", "Garcia", "Haddad", "Ivanova", "Jensen",
+              "Kim", "Lopez", "Mensah", "Novak", "Okafor", "Patel", "Rossi", "Sato", "Tanaka", "Weber"]
+SUBJECTS = ["Algebra", "Geometry", "Statistics", "Calculus", "Data Science", "Python", "Databases", "Networks",
+            "History", "Biology", "Chemistry", "Physics", "Economics", "Writing", "Logic", "Probability"]
+
+
+class Inserter:
+    """Buffers rows per table and writes them with executemany, --chunk rows at a time."""
+
+    def __init__(self, engine, chunk):
+        self.engine = engine
+        self.chunk = chunk
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, table, row):
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.chunk:
+            self.flush(table)
+
+    def flush(self, table=None):
+        tables = [table] if table is not None else list(self.buffers)
+        for t in tables:
+            rows = self.buffers.get(t)
+            if not rows:
+                continue
+            with self.engine.begin() as conn:
+                conn.execute(t.insert(), rows)
+            self.counts[t.name] = self.counts.get(t.name, 0) + len(rows)
+            self.buffers[t] = []
+
+
+def attempt_counts(rng, students, events):
+    """
+    Attempts per student: one each, plus a lognormal share of the rest.
+    Totals exactly max(events, students), since nobody has zero attempts.
+    """
+    weights = [rng.lognormvariate(0, 0.8) for _ in range(students)]
+    spare = max(0, events - students)
+    scale = spare / sum(weights)
+    counts = [1 + int(w * scale) for w in weights]
+    # Each int() drops less than one attempt, so fewer than `students` are left to hand out
+    for i in rng.sample(range(students), students + spare - sum(counts)):
+        counts[i] += 1
+    return counts
+
+
+def session_times(rng, n, start, days):
+    """n attempt timestamps in study sessions across the semester, in order."""
+    sessions = max(1, round(n / rng.uniform(6, 15)))
+    starts = sorted(rng.uniform(0, days * 86400 - 3600) for _ in range(sessions))
+    per_session = [n // sessions + (1 if i < n % sessions else 0) for i in range(sessions)]
+    for offset, size in zip(starts, per_session):
+        t = offset
+        for _ in range(size):
+            yield start + timedelta(seconds=t)
+            t += rng.uniform(20, 120)
+
+
+def build_catalog(db, args, rng):
+    names = (SUBJECTS * (args.topics // len(SUBJECTS) + 1))[:args.topics]
+    topics = [Topic(name=name if i < len(SUBJECTS) else f"{name} {i // len(SUBJECTS) + 1}",
+                    default_p_init=round(rng.uniform(0.2, 0.5), 2), default_p_learn=round(rng.uniform(0.05, 0.2), 2),
+                    default_p_guess=round(rng.uniform(0.15, 0.25), 2), default_p_slip=round(rng.uniform(0.05, 0.15), 2))
+              for i, name in enumerate(names)]
+    db.add_all(topics)
+    db.commit()
+    return topics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--topics", type=int, default=12)
+    parser.add_argument("--questions-per-topic", type=int, default=40)
+    parser.add_argument("--resources-per-topic", type=int, default=5)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=120, help="Length of the semester")
+    parser.add_argument("--drift-fraction", type=float, default=0.1, help="Share of students who hit a slump")
+    parser.add_argument("--slump-days", type=float, default=21, help="How long a slump lasts")
+    parser.add_argument("--relearn", type=float, default=DEFAULT_WORLD["relearn"],
+                        help="Learning rate multiplier for a topic forgotten in a slump")
+    parser.add_argument("--chunk", type=int, default=10_000, help="Rows per executemany batch")
+    parser.add_argument("--no-drift-detection", action="store_true",
+                        help="Skip ADWIN (faster); drift_events stays empty")
+    parser.add_argument("--database", help="SQLAlchemy URL (default: the backend's database)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    engine = create_engine(args.database) if args.database else default_engine
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _bulk_load_pragmas(dbapi_conn, _):
+            # A crash means regenerating anyway, so skip the fsyncs
+            dbapi_conn.execute("PRAGMA synchronous=OFF")
+        engine.dispose()
+    db = sessionmaker(bind=engine)()
+    inserter = Inserter(engine, args.chunk)
+    start_wall = time.perf_counter()
+
+    # 1. Catalog: topics, resources, questions, users
+    topics = build_catalog(db, args, rng)
+    for topic in topics:
+        for j in range(args.resources_per_topic):
+            inserter.add(Resource.__table__, {
+                "title": f"{topic.name} {('Basics', 'Practice', 'Deep Dive', 'Review', 'Project')[j % 5]} {j // 5 + 1}",
+                "content": f"Study notes for {topic.name}, part {j + 1}.", "topic_id": topic.id,
+                "difficulty": round(rng.uniform(0.1, 0.9), 2), "tags": topic.name.lower()})
+        for j in range(args.questions_per_topic):
+            inserter.add(Question.__table__, {
+                "topic_id": topic.id, "text": f"{topic.name} question {j + 1}: which statement is correct?",
+                "options": [f"Statement {c}" for c in "ABCD"], "correct_index": rng.randrange(4),
+                "difficulty": round(rng.uniform(0.1, 0.9), 2)})
+    password_hash = get_password_hash("student")  # bcrypt once, shared by every generated student
+    for i in range(args.students):
+        inserter.add(Student.__table__, {
+            "username": f"student{i + 1}", "password_hash": password_hash,
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "created_at": datetime(2024, 1, 1) - timedelta(days=rng.randrange(30))})
+    inserter.add(Instructor.__table__, {"username": "admin", "password_hash": get_password_hash("admin"), "name": "Dr. Smith"})
+    inserter.flush()
+    question_ids = {}
+    for qid, tid in db.query(Question.id, Question.topic_id):
+        question_ids.setdefault(tid, []).append(qid)
+    student_ids = [sid for (sid,) in db.query(Student.id).order_by(Student.id)]
+    print(f"Catalog: {len(topics)} topics, {sum(map(len, question_ids.values()))} questions, "
+          f"{len(student_ids)} students in {time.perf_counter() - start_wall:.1f}s")
+
+    # 2. Event histories, one student at a time
+    semester_start = datetime(2024, 1, 8)
+    counts = attempt_counts(rng, len(student_ids), args.events)
+    drifting_students = set(rng.sample(student_ids, round(len(student_ids) * args.drift_fraction)))
+    events_start = time.perf_counter()
+    events_done = 0
+    drifts_injected = drifts_found = 0
+    for student_id, n in zip(student_ids, counts):
+        ability = draw_ability(rng)
+        slump = None
+        if student_id in drifting_students:
+            slump_start = rng.uniform(0.3, 0.8) * args.days * 86400
+            slump = (slump_start, slump_start + args.slump_days * 86400)
+            drifts_injected += 1
+        pairs = {}  # topic index -> [learner, mastery, tracker, last_at]
+        detector = None if args.no_drift_detection else DriftDetector()
+        for at in session_times(rng, n, semester_start, args.days):
+            elapsed = (at - semester_start).total_seconds()
+            # Mostly the topic the course is at, sometimes revision of an earlier one
+            current = min(len(topics) - 1, int(elapsed / (args.days * 86400) * len(topics)))
+            k = current if rng.random() < 0.7 else rng.randint(0, current)
+            topic = topics[k]
+            pair = pairs.get(k)
+            if pair is None:
+                tracker = BKTTracker(topic.default_p_init, topic.default_p_learn, topic.default_p_guess, topic.default_p_slip)
+                learner = SimulatedLearner(rng, topic.default_p_init, topic.default_p_learn, topic.default_p_guess,
+                                           topic.default_p_slip, ability=ability, relearn=args.relearn)
+                pair = pairs[k] = [learner, topic.default_p_init, tracker, at]
+            learner, mastery, tracker, _ = pair
+            in_slump = slump is not None and slump[0] <= elapsed < slump[1]
+            if in_slump and k == current:
+                learner.forget()  # Has to relearn the topic after the slump
+            correct = learner.attempt(distracted=in_slump)
+            error = abs((1.0 if correct else 0.0) - tracker.predict_correctness(mastery))
+            mastery = tracker.update_mastery(mastery, correct)
+            if detector is not None and detector.update(student_id, topic.id, error):
+                drifts_found += 1
+                inserter.add(DriftEvent.__table__, {
+                    "student_id": student_id, "topic_id": topic.id, "detected_at": at, "metric_value": error,
+                    "notes": "High prediction error detected. Adapting mastery."})
+                mastery = (mastery + 0.5) / 2.0
+            pair[1], pair[3] = mastery, at
+            inserter.add(Event.__table__, {
+                "student_id": student_id, "topic_id": topic.id, "resource_id": rng.choice(question_ids[topic.id]),
+                "event_type": "quiz_real", "is_correct": correct, "timestamp": at, "prediction_error": error})
+        for k, (_, mastery, tracker, last_at) in pairs.items():
+            inserter.add(StudentTopicState.__table__, {
+                "student_id": student_id, "topic_id": topics[k].id, "mastery_probability": mastery,
+                "p_init": tracker.p_init, "p_learn": tracker.p_learn, "p_guess": tracker.p_guess,
+                "p_slip": tracker.p_slip, "last_updated": last_at})
+        events_done += n
+        if events_done // 200_000 != (events_done - n) // 200_000:
+            elapsed = time.perf_counter() - events_start
+            print(f"  {events_done:>12,} events  {events_done / elapsed:>10,.0f} rows/s")
+    inserter.flush()
+
+    # 3. Fresh catalog versions, so clients holding ETags from the old data refetch
+    catalog.ensure_versions(db)
+    db.close()
+
+    elapsed = time.perf_counter() - events_start
+    total = time.perf_counter() - start_wall
+    print(f"\nEvents: {events_done:,} in {elapsed:.1f}s ({events_done / elapsed:,.0f} rows/s)")
+    print(f"Drift: {drifts_injected} students had a slump, {drifts_found} drift events detected")
+    print("Rows: " + ", ".join(f"{name} {count:,}" for name, count in inserter.counts.items()))
+    print(f"Total: {sum(inserter.counts.values()):,} rows in {total:.1f}s "
+          f"({sum(inserter.counts.values()) / total:,.0f} rows/s)")
+    if resource is not None:
+        print(f"Peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
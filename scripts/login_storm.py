@@ -0,0 +1,112 @@
+"""
+Login storm benchmark: many students logging in at once at the start of a class.
+
+Creates (or reuses) --users student accounts, then fires --logins logins with
+--concurrency in flight while a probe thread keeps calling a cheap endpoint,
+so you can see whether bcrypt work starves the rest of the API:
+
+    python3 -m uvicorn backend.main:app --workers 1
+    python scripts/login_storm.py --backend http://localhost:8000 --users 50 --logins 400 --concurrency 32
+
+Compare AUTH_HASH_WORKERS settings on the server to size the hashing pool.
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from percentiles import percentile
+
+PASSWORD = "storm-password"
+
+
+def ensure_users(session, args):
+    def register(i):
+        username = f"{args.prefix}{i}"
+        resp = session.post(f"{args.backend}/register/student",
+                            json={"username": username, "password": PASSWORD, "name": f"Storm Student {i}"})
+        # 400 means the account exists from an earlier run
+        if resp.status_code not in (200, 400):
+            raise RuntimeError(f"Could not register {username}: {resp.status_code} {resp.text}")
+        return username
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        return list(pool.map(register, range(args.users)))
+
+
+def probe(session, url, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            session.get(url, timeout=30)
+        except requests.RequestException:
+            pass
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.05)
+
+
+def probe_baseline(session, url, n=20):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        session.get(url, timeout=30)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--prefix", default="storm_user_")
+    parser.add_argument("--probe-path", default="/topics", help="Cheap endpoint timed during the storm")
+    args = parser.parse_args()
+
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=args.concurrency + 1))
+
+    print(f"Preparing {args.users} accounts...")
+    usernames = ensure_users(session, args)
+
+    probe_url = args.backend + args.probe_path
+    baseline = probe_baseline(session, probe_url)
+
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def login(i):
+        start = time.perf_counter()
+        resp = session.post(f"{args.backend}/login/student",
+                            json={"username": usernames[i % len(usernames)], "password": PASSWORD}, timeout=120)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if resp.status_code != 200 or not resp.json().get("token"):
+                failures.append(resp.status_code)
+
+    stop = threading.Event()
+    during = []
+    prober = threading.Thread(target=probe, args=(session, probe_url, stop, during), daemon=True)
+    prober.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(login, range(args.logins)))
+    wall = time.perf_counter() - started
+    stop.set()
+    prober.join()
+
+    print(f"{args.logins} logins in {wall:.1f}s with concurrency {args.concurrency} -> {args.logins / wall:.1f} logins/s")
+    print(f"login latency: p50 {percentile(latencies, 50):.3f}s  p95 {percentile(latencies, 95):.3f}s  "
+          f"p99 {percentile(latencies, 99):.3f}s  failures {len(failures)}")
+    print(f"{args.probe_path} latency idle:  p50 {percentile(baseline, 50) * 1000:.1f}ms  p95 {percentile(baseline, 95) * 1000:.1f}ms")
+    print(f"{args.probe_path} latency storm: p50 {percentile(during, 50) * 1000:.1f}ms  p95 {percentile(during, 95) * 1000:.1f}ms  (n={len(during)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Local stand-in for Ollama's /api/chat, plus a load generator for the LLM endpoints.
+
+Serve the mock (no model, no GPU needed):
+    python scripts/mock_ollama.py serve --port 11434 --latency 0.5 --token-rate 40 \
+        --malformed-rate 0.05 --failure-rate 0.02
+
+Point the backend at it and drive /chat, /assessment/generate and /assessment/analyze:
+    OLLAMA_URL=http://localhost:11434/api/chat python3 -m uvicorn backend.main:app
+    python scripts/mock_ollama.py loadtest --backend http://localhost:8000 --concurrency 16 --requests 200
+
+The mock understands `stream` (NDJSON token chunks at --token-rate) and
+`format: json` (quiz or analysis JSON depending on the system prompt).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from percentiles import percentile
+
+WORDS = (
+    "the variable function loop concept value model answer example data derivative "
+    "equation practice review topic matrix history pattern result step memory"
+).split()
+
+
+# --- MOCK SERVER ---
+
+def fake_quiz(prompt: str, rng: random.Random) -> str:
+    match = re.search(r"Create a (\d+)-question", prompt)
+    count = int(match.group(1)) if match else 12
+    questions = []
+    for i in range(count):
+        topic = rng.choice(WORDS).capitalize()
+        questions.append({
+            "text": f"Which statement about {topic} number {i + 1} is correct?",
+            "options": [f"{topic} option {chr(65 + j)}" for j in range(4)],
+            "correct_index": rng.randrange(4),
+            "topic": topic,
+        })
+    return json.dumps({"questions": questions})
+
+
+def fake_analysis(rng: random.Random) -> str:
+    return json.dumps({
+        "verdict": rng.choice(["Good", "Average", "Bad"]),
+        "feedback": "Solid fundamentals. Review the advanced material before the next exam.",
+        "study_plan": ["Loops: practise tracing small programs", "Functions: revisit scope rules"],
+        "mastered_topics": ["Variables"],
+    })
+
+
+def fake_text(rng: random.Random, n_tokens: int) -> list:
+    return [(" " if i else "") + rng.choice(WORDS) for i in range(n_tokens)]
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # argparse namespace, set in serve()
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        cfg = self.config
+        rng = random.Random()
+        if self.path != "/api/chat":
+            return self._send_json(404, {"error": "not found"})
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = " ".join(m.get("content", "") for m in body.get("messages", []))
+
+        # Time to first token
+        time.sleep(max(0.0, rng.gauss(cfg.latency, cfg.latency * 0.2)))
+
+        if rng.random() < cfg.failure_rate:
+            if rng.random() < 0.5:
+                return self._send_json(503, {"error": "injected failure"})
+            self.close_connection = True
+            return  # Drop the connection without a response
+
+        if body.get("format") == "json":
+            content = fake_quiz(prompt, rng) if "exam setter" in prompt else fake_analysis(rng)
+            if rng.random() < cfg.malformed_rate:
+                content = content[: rng.randrange(1, len(content))]  # Truncated mid-document
+            tokens = [content[i:i + 4] for i in range(0, len(content), 4)]  # ~4 chars per token
+        else:
+            tokens = fake_text(rng, cfg.reply_tokens)
+
+        if not body.get("stream", True):
+            time.sleep(len(tokens) / cfg.token_rate)
+            return self._send_json(200, {
+                "model": body.get("model"),
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "done": True,
+                "eval_count": len(tokens),
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            time.sleep(1.0 / cfg.token_rate)
+            chunk = {"model": body.get("model"), "message": {"role": "assistant", "content": token}, "done": False}
+            self._write_chunk((json.dumps(chunk) + "\n").encode())
+        self._write_chunk((json.dumps({"model": body.get("model"), "done": True, "eval_count": len(tokens)}) + "\n").encode())
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(args):
+    MockOllamaHandler.config = args
+    server = ThreadingHTTPServer((args.host, args.port), MockOllamaHandler)
+    server.daemon_threads = True
+    print(f"Mock Ollama on http://{args.host}:{args.port}/api/chat "
+          f"(latency={args.latency}s, {args.token_rate} tok/s, malformed={args.malformed_rate}, failures={args.failure_rate})")
+    server.serve_forever()
+
+
+# --- LOAD TEST ---
+
+def _request_for(endpoint: str, i: int, rng: random.Random, student_ids: list):
+    if endpoint == "chat":
+        return "/chat", {"student_id": rng.choice(student_ids), "message": f"Can you explain topic {i}?"}
+    if endpoint == "chat_stream":
+        return "/chat/stream", {"student_id": rng.choice(student_ids), "message": f"Can you explain topic {i}?"}
+    if endpoint == "generate":
+        # Custom batches bypass the assessment pool, unique subjects bypass the response cache
+        return "/assessment/generate", {"subject": f"Load Test Subject {i}", "batches": ["Fundamentals", "Advanced"]}
+    total = 20
+    score = rng.randint(0, total)
+    topics = rng.sample(WORDS, k=min(total - score, 5))
+    return "/assessment/analyze", {"subject": f"Load Test Subject {i}", "score": score, "total": total, "incorrect_topics": topics}
+
+
+def loadtest(args):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_maxsize=args.concurrency))
+    endpoints = args.endpoints.split(",")
+    rng = random.Random(args.seed)
+    jobs = [(endpoints[i % len(endpoints)], i) for i in range(args.requests)]
+    results = {e: {"latency": [], "ttfb": [], "errors": 0} for e in endpoints}
+    lock = threading.Lock()
+
+    def run(job):
+        endpoint, i = job
+        with lock:
+            path, payload = _request_for(endpoint, i, rng, args.student_ids)
+        start = time.perf_counter()
+        ttfb = None
+        ok = False
+        try:
+            with session.post(args.backend + path, json=payload, stream=True, timeout=args.timeout) as resp:
+                body = []
+                for chunk in resp.iter_content(chunk_size=None):
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - start
+                    body.append(chunk)
+                # The tutor endpoints report upstream failures inside a 200 reply
+                ok = resp.status_code == 200 and b"Error communicating" not in b"".join(body)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            stats = results[endpoint]
+            stats["latency"].append(elapsed)
+            if ttfb is not None:
+                stats["ttfb"].append(ttfb)
+            if not ok:
+                stats["errors"] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run, jobs))
+    wall = time.perf_counter() - started
+
+    print(f"{len(jobs)} requests in {wall:.1f}s with concurrency {args.concurrency} -> {len(jobs) / wall:.2f} req/s")
+    print(f"{'endpoint':<12} {'n':>5} {'err%':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'ttfb p50':>9}")
+    for endpoint, stats in results.items():
+        lat = stats["latency"]
+        n = len(lat)
+        print(f"{endpoint:<12} {n:>5} {100.0 * stats['errors'] / max(n, 1):>5.1f}% {n / wall:>7.2f} "
+              f"{percentile(lat, 50):>7.2f}s {percentile(lat, 95):>7.2f}s {percentile(lat, 99):>7.2f}s "
+              f"{percentile(stats['ttfb'], 50):>8.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    s = sub.add_parser("serve", help="Run the mock Ollama server")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=11434)
+    s.add_argument("--latency", type=float, default=0.3, help="Mean seconds before the first token")
+    s.add_argument("--token-rate", type=float, default=30.0, help="Tokens per second")
+    s.add_argument("--reply-tokens", type=int, default=120, help="Tokens in a tutor reply")
+    s.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of JSON replies truncated")
+    s.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests failing (503 or dropped)")
+
+    l = sub.add_parser("loadtest", help="Drive the backend's LLM endpoints")
+    l.add_argument("--backend", default="http://localhost:8000")
+    l.add_argument("--endpoints", default="chat,generate,analyze", help="Comma-separated: chat,chat_stream,generate,analyze")
+    l.add_argument("--requests", type=int, default=60)
+    l.add_argument("--concurrency", type=int, default=8)
+    l.add_argument("--timeout", type=float, default=600)
+    l.add_argument("--student-ids", type=lambda v: [int(x) for x in v.split(",")], default=[1, 2])
+    l.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        loadtest(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""Latency statistics shared by the load test scripts."""
+import math
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    k = max(0, math.ceil(p / 100.0 * len(ordered)) - 1)
+    return ordered[k]
@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from backend.db import SessionLocal, engine, Base
 from backend.models import Student, Instructor, Topic, Resource, Question
 from backend.auth import get_password_hash
+from backend import catalog
 
 def seed_data():
     # DROP ALL TABLES to apply new schema
@@ -64,6 +65,9 @@ def seed_data():
     
     db.add_all([s1, s2, i1])
     db.commit()
+
+    # Fresh catalog versions, so clients holding ETags from the old data refetch
+    catalog.ensure_versions(db)
     
     print("Seeding complete.")
     print("Users: student/student, student2/student")
@@ -1,58 +1,269 @@
-import requests
+"""
+Load generator: a class of simulated students working against a running backend.
+
+Each of --students students practises --topics topics. Their answers come
+from backend.simulation.SimulatedLearner, the student model the drift sweep
+and the dataset generator use: a hidden knowledge state learned BKT-style
+(guess/slip/learn). For a --drift-fraction of student/topic pairs the student
+forgets the topic at a scheduled moment and relearns it at --relearn times
+the usual rate: the injected concept drift. Requests
+arrive open-loop (Poisson, --rate per second, independent of how fast the
+server answers) and are a --mix of answer submissions, dashboard and progress
+loads and tutor chats:
+
+    python3 -m uvicorn backend.main:app
+    python scripts/simulate_events.py --students 500 --topics 5 --rate 200 --duration 60
+
+Reports throughput, error rate and p50/p95/p99 latency per endpoint, and for
+the injected drifts how many were detected and how late.
+
+Students are registered on first use (accounts named --prefix<i>) and reused
+on later runs. Pass --auth when the server runs with REQUIRE_SESSION=1.
+"""
+import argparse
+import asyncio
+import os
 import random
+import sys
 import time
+from collections import defaultdict
 
-API_URL = "http://localhost:8000"
-
-def simulate():
-    # Ensure student exists via seed or just use ID=1
-    student_id = 1
-    topic_id = 1 # Algebra
-    
-    print("Starting simulation for Student 1 on Topic 1...")
-    
-    # Phase 1: High Performance (20 events)
-    print("Phase 1: High Mastery (Success Rate 90%)")
-    for i in range(20):
-        is_correct = random.random() < 0.9
-        try:
-            resp = requests.post(f"{API_URL}/events/simulate", json={
-                "student_id": student_id,
-                "topic_id": topic_id,
-                "is_correct": is_correct
-            })
-            if resp.status_code != 200:
-                print(f"Error {resp.status_code}: {resp.text}")
-                continue
-                
-            data = resp.json()
-            print(f"Event {i+1}: Correct={is_correct} | Mastery={data['new_mastery']:.3f} | Drift={data['drift_status']}")
-        except Exception as e:
-            print(f"Connection failed: {e}")
-        time.sleep(0.1)
-
-    # Phase 2: Drift (Concept Drift - sudden drop in performance)
-    print("\nPhase 2: Concept Drift (Success Rate 20%) - Student forgets or gets distracted")
-    for i in range(20, 50):
-        is_correct = random.random() < 0.2
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from backend.simulation import DEFAULT_WORLD, SimulatedLearner, draw_ability
+from percentiles import percentile
+
+PASSWORD = "loadgen-password"
+CHAT_MESSAGES = [
+    "I don't understand my last mistake, can you explain?",
+    "What should I practise next?",
+    "Can you give me a hint for this topic?",
+]
+
+
+class Trajectory:
+    """One student on one topic: their answers, and when drift was injected and detected."""
+
+    def __init__(self, rng, ability=1.0, drift_at=None, relearn=DEFAULT_WORLD["relearn"]):
+        self.learner = SimulatedLearner(rng, DEFAULT_WORLD["p_init"], DEFAULT_WORLD["p_learn"],
+                                        DEFAULT_WORLD["p_guess"], DEFAULT_WORLD["p_slip"],
+                                        ability=ability, relearn=relearn)
+        self.drift_at = drift_at  # Seconds into the run; None = never drifts
+        self.attempts = 0
+        self.drift_attempt = None  # Attempt number at which the drift actually started
+        self.detected_attempt = None
+        self.detected_after = None  # Seconds from drift onset to detection
+        self.false_alarms = 0
+
+    def answer(self, elapsed) -> bool:
+        if self.drift_at is not None and elapsed >= self.drift_at and self.drift_attempt is None:
+            self.drift_attempt = self.attempts
+            self.learner.forget()
+        return self.learner.attempt()
+
+    def record(self, elapsed, drifted):
+        self.attempts += 1
+        if not drifted:
+            return
+        if self.drift_attempt is not None and self.detected_attempt is None:
+            self.detected_attempt = self.attempts
+            self.detected_after = elapsed - self.drift_at
+        elif self.drift_attempt is None:
+            self.false_alarms += 1
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies = defaultdict(list)  # endpoint -> seconds
+        self.errors = defaultdict(int)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+        self.lag = []  # How late each request was sent vs its scheduled arrival
+        self.shed = 0  # Arrivals skipped because --max-inflight requests were already running
+        self.students = []  # (student_id, token)
+        self.topics = []
+        self.trajectories = {}  # (student_id, topic_id) -> Trajectory
+        self.mix = self._parse_mix(args.mix)
+
+    @staticmethod
+    def _parse_mix(spec):
+        mix = {}
+        for part in spec.split(","):
+            name, weight = part.split("=")
+            mix[name.strip()] = float(weight)
+        unknown = set(mix) - {"submit", "dashboard", "progress", "chat"}
+        if unknown:
+            raise SystemExit(f"Unknown call types in --mix: {', '.join(sorted(unknown))}")
+        return mix
+
+    # --- Setup ---
+
+    async def setup(self, client):
+        topics = (await client.get("/topics")).json()
+        if len(topics) < self.args.topics:
+            raise SystemExit(f"Backend has {len(topics)} topics, --topics asks for {self.args.topics}; seed more first")
+        self.topics = [t["id"] for t in topics[:self.args.topics]]
+
+        existing = {s["username"]: s["id"] for s in (await client.get("/students")).json()}
+        new = sum(f"{self.args.prefix}{i}" not in existing for i in range(self.args.students))
+        sem = asyncio.Semaphore(16)
+
+        async def ensure(i):
+            username = f"{self.args.prefix}{i}"
+            async with sem:
+                if username in existing and not self.args.auth:
+                    return existing[username], None
+                path = "/login/student" if username in existing else "/register/student"
+                body = {"username": username, "password": PASSWORD, "name": f"Load Student {i}"}
+                resp = await client.post(path, json=body, timeout=60)
+                resp.raise_for_status()
+                data = resp.json()
+                return data["id"], data.get("token")
+
+        start = time.perf_counter()
+        self.students = await asyncio.gather(*(ensure(i) for i in range(self.args.students)))
+        print(f"{len(self.students)} students ready in {time.perf_counter() - start:.1f}s ({new} registered)")
+
+        # Drift onsets are spread over the --drift-window part of the run
+        lo, hi = self.args.drift_window
+        pairs = [(sid, tid) for sid, _ in self.students for tid in self.topics]
+        drifting = set(self.rng.sample(pairs, round(len(pairs) * self.args.drift_fraction)))
+        abilities = {sid: draw_ability(self.rng) for sid, _ in self.students}
+        for pair in pairs:
+            drift_at = self.rng.uniform(lo, hi) * self.args.duration if pair in drifting else None
+            self.trajectories[pair] = Trajectory(self.rng, abilities[pair[0]], drift_at, self.args.relearn)
+
+    # --- Calls ---
+
+    async def _call(self, client, endpoint, method, path, token, **kwargs):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        start = time.perf_counter()
         try:
-            resp = requests.post(f"{API_URL}/events/simulate", json={
-                "student_id": student_id,
-                "topic_id": topic_id,
-                "is_correct": is_correct
-            })
-            if resp.status_code != 200:
-                print(f"Error {resp.status_code}: {resp.text}")
-                continue
-
-            data = resp.json()
-            print(f"Event {i+1}: Correct={is_correct} | Mastery={data['new_mastery']:.3f} | Drift={data['drift_status']}")
-            if data['drift_status'] == "Drift Detected":
-                print("!!! DRIFT DETECTED - SYSTEM ADAPTING !!!")
-        except Exception as e:
-            print(f"Connection failed: {e}")
-        time.sleep(0.1)
+            resp = await client.request(method, path, headers=headers, **kwargs)
+        except httpx.HTTPError as e:
+            self.errors[endpoint] += 1
+            self.status_codes[endpoint][type(e).__name__] += 1
+            self.latencies[endpoint].append(time.perf_counter() - start)
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        self.status_codes[endpoint][resp.status_code] += 1
+        if resp.status_code != 200:
+            self.errors[endpoint] += 1
+            return None
+        return resp
+
+    async def submit(self, client, student_id, token, t0):
+        topic_id = self.rng.choice(self.topics)
+        trajectory = self.trajectories[(student_id, topic_id)]
+        elapsed = time.perf_counter() - t0
+        is_correct = trajectory.answer(elapsed)
+        resp = await self._call(client, "submit", "POST", "/events/simulate", token,
+                                json={"student_id": student_id, "topic_id": topic_id, "is_correct": is_correct})
+        if resp is not None:
+            trajectory.record(time.perf_counter() - t0, resp.json()["drift_status"] != "Stable")
+
+    async def dashboard(self, client, student_id, token, t0):
+        await self._call(client, "dashboard", "GET", f"/students/{student_id}/dashboard", token)
+
+    async def progress(self, client, student_id, token, t0):
+        await self._call(client, "progress", "GET", f"/students/{student_id}/progress", token)
+
+    async def chat(self, client, student_id, token, t0):
+        await self._call(client, "chat", "POST", "/chat", token, timeout=self.args.chat_timeout,
+                         json={"student_id": student_id, "message": self.rng.choice(CHAT_MESSAGES)})
+
+    # --- Run ---
+
+    async def run(self):
+        args = self.args
+        limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+        async with httpx.AsyncClient(base_url=args.backend, limits=limits, timeout=args.timeout) as client:
+            await self.setup(client)
+            names, weights = zip(*self.mix.items())
+            inflight = set()
+            t0 = time.perf_counter()
+            next_at = 0.0
+            print(f"Running {args.duration:.0f}s at {args.rate:g} req/s, mix {args.mix}...")
+            while next_at < args.duration:
+                delay = next_at - (time.perf_counter() - t0)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.lag.append(max(0.0, -delay))
+                if len(inflight) >= args.max_inflight:
+                    self.shed += 1
+                else:
+                    student_id, token = self.rng.choice(self.students)
+                    call = getattr(self, self.rng.choices(names, weights)[0])
+                    task = asyncio.create_task(call(client, student_id, token, t0))
+                    inflight.add(task)
+                    task.add_done_callback(inflight.discard)
+                next_at += self.rng.expovariate(args.rate)
+            if inflight:
+                await asyncio.wait(inflight)
+            self.elapsed = time.perf_counter() - t0
+
+    # --- Report ---
+
+    def report(self):
+        print(f"\n{'endpoint':<10} {'requests':>9} {'req/s':>8} {'errors':>7} {'err %':>6} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for endpoint in sorted(self.latencies):
+            values = self.latencies[endpoint]
+            errors = self.errors[endpoint]
+            print(f"{endpoint:<10} {len(values):>9} {len(values) / self.elapsed:>8.1f} {errors:>7} "
+                  f"{100 * errors / len(values):>5.1f}% {percentile(values, 50) * 1000:>8.1f} "
+                  f"{percentile(values, 95) * 1000:>8.1f} {percentile(values, 99) * 1000:>8.1f}")
+            failures = {code: n for code, n in self.status_codes[endpoint].items() if code != 200}
+            if failures:
+                print(f"{'':<10} failures: " + ", ".join(f"{code} x{n}" for code, n in failures.items()))
+        total = sum(len(v) for v in self.latencies.values())
+        print(f"\nTotal: {total} requests in {self.elapsed:.1f}s ({total / self.elapsed:.1f} req/s); "
+              f"send lag p99 {percentile(self.lag, 99) * 1000:.1f} ms; {self.shed} arrivals shed at --max-inflight")
+
+        injected = [t for t in self.trajectories.values() if t.drift_attempt is not None]
+        detected = [t for t in injected if t.detected_attempt is not None]
+        false_alarms = sum(t.false_alarms for t in self.trajectories.values())
+        print(f"\nDrift: {len(injected)} injected (of {sum(t.drift_at is not None for t in self.trajectories.values())} "
+              f"scheduled), {len(detected)} detected, {false_alarms} detections outside a drift phase")
+        if detected:
+            delays = [t.detected_attempt - t.drift_attempt for t in detected]
+            seconds = [t.detected_after for t in detected]
+            print(f"  delay: median {percentile(delays, 50)} attempts / {percentile(seconds, 50):.1f}s, "
+                  f"p95 {percentile(delays, 95)} attempts / {percentile(seconds, 95):.1f}s")
+        undetected = [t.attempts - t.drift_attempt for t in injected if t.detected_attempt is None]
+        if undetected:
+            print(f"  undetected pairs saw a median of {percentile(undetected, 50)} attempts after onset")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="http://localhost:8000")
+    parser.add_argument("--students", type=int, default=50)
+    parser.add_argument("--topics", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=50, help="Mean arrivals per second (Poisson)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--mix", default="submit=0.8,dashboard=0.12,progress=0.05,chat=0.03",
+                        help="Relative weights of submit, dashboard, progress and chat calls")
+    parser.add_argument("--drift-fraction", type=float, default=0.2, help="Share of student/topic pairs that drift")
+    parser.add_argument("--drift-window", type=float, nargs=2, default=(0.3, 0.6), metavar=("FROM", "TO"),
+                        help="Drift onsets fall in this fraction of the run")
+    parser.add_argument("--relearn", type=float, default=DEFAULT_WORLD["relearn"],
+                        help="Learning rate multiplier for a topic forgotten in a drift")
+    parser.add_argument("--max-inflight", type=int, default=256, help="Arrivals beyond this many open requests are shed")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--chat-timeout", type=float, default=120)
+    parser.add_argument("--prefix", default="loadgen_")
+    parser.add_argument("--auth", action="store_true", help="Log every student in and send session tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generator = LoadGenerator(args)
+    asyncio.run(generator.run())
+    generator.report()
+
 
 if __name__ == "__main__":
-    print("Make sure server is running on localhost:8000")
-    simulate()
+    main()